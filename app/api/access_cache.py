@@ -0,0 +1,212 @@
+import asyncio
+import logging
+import time
+from datetime import datetime
+from typing import NamedTuple, Optional
+
+from sqlalchemy.future import select
+
+from database import async_session
+from models.monitoring import Sensor, Door, KeyFob
+
+_logger = logging.getLogger(__name__)
+
+
+class KeyFobEntry(NamedTuple):
+    id: int
+    is_active: bool
+    valid_until: Optional[datetime]
+
+    def allows_entry(self, now=None):
+        if not self.is_active:
+            return False
+        if self.valid_until is None:
+            return True
+        # valid_until is stored in UTC (see create_sample_data)
+        return self.valid_until > (now or datetime.utcnow())
+
+
+class AccessCache:
+    """
+    In-memory copy of the data needed for door access decisions:
+    KeyFob.key -> (id, is_active, valid_until) and Sensor.id -> Door.access_code.
+
+    Loaded at startup and kept up to date by the HTTP endpoints that change
+    key fobs, doors and sensors. A miss falls back to the database and stores
+    the result, so the cache is never the only source of truth.
+
+    With several gunicorn workers each one has its own copy and only sees the
+    updates made through itself, so the whole index is also reloaded every
+    refresh_interval seconds to pick up changes from other workers or made
+    directly in the database.
+
+    Lookups that found nothing are remembered for negative_ttl seconds, so a
+    door being tried with an unknown card or a device on an unknown sensor
+    doesn't cost a query per message. put_keyfob / put_sensor forget them
+    right away, other workers see the new fob or sensor after the TTL.
+    """
+
+    def __init__(self, refresh_interval=300, negative_ttl=30, max_negative=10000):
+        self.refresh_interval = refresh_interval
+        self.negative_ttl = negative_ttl
+        self.max_negative = max_negative
+        self._task = None
+        self._keyfobs = {}
+        self._door_codes = {}
+        self._sensor_doors = {}
+        # Every sensor id, doors or not
+        self._sensors = set()
+        # ("keyfob", key) / ("sensor", id) / ("door_code", sensor id) -> time.monotonic() it expires
+        self._missing = {}
+        self.loaded = False
+        self.stats = {"hits": 0, "misses": 0, "negative_hits": 0, "reloads": 0}
+
+    async def load(self):
+        """
+        Replaces the whole index with what is in the database.
+        """
+        async with async_session() as session:
+            keyfobs = await session.execute(select(KeyFob.id, KeyFob.key, KeyFob.is_active, KeyFob.valid_until))
+            doors = await session.execute(select(Door.id, Door.access_code))
+            sensors = (await session.execute(select(Sensor.id, Sensor.door_id))).all()
+
+            self._keyfobs = {key: KeyFobEntry(id, bool(is_active), valid_until) for id, key, is_active, valid_until in keyfobs}
+            self._door_codes = {id: access_code for id, access_code in doors}
+            self._sensor_doors = {id: door_id for id, door_id in sensors}
+            self._sensors = {id for id, _ in sensors}
+            self._missing = {}
+
+        self.loaded = True
+        self.stats["reloads"] += 1
+        _logger.info(f"Access cache loaded: {len(self._keyfobs)} keyfobs, {len(self._sensor_doors)} sensors")
+
+    async def _refresh(self):
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            try:
+                await self.load()
+            except Exception:
+                _logger.exception("Access cache reload failed, keeping the current copy")
+
+    def start(self):
+        if self._task is None and self.refresh_interval:
+            self._task = asyncio.create_task(self._refresh())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    # ---------------------------------------------------------------- lookups
+
+    def _known_missing(self, name):
+        expires = self._missing.get(name)
+        if expires is None:
+            return False
+        if expires <= time.monotonic():
+            del self._missing[name]
+            return False
+        self.stats["negative_hits"] += 1
+        return True
+
+    def _remember_missing(self, name):
+        if not self.negative_ttl:
+            return
+        if len(self._missing) >= self.max_negative:
+            # Keys come from the devices, so this can't grow without bound
+            self._missing.clear()
+        self._missing[name] = time.monotonic() + self.negative_ttl
+
+    async def get_keyfob(self, key):
+        entry = self._keyfobs.get(key)
+        if entry is not None:
+            self.stats["hits"] += 1
+            return entry
+        if self._known_missing(("keyfob", key)):
+            return None
+
+        self.stats["misses"] += 1
+        async with async_session() as session:
+            result = await session.execute(select(KeyFob).where(KeyFob.key == key))
+            keyfob = result.scalars().first()
+        if keyfob is None:
+            self._remember_missing(("keyfob", key))
+            return None
+        return self.put_keyfob(keyfob)
+
+    async def get_access_code(self, sensor_id):
+        door_id = self._sensor_doors.get(sensor_id)
+        if door_id is not None and door_id in self._door_codes:
+            self.stats["hits"] += 1
+            return self._door_codes[door_id]
+        if self._known_missing(("door_code", sensor_id)):
+            return None
+
+        self.stats["misses"] += 1
+        async with async_session() as session:
+            result = await session.execute(
+                select(Door.id, Door.access_code).join(Sensor, Sensor.door_id == Door.id).where(Sensor.id == sensor_id)
+            )
+            row = result.first()
+        if row is None:
+            self._remember_missing(("door_code", sensor_id))
+            return None
+        self._sensor_doors[sensor_id] = row.id
+        self._door_codes[row.id] = row.access_code
+        return row.access_code
+
+    async def has_sensor(self, sensor_id):
+        if sensor_id in self._sensors:
+            self.stats["hits"] += 1
+            return True
+        if self._known_missing(("sensor", sensor_id)):
+            return False
+
+        self.stats["misses"] += 1
+        async with async_session() as session:
+            result = await session.execute(select(Sensor.id).where(Sensor.id == sensor_id))
+            found = result.first() is not None
+        if found:
+            self._sensors.add(sensor_id)
+        else:
+            self._remember_missing(("sensor", sensor_id))
+        return found
+
+    # ---------------------------------------------------------------- updates
+
+    def put_keyfob(self, keyfob: KeyFob):
+        # Drop the old key if the fob was re-keyed
+        self.invalidate_keyfob(keyfob.id)
+        entry = KeyFobEntry(keyfob.id, bool(keyfob.is_active), keyfob.valid_until)
+        self._keyfobs[keyfob.key] = entry
+        self._missing.pop(("keyfob", keyfob.key), None)
+        return entry
+
+    def invalidate_keyfob(self, keyfob_id):
+        for key, entry in list(self._keyfobs.items()):
+            if entry.id == keyfob_id:
+                del self._keyfobs[key]
+
+    def put_door(self, door: Door):
+        self._door_codes[door.id] = door.access_code
+
+    def put_sensor(self, sensor: Sensor):
+        self._sensors.add(sensor.id)
+        self._missing.pop(("sensor", sensor.id), None)
+        self._missing.pop(("door_code", sensor.id), None)
+        if sensor.door_id is None:
+            self._sensor_doors.pop(sensor.id, None)
+        else:
+            self._sensor_doors[sensor.id] = sensor.door_id
+
+    def snapshot(self):
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return {
+            **self.stats,
+            "hit_ratio": self.stats["hits"] / lookups if lookups else 0.0,
+            "loaded": self.loaded,
+            "keyfobs": len(self._keyfobs),
+            "sensors": len(self._sensor_doors),
+            "doors": len(self._door_codes),
+            "negative_entries": len(self._missing),
+        }
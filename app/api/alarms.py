@@ -0,0 +1,100 @@
+import logging
+from typing import NamedTuple
+
+_logger = logging.getLogger(__name__)
+
+
+class Threshold(NamedTuple):
+    min: float
+    max: float
+    hysteresis: float = 0
+
+
+class AlarmTransition(NamedTuple):
+    sensor_id: int
+    value_type_id: int
+    message: str
+    severity: str
+    raised: bool
+
+
+class AlarmEngine:
+    """
+    Per sensor alarm state for readings.
+
+    An alarm is raised once when a value leaves [min, max] and stays active
+    until the value is back inside [min + hysteresis, max - hysteresis].
+    evaluate() only returns something on those two transitions, so a sensor
+    sitting outside its range produces one alarm instead of one per message.
+    """
+
+    def __init__(self, thresholds, labels, sensor_thresholds=None):
+        # value_type_id -> Threshold
+        self.thresholds = thresholds
+        # value_type_id -> text used in the alarm messages
+        self.labels = labels
+        # (sensor_id, value_type_id) -> Threshold, overrides the global one
+        self.sensor_thresholds = sensor_thresholds or {}
+
+        # (sensor_id, value_type_id) -> "high" / "low" while an alarm is active
+        self._active = {}
+        self.stats = {"evaluated": 0, "raised": 0, "cleared": 0}
+
+    def threshold_for(self, sensor_id, value_type_id):
+        return self.sensor_thresholds.get((sensor_id, value_type_id)) or self.thresholds.get(value_type_id)
+
+    def evaluate(self, sensor_id, value_type_id, value):
+        threshold = self.threshold_for(sensor_id, value_type_id)
+        if threshold is None or value is None:
+            return None
+
+        self.stats["evaluated"] += 1
+        key = (sensor_id, value_type_id)
+        active = self._active.get(key)
+        label = self.labels.get(value_type_id, f"Value type {value_type_id}")
+
+        if active is None:
+            if value > threshold.max:
+                direction = "high"
+            elif value < threshold.min:
+                direction = "low"
+            else:
+                return None
+            self._active[key] = direction
+            self.stats["raised"] += 1
+            return AlarmTransition(sensor_id, value_type_id, f"{label} outside normal fuction", "warning", True)
+
+        if threshold.min + threshold.hysteresis <= value <= threshold.max - threshold.hysteresis:
+            del self._active[key]
+            self.stats["cleared"] += 1
+            return AlarmTransition(sensor_id, value_type_id, f"{label} back to normal", "info", False)
+
+        return None
+
+    def snapshot(self):
+        return {
+            **self.stats,
+            "active": [
+                {"sensor_id": sensor_id, "value_type_id": value_type_id, "direction": direction}
+                for (sensor_id, value_type_id), direction in self._active.items()
+            ],
+        }
+
+
+def parse_sensor_thresholds(spec, hysteresis):
+    """
+    Parses per sensor thresholds from the control file, written as
+    "sensor_id:value_type_id:min:max" entries separated by commas, e.g. "3:1:18:26,3:2:20:60".
+    Hysteresis comes from the global setting of the value type.
+    """
+    sensor_thresholds = {}
+    for entry in filter(None, (part.strip() for part in (spec or "").split(","))):
+        try:
+            sensor_id, value_type_id, low, high = entry.split(":")
+            sensor_id, value_type_id = int(sensor_id), int(value_type_id)
+            sensor_thresholds[(sensor_id, value_type_id)] = Threshold(
+                float(low), float(high), hysteresis.get(value_type_id, 0)
+            )
+        except ValueError:
+            _logger.error(f"Ignoring invalid sensor threshold '{entry}'")
+    return sensor_thresholds
@@ -0,0 +1,403 @@
+"""
+Device fleet load generator and ingest benchmark.
+
+Simulates devices publishing temperature, keycard and pin messages in the
+formats the handlers parse, and drives them either straight into
+subscriber.message() (direct) or through the MQTT broker into a running
+service (broker). Run from app/api against a local Postgres:
+
+    python -m bench.ingest_bench provision --devices 200
+    python -m bench.ingest_bench simulate --devices 200 --duration 30 --target direct
+    python -m bench.ingest_bench simulate --devices 200 --duration 30 --payload binary --samples 10
+    python -m bench.ingest_bench simulate --devices 200 --duration 30 --save capture.ndjson
+    python -m bench.ingest_bench record --duration 600 --output capture.ndjson
+    python -m bench.ingest_bench replay capture.ndjson --speed 10 --target broker
+
+Reports messages/sec, keycard/pin round trip p50/p99 and readings rows/sec.
+"""
+import argparse
+import asyncio
+import base64
+import json
+import os
+import random
+import time
+import uuid
+from typing import NamedTuple
+
+from sqlalchemy import func
+from sqlalchemy.future import select
+
+from database import async_session
+from models.monitoring import Device, Sensor, Door, KeyFob, Reading
+from payloads import encode_binary_telemetry
+
+# Prefix of everything provision() creates, so a bench fleet is easy to find
+BENCH_PREFIX = "bench"
+REPLY_PREFIX = "/bench/reply"
+
+
+class FleetDevice(NamedTuple):
+    device_id: int
+    temp_sensor_id: int
+    door_sensor_id: int
+    access_code: str
+    key: str
+
+
+class TrafficMessage(NamedTuple):
+    # Seconds from the start of the run
+    t: float
+    topic: str
+    payload: bytes
+
+
+# ------------------------------------------------------------ Fleet
+
+async def provision(devices):
+    """
+    Creates devices with a temperature sensor, a door sensor, a door and an
+    active keyfob each, and returns them as FleetDevice.
+    """
+    async with async_session() as session:
+        for i in range(devices):
+            device = Device(name=f"{BENCH_PREFIX}-device-{i}")
+            door = Door(name=f"{BENCH_PREFIX}-door-{i}", access_code=f"{i:05d}")
+            temp_sensor = Sensor(name=f"{BENCH_PREFIX}-temperature-{i}", device=device)
+            door_sensor = Sensor(name=f"{BENCH_PREFIX}-door-{i}", device=device, door=door)
+            keyfob = KeyFob(is_active=True, key=f"{BENCH_PREFIX}{i:08x}")
+            session.add_all([device, door, temp_sensor, door_sensor, keyfob])
+        await session.commit()
+    return await load_fleet()
+
+
+async def load_fleet():
+    async with async_session() as session:
+        devices = (await session.execute(
+            select(Device).where(Device.name.like(f"{BENCH_PREFIX}-device-%")).order_by(Device.id)
+        )).scalars().all()
+        sensors = (await session.execute(
+            select(Sensor).where(Sensor.name.like(f"{BENCH_PREFIX}-%"))
+        )).scalars().all()
+        doors = {door.id: door for door in (await session.execute(
+            select(Door).where(Door.name.like(f"{BENCH_PREFIX}-door-%"))
+        )).scalars().all()}
+        keys = {keyfob.key for keyfob in (await session.execute(
+            select(KeyFob).where(KeyFob.key.like(f"{BENCH_PREFIX}%"))
+        )).scalars().all()}
+
+    by_name = {sensor.name: sensor for sensor in sensors}
+    fleet = []
+    for device in devices:
+        i = device.name.rsplit("-", 1)[1]
+        temp_sensor = by_name.get(f"{BENCH_PREFIX}-temperature-{i}")
+        door_sensor = by_name.get(f"{BENCH_PREFIX}-door-{i}")
+        key = f"{BENCH_PREFIX}{int(i):08x}"
+        if temp_sensor is None or door_sensor is None or key not in keys:
+            continue
+        fleet.append(FleetDevice(device.id, temp_sensor.id, door_sensor.id, doors[door_sensor.door_id].access_code, key))
+    return fleet
+
+
+# ------------------------------------------------------------ Traffic
+
+def temperature_payload(samples, payload_format="text"):
+    """
+    One message for [(temperature, humidity, unix seconds)] in one of the
+    forms decode_telemetry() accepts. text only carries the last sample.
+    """
+    if payload_format == "binary":
+        return encode_binary_telemetry(samples, base_time=samples[0][2])
+    if payload_format == "batch":
+        return "; ".join(f"T: {t}, H: {h} @{int(at)}" for t, h, at in samples).encode()
+    temperature, humidity, _ = samples[-1]
+    return f"T: {temperature}, H: {humidity}".encode()
+
+
+def access_payload(code, return_address):
+    # parse_payload_keycard / parse_payload_pin
+    return f"!{code}+{return_address}".encode()
+
+
+def simulate(fleet, duration, interval, access_ratio, seed=1, payload_format="text", samples=1):
+    """
+    Every device takes one temperature reading per interval and publishes
+    them samples at a time (batch and binary payloads), and with probability
+    access_ratio makes a keycard or pin attempt in the same interval.
+    """
+    rng = random.Random(seed)
+    traffic = []
+    pending = {device.device_id: [] for device in fleet}
+    ticks = int(duration / interval)
+    for tick in range(ticks):
+        for device in fleet:
+            start = tick * interval
+            taken = pending[device.device_id]
+            taken.append((rng.randint(15, 35), rng.randint(20, 60), time.time() + start))
+            if payload_format == "text" or len(taken) >= samples or tick == ticks - 1:
+                traffic.append(TrafficMessage(
+                    start + rng.random() * interval,
+                    f"/mqtt/{device.device_id}/{device.temp_sensor_id}/temperature",
+                    temperature_payload(taken, payload_format),
+                ))
+                pending[device.device_id] = []
+            if rng.random() < access_ratio:
+                kind = rng.choice(("keycard", "pin"))
+                code = device.key if kind == "keycard" else device.access_code
+                return_address = f"{REPLY_PREFIX}/{device.door_sensor_id}/{uuid.uuid4().hex[:8]}"
+                traffic.append(TrafficMessage(
+                    start + rng.random() * interval,
+                    f"/mqtt/{device.device_id}/{device.door_sensor_id}/{kind}",
+                    access_payload(code, return_address),
+                ))
+    traffic.sort(key=lambda message: message.t)
+    return traffic
+
+
+def save_capture(traffic, path):
+    with open(path, "w") as capture:
+        for message in traffic:
+            capture.write(json.dumps({
+                "t": round(message.t, 6),
+                "topic": message.topic,
+                "payload": base64.b64encode(message.payload).decode(),
+            }) + "\n")
+
+
+def load_capture(path):
+    with open(path) as capture:
+        return [
+            TrafficMessage(record["t"], record["topic"], base64.b64decode(record["payload"]))
+            for record in map(json.loads, capture) if record
+        ]
+
+
+def return_address_of(message: TrafficMessage):
+    if not message.topic.endswith(("/keycard", "/pin")):
+        return None
+    _, _, address = message.payload.decode(errors="replace").partition("+")
+    return address or None
+
+
+# ------------------------------------------------------------ Drivers
+
+class Results:
+    def __init__(self):
+        self.sent = 0
+        self.round_trips = []
+        self.started = time.perf_counter()
+        self.finished = None
+        self.rows_written = 0
+        self._pending = {}
+
+    def expect_reply(self, return_address):
+        self._pending[return_address] = time.perf_counter()
+
+    def reply(self, return_address):
+        sent_at = self._pending.pop(return_address, None)
+        if sent_at is not None:
+            self.round_trips.append(time.perf_counter() - sent_at)
+
+    @staticmethod
+    def percentile(values, p):
+        if not values:
+            return None
+        values = sorted(values)
+        return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+    def report(self):
+        elapsed = (self.finished or time.perf_counter()) - self.started
+        return {
+            "messages": self.sent,
+            "seconds": round(elapsed, 3),
+            "messages_per_second": round(self.sent / elapsed, 1) if elapsed else None,
+            "access_replies": len(self.round_trips),
+            "access_missing_replies": len(self._pending),
+            "access_rtt_p50_ms": _ms(self.percentile(self.round_trips, 50)),
+            "access_rtt_p99_ms": _ms(self.percentile(self.round_trips, 99)),
+            "reading_rows": self.rows_written,
+            "reading_rows_per_second": round(self.rows_written / elapsed, 1) if elapsed else None,
+        }
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 3)
+
+
+async def _pace(traffic, speed, send):
+    """
+    Calls send() for every message at its offset divided by speed, or as fast
+    as possible when speed is 0.
+    """
+    started = time.perf_counter()
+    for message in traffic:
+        if speed:
+            delay = message.t / speed - (time.perf_counter() - started)
+            if delay > 0:
+                await asyncio.sleep(delay)
+        await send(message)
+
+
+async def run_direct(traffic, speed):
+    """
+    Feeds the traffic into subscriber.message() in this process, with replies
+    captured instead of published.
+    """
+    import subscriber
+
+    results = Results()
+    # Replies go to the results instead of the broker
+    subscriber.publish_reply = lambda return_address, payload, properties: results.reply(return_address)
+
+    await subscriber.startup_event()
+    written_before = subscriber.reading_buffer.stats["rows_written"]
+    results.started = time.perf_counter()
+
+    async def send(message):
+        return_address = return_address_of(message)
+        if return_address:
+            results.expect_reply(return_address)
+        await subscriber.message(None, message.topic, message.payload, 0, None)
+        results.sent += 1
+
+    await _pace(traffic, speed, send)
+    # Drains the work queue and flushes the ingest buffer
+    await subscriber.shutdown_event()
+    results.finished = time.perf_counter()
+    results.rows_written = subscriber.reading_buffer.stats["rows_written"] - written_before
+    return results
+
+
+async def _count_readings():
+    async with async_session() as session:
+        return (await session.execute(select(func.count(Reading.id)))).scalar_one()
+
+
+def _mqtt_client(name):
+    from gmqtt import Client
+
+    client = Client(f"{name}-{uuid.uuid4().hex[:8]}")
+    if os.getenv("USERNAME"):
+        client.set_auth_credentials(os.getenv("USERNAME"), os.getenv("PASSWORD", ""))
+    return client
+
+
+async def run_broker(traffic, speed, settle):
+    """
+    Publishes the traffic to the broker for a running service and listens for
+    the door replies. Rows are counted in the database before and after.
+    """
+    results = Results()
+    client = _mqtt_client("bench-fleet")
+    client.on_message = lambda client, topic, payload, qos, properties: results.reply(topic)
+    await client.connect(os.getenv("HOST", "localhost"), int(os.getenv("PORT", 1883)))
+    client.subscribe(f"{REPLY_PREFIX}/#")
+
+    rows_before = await _count_readings()
+    results.started = time.perf_counter()
+
+    async def send(message):
+        return_address = return_address_of(message)
+        if return_address:
+            results.expect_reply(return_address)
+        client.publish(message.topic, message.payload, qos=0)
+        results.sent += 1
+
+    await _pace(traffic, speed, send)
+    # Give the service time to answer and flush its ingest buffer
+    await asyncio.sleep(settle)
+    results.finished = time.perf_counter()
+    results.rows_written = await _count_readings() - rows_before
+    await client.disconnect()
+    return results
+
+
+async def record(duration, output):
+    """
+    Captures live device traffic from the broker into a replayable file.
+    """
+    traffic = []
+    started = time.perf_counter()
+    client = _mqtt_client("bench-recorder")
+    client.on_message = lambda client, topic, payload, qos, properties: traffic.append(
+        TrafficMessage(time.perf_counter() - started, topic, payload)
+    )
+    await client.connect(os.getenv("HOST", "localhost"), int(os.getenv("PORT", 1883)))
+    client.subscribe("/mqtt/#")
+    await asyncio.sleep(duration)
+    await client.disconnect()
+    save_capture(traffic, output)
+    return len(traffic)
+
+
+# ------------------------------------------------------------ CLI
+
+async def _drive(traffic, args):
+    if args.target == "direct":
+        return await run_direct(traffic, args.speed)
+    return await run_broker(traffic, args.speed, args.settle)
+
+
+async def main(args):
+    if args.command == "provision":
+        fleet = await provision(args.devices)
+        print(f"{len(fleet)} bench devices provisioned")
+        return
+
+    if args.command == "record":
+        count = await record(args.duration, args.output)
+        print(f"{count} messages recorded to {args.output}")
+        return
+
+    if args.command == "simulate":
+        fleet = (await load_fleet())[:args.devices]
+        if len(fleet) < args.devices:
+            raise SystemExit(f"Only {len(fleet)} bench devices exist, run provision --devices {args.devices} first")
+        traffic = simulate(fleet, args.duration, args.interval, args.access_ratio, args.seed, args.payload, args.samples)
+        if args.save:
+            save_capture(traffic, args.save)
+            print(f"{len(traffic)} messages saved to {args.save}")
+            return
+    else:
+        traffic = load_capture(args.capture)
+
+    results = await _drive(traffic, args)
+    print(json.dumps(results.report(), indent=2))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    provision_cmd = commands.add_parser("provision", help="Create bench devices, sensors, doors and keyfobs")
+    provision_cmd.add_argument("--devices", type=int, default=100)
+
+    def add_drive_options(command):
+        command.add_argument("--target", choices=("direct", "broker"), default="direct")
+        command.add_argument("--speed", type=float, default=1.0, help="Replay speed multiplier, 0 = as fast as possible")
+        command.add_argument("--settle", type=float, default=2.0, help="Seconds to wait for replies and flushes (broker)")
+
+    simulate_cmd = commands.add_parser("simulate", help="Generate fleet traffic and run it")
+    simulate_cmd.add_argument("--devices", type=int, default=100)
+    simulate_cmd.add_argument("--duration", type=float, default=10.0, help="Seconds of simulated traffic")
+    simulate_cmd.add_argument("--interval", type=float, default=1.0, help="Seconds between readings per device")
+    simulate_cmd.add_argument("--access-ratio", type=float, default=0.05, help="Chance of a door event per device and interval")
+    simulate_cmd.add_argument("--seed", type=int, default=1)
+    simulate_cmd.add_argument("--payload", choices=("text", "batch", "binary"), default="text", help="Telemetry payload form")
+    simulate_cmd.add_argument("--samples", type=int, default=1, help="Readings per message for batch and binary payloads")
+    simulate_cmd.add_argument("--save", help="Write the generated traffic to a capture file instead of running it")
+    add_drive_options(simulate_cmd)
+
+    replay_cmd = commands.add_parser("replay", help="Run a recorded or saved capture")
+    replay_cmd.add_argument("capture")
+    add_drive_options(replay_cmd)
+
+    record_cmd = commands.add_parser("record", help="Record live traffic from the broker")
+    record_cmd.add_argument("--duration", type=float, default=60.0)
+    record_cmd.add_argument("--output", default="capture.ndjson")
+
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
@@ -0,0 +1,97 @@
+"""
+Startup profile of the service. Run from app/api:
+
+    python -m bench.startup_bench imports --top 25
+    python -m bench.startup_bench restart --unit mqtt_api.service --url http://127.0.0.1:8000/ready
+
+imports runs `python -X importtime -c "import subscriber"` in a fresh
+interpreter and lists the slowest modules, cumulative time included.
+restart restarts the systemd unit and reports how long it took until
+/ready answered 200, with the phase timings the worker reported.
+"""
+import argparse
+import json
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+
+def import_times(module="subscriber"):
+    """
+    [(cumulative seconds, self seconds, module)] from -X importtime, slowest first.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        sys.stderr.write(result.stderr)
+        raise SystemExit(f"import {module} failed")
+
+    times = []
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        own, cumulative, name = line[len("import time:"):].split("|")
+        times.append((int(cumulative) / 1e6, int(own) / 1e6, name.rstrip()))
+    times.sort(reverse=True)
+    return times
+
+
+def fetch_ready(url):
+    try:
+        with urllib.request.urlopen(url, timeout=1) as response:
+            return response.status, json.load(response)
+    except urllib.error.HTTPError as e:
+        return e.code, json.load(e)
+    except (urllib.error.URLError, OSError):
+        return None, None
+
+
+def restart(unit, url, timeout):
+    started = time.perf_counter()
+    subprocess.run(["systemctl", "restart", "--no-block", unit], check=True)
+    # Give the old process time to go away, so its /ready isn't measured
+    time.sleep(0.5)
+    while time.perf_counter() - started < timeout:
+        status, state = fetch_ready(url)
+        if status == 200:
+            return time.perf_counter() - started, state
+        time.sleep(0.1)
+    raise SystemExit(f"{url} not ready after {timeout}s")
+
+
+def main(args):
+    if args.command == "imports":
+        times = import_times(args.module)
+        print(f"{'cumulative':>10} {'self':>8}  module")
+        for cumulative, own, name in times[:args.top]:
+            print(f"{cumulative:10.3f} {own:8.3f}  {name}")
+        print(f"total {times[0][0]:.3f}s" if times else "no import times")
+    elif args.command == "restart":
+        elapsed, state = restart(args.unit, args.url, args.timeout)
+        print(f"ready after {elapsed:.2f}s (worker reports {state['ready_after']}s since import)")
+        print(json.dumps(state["phases"], indent=2))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    imports = commands.add_parser("imports", help="Slowest imports of the app module")
+    imports.add_argument("--module", default="subscriber")
+    imports.add_argument("--top", type=int, default=25)
+
+    restart = commands.add_parser("restart", help="Time a service restart until /ready")
+    restart.add_argument("--unit", default="mqtt_api.service")
+    restart.add_argument("--url", default="http://127.0.0.1:8000/ready")
+    restart.add_argument("--timeout", type=float, default=90)
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    main(parse_args())
@@ -0,0 +1,30 @@
+import os
+
+from dotenv import load_dotenv
+
+CONFIG_DIR = os.path.join(os.path.dirname(__file__), '..', 'configFiles')
+
+# Variables already set (systemd, shell) win, then the first file that sets one
+ENV_FILES = (
+    'database.env',
+    '.control.env',
+    '.env',
+    'mqtt.env',
+    'ingest.env',
+    'retention.env',
+    'logging.env',
+)
+
+_loaded = False
+
+
+def load_config():
+    """
+    Loads every file in configFiles once per process, however many modules ask for it.
+    """
+    global _loaded
+    if _loaded:
+        return
+    for name in ENV_FILES:
+        load_dotenv(os.path.join(CONFIG_DIR, name))
+    _loaded = True
@@ -0,0 +1,100 @@
+import hashlib
+import time
+from collections import OrderedDict
+
+# MQTT 5 user property a device can set to name a message, e.g. a sequence number
+MESSAGE_ID_PROPERTY = "msg_id"
+
+
+def message_id(properties):
+    """
+    The msg_id user property of an MQTT 5 message, or None.
+    """
+    if not properties:
+        return None
+    for name, value in properties.get("user_property") or ():
+        if name == MESSAGE_ID_PROPERTY:
+            return value
+    return None
+
+
+class Deduplicator:
+    """
+    Drops messages already seen in the last window seconds, so broker
+    redeliveries after a reconnect and device retries don't turn into extra
+    readings, alarms or entry logs.
+
+    A message is identified by (topic, hash of the payload, msg_id user
+    property). Every message is remembered, but a repeat is only dropped when
+    it can't be a new sample: it has a msg_id, the broker set the dup flag, or
+    the payload carries device timestamps (timestamped=True). A plain
+    "T: 21, H: 40" that a sensor sends every second with steady values is
+    kept.
+
+    The index holds at most max_entries keys in arrival order. Expired keys are
+    dropped from the front on every check, and when it is full the oldest key
+    goes first even if its window hasn't passed. With INGEST_MODE=shared every
+    worker has its own index, so a redelivery that the broker hands to another
+    worker isn't caught.
+    """
+
+    def __init__(self, window=5.0, max_entries=50000):
+        self.window = window
+        self.max_entries = max_entries
+        # key -> time it was first seen
+        self._seen = OrderedDict()
+        self.stats = {"checked": 0, "suppressed": 0, "flagged_dup": 0, "repeats_kept": 0, "expired": 0, "evicted": 0}
+
+    @staticmethod
+    def key(topic, payload, properties=None):
+        return topic, hashlib.blake2b(payload, digest_size=16).digest(), message_id(properties)
+
+    def _expire(self, now):
+        seen = self._seen
+        cutoff = now - self.window
+        while seen:
+            if next(iter(seen.values())) > cutoff:
+                break
+            seen.popitem(last=False)
+            self.stats["expired"] += 1
+
+    def is_duplicate(self, topic, payload, properties=None, now=None, timestamped=False):
+        """
+        True if the same message arrived within the window and is known to be
+        a repeat, otherwise records it.
+        """
+        if not self.window:
+            return False
+        now = time.perf_counter() if now is None else now
+        self.stats["checked"] += 1
+        # Set by the broker on QoS 1/2 redeliveries
+        redelivered = bool(properties and properties.get("dup"))
+        if redelivered:
+            self.stats["flagged_dup"] += 1
+        self._expire(now)
+
+        key = self.key(topic, payload, properties)
+        if key in self._seen:
+            if redelivered or timestamped or key[2] is not None:
+                # The window runs from the first copy, repeats don't extend it
+                self.stats["suppressed"] += 1
+                return True
+            # Same values from a sensor without timestamps, most likely a new
+            # sample, so it is remembered as the latest copy
+            self.stats["repeats_kept"] += 1
+            self._seen.move_to_end(key)
+            self._seen[key] = now
+            return False
+        if len(self._seen) >= self.max_entries:
+            self._seen.popitem(last=False)
+            self.stats["evicted"] += 1
+        self._seen[key] = now
+        return False
+
+    def snapshot(self):
+        return {
+            "window": self.window,
+            "max_entries": self.max_entries,
+            "entries": len(self._seen),
+            **self.stats,
+        }
@@ -0,0 +1,209 @@
+"""
+Streams readings, entry logs and alarms for a time range as Arrow IPC,
+Parquet or CSV. Rows come from a server side cursor and are converted one
+chunk at a time in a worker thread, so memory stays bounded and the event
+loop keeps serving MQTT while an export runs.
+
+Arrow and Parquet need pyarrow (pip install pyarrow), CSV always works.
+Served on /export/{table}, or from the command line in app/api:
+
+    python -m export readings --from 2024-01-01 --to 2024-02-01 --format parquet --output readings.parquet
+    python -m export entry_logs --from 2024-01-01 --to 2024-01-02 --sensor-ids 3,4 --format csv
+"""
+import argparse
+import asyncio
+import csv
+import importlib.util
+import io
+import sys
+from datetime import datetime
+
+from sqlalchemy import Boolean, DateTime, Float, Integer, and_
+
+from database import async_session
+from models.monitoring import Reading, EntryLog, Alarm
+from pagination import select_columns
+
+# pyarrow takes a while to import, so it is only loaded by the first arrow or parquet export
+HAS_PYARROW = importlib.util.find_spec("pyarrow") is not None
+pyarrow = None
+
+
+def _load_pyarrow():
+    global pyarrow
+    if pyarrow is None:
+        import pyarrow
+        import pyarrow.ipc
+        import pyarrow.parquet
+    return pyarrow
+
+
+EXPORT_TABLES = {
+    "readings": Reading,
+    "entry_logs": EntryLog,
+    "alarms": Alarm,
+}
+
+EXPORT_CHUNK = 10000
+
+MEDIA_TYPES = {
+    "arrow": "application/vnd.apache.arrow.stream",
+    "parquet": "application/vnd.apache.parquet",
+    "csv": "text/csv",
+}
+
+
+def available_formats():
+    return ("arrow", "parquet", "csv") if HAS_PYARROW else ("csv",)
+
+
+def default_format():
+    return "arrow" if HAS_PYARROW else "csv"
+
+
+def export_statement(table, date_from, date_to, sensor_ids=None):
+    model = EXPORT_TABLES[table]
+    conditions = [model.created_date >= date_from, model.created_date < date_to]
+    if sensor_ids:
+        conditions.append(model.sensor_id.in_(sensor_ids))
+    return select_columns(model).where(and_(*conditions)).order_by(model.created_date, model.id)
+
+
+def arrow_schema(model):
+    def arrow_type(column_type):
+        if isinstance(column_type, Boolean):
+            return pyarrow.bool_()
+        if isinstance(column_type, Integer):
+            return pyarrow.int64()
+        if isinstance(column_type, Float):
+            return pyarrow.float64()
+        if isinstance(column_type, DateTime):
+            return pyarrow.timestamp("us")
+        return pyarrow.string()
+
+    return pyarrow.schema([(column.name, arrow_type(column.type)) for column in model.__table__.columns])
+
+
+class _Sink(io.RawIOBase):
+    """
+    File object the pyarrow writers write into, drained after every chunk.
+    """
+
+    def __init__(self):
+        self._parts = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._parts.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self):
+        data = b"".join(self._parts)
+        self._parts = []
+        return data
+
+
+class ArrowEncoder:
+    def __init__(self, model, format):
+        _load_pyarrow()
+        self.schema = arrow_schema(model)
+        self.sink = _Sink()
+        if format == "parquet":
+            self.writer = pyarrow.parquet.ParquetWriter(self.sink, self.schema)
+        else:
+            self.writer = pyarrow.ipc.new_stream(self.sink, self.schema)
+
+    def encode(self, rows):
+        columns = list(zip(*rows))
+        batch = pyarrow.record_batch(
+            [pyarrow.array(values, type=field.type) for values, field in zip(columns, self.schema)],
+            schema=self.schema,
+        )
+        # One row group (parquet) or record batch (arrow) per chunk
+        self.writer.write_batch(batch)
+        return self.sink.drain()
+
+    def close(self):
+        self.writer.close()
+        return self.sink.drain()
+
+
+class CSVEncoder:
+    def __init__(self, model, format):
+        self.header = [column.name for column in model.__table__.columns]
+
+    def encode(self, rows):
+        out = io.StringIO()
+        writer = csv.writer(out)
+        if self.header is not None:
+            writer.writerow(self.header)
+            self.header = None
+        writer.writerows(
+            [value.isoformat() if isinstance(value, datetime) else value for value in row] for row in rows
+        )
+        return out.getvalue().encode()
+
+    def close(self):
+        return b""
+
+
+async def export_chunks(table, date_from, date_to, sensor_ids=None, format="csv", chunk_size=EXPORT_CHUNK):
+    """
+    Yields the encoded export piece by piece.
+    """
+    if format not in available_formats():
+        raise ValueError(f"format must be one of {', '.join(available_formats())}")
+    model = EXPORT_TABLES[table]
+    encoder = (CSVEncoder if format == "csv" else ArrowEncoder)(model, format)
+    stmt = export_statement(table, date_from, date_to, sensor_ids)
+
+    async with async_session() as session:
+        result = await session.stream(stmt.execution_options(yield_per=chunk_size))
+        async for partition in result.partitions():
+            data = await asyncio.to_thread(encoder.encode, [tuple(row) for row in partition])
+            if data:
+                yield data
+    data = await asyncio.to_thread(encoder.close)
+    if data:
+        yield data
+
+
+def export_filename(table, date_from, date_to, format):
+    extension = {"arrow": "arrows", "parquet": "parquet", "csv": "csv"}[format]
+    return f"{table}_{date_from:%Y%m%dT%H%M%S}_{date_to:%Y%m%dT%H%M%S}.{extension}"
+
+
+# ------------------------------------------------------------ CLI
+
+async def main(args):
+    sensor_ids = [int(part) for part in args.sensor_ids.split(",")] if args.sensor_ids else None
+    output = open(args.output, "wb") if args.output else sys.stdout.buffer
+    try:
+        async for data in export_chunks(args.table, args.date_from, args.date_to, sensor_ids, args.format, args.chunk_size):
+            output.write(data)
+    finally:
+        if args.output:
+            output.close()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("table", choices=EXPORT_TABLES)
+    parser.add_argument("--from", dest="date_from", type=datetime.fromisoformat, required=True)
+    parser.add_argument("--to", dest="date_to", type=datetime.fromisoformat, required=True)
+    parser.add_argument("--sensor-ids", help="Comma separated, default all sensors")
+    parser.add_argument("--format", choices=("arrow", "parquet", "csv"), default=default_format())
+    parser.add_argument("--chunk-size", type=int, default=EXPORT_CHUNK)
+    parser.add_argument("--output", help="File to write, default stdout")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
@@ -0,0 +1,360 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from datetime import datetime
+
+from sqlalchemy import and_, insert, update
+from sqlalchemy.exc import DataError, IntegrityError
+
+from database import async_session
+from models.monitoring import Reading, EntryLog, Alarm
+import rollups
+from metrics import DB_COMMIT_SECONDS
+
+_logger = logging.getLogger(__name__)
+
+# Upper bounds (in rows) of the batch size buckets reported by /ingest_stats
+BATCH_SIZE_BUCKETS = (1, 10, 50, 100, 250, 500, 1000, 5000)
+
+# Errors that come from the rows themselves (unknown sensor_id, value out of
+# range), retrying the same rows would fail forever
+ROW_ERRORS = (IntegrityError, DataError)
+
+# Rejected rows listed by /ingest_stats, all of them are logged
+RECENT_DEAD_LETTERS = 20
+
+
+class BatchBuffer:
+    """
+    Collects rows from the MQTT handlers and writes them to the database in
+    one multi-row INSERT, either when max_batch_size rows are waiting or when
+    max_latency seconds have passed since the last flush. Subclasses provide
+    add() and _insert().
+
+    With a spool (see spool.py) rows are appended to disk instead of kept in
+    memory, and a batch is only marked done in the spool after its commit, so
+    nothing is lost or dropped while the database is down or restarting.
+
+    When the database rejects a batch because of its contents, the rows are
+    written one by one and the ones it still rejects are dead-lettered
+    (logged and counted) instead of holding up everything behind them.
+    """
+
+    # DB_COMMIT_SECONDS label
+    operation = "batch"
+
+    def __init__(self, max_batch_size=500, max_latency=0.5, max_pending=50000, spool=None, on_written=None):
+        self._commit_seconds = DB_COMMIT_SECONDS.labels(self.operation)
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency
+        # Rows kept in memory while the database is failing, oldest are dropped first
+        self.max_pending = max_pending
+        self.spool = spool
+        # Called with the rows of every committed batch
+        self.on_written = on_written
+
+        self._rows = []
+        self._lock = asyncio.Lock()
+        self._batch_ready = asyncio.Event()
+        self._task = None
+        self._stopping = False
+        # Spools of workers that no longer run, drained before our own
+        self._orphans = []
+        self._dead_letters = deque(maxlen=RECENT_DEAD_LETTERS)
+
+        self.stats = {
+            "rows_buffered": 0,
+            "rows_written": 0,
+            "rows_dropped": 0,
+            "rows_dead_lettered": 0,
+            "flushes": 0,
+            "failed_flushes": 0,
+            "last_batch_size": 0,
+            "max_batch_size_seen": 0,
+            "flush_seconds_total": 0.0,
+            "flush_seconds_max": 0.0,
+            "batch_size_buckets": {str(b): 0 for b in BATCH_SIZE_BUCKETS} | {"+Inf": 0},
+        }
+
+    def _append(self, row):
+        """
+        Queues one row. Never touches the database, so it is safe to call
+        from the MQTT message handlers.
+        """
+        if self.spool is not None:
+            self.spool.append(row)
+            pending = self.spool.pending
+        else:
+            self._rows.append(row)
+            pending = len(self._rows)
+        self.stats["rows_buffered"] += 1
+        if pending >= self.max_batch_size:
+            self._batch_ready.set()
+
+    async def _insert(self, session, rows):
+        raise NotImplementedError
+
+    async def flush(self):
+        """
+        Writes everything currently buffered. Rows that fail to write are put
+        back in front of the buffer and retried on the next flush.
+        """
+        async with self._lock:
+            if self.spool is not None:
+                for orphan in list(self._orphans):
+                    if await self._flush_spool(orphan):
+                        _logger.info(f"Replayed the spool left behind in {orphan.directory}")
+                        orphan.release()
+                        self._orphans.remove(orphan)
+                await self._flush_spool(self.spool)
+                return
+
+            if not self._rows:
+                return
+
+            rows, self._rows = self._rows, []
+            try:
+                await self._write(rows)
+            except Exception:
+                _logger.exception(f"Failed to flush {len(rows)} {self.operation} rows, retrying on next flush")
+                self.stats["failed_flushes"] += 1
+                self._requeue(rows)
+
+    async def _flush_spool(self, spool):
+        """
+        Returns True once everything in spool is written. Rejected rows are
+        dead-lettered by _write() and committed past, so only an unreachable
+        database stops the replay.
+        """
+        # A backlog from an outage or a replay is written in max_batch_size chunks
+        while spool.pending:
+            rows, end = spool.read(spool.committed, self.max_batch_size)
+            if rows:
+                try:
+                    await self._write(rows)
+                except Exception:
+                    _logger.exception(f"Failed to flush {len(rows)} spooled rows, retrying on next flush")
+                    self.stats["failed_flushes"] += 1
+                    return False
+            spool.commit(end)
+        return True
+
+    async def _write(self, rows):
+        started = time.perf_counter()
+        try:
+            async with async_session() as session:
+                await self._insert(session, rows)
+                await session.commit()
+        except ROW_ERRORS as e:
+            _logger.warning(f"{self.operation}: batch of {len(rows)} rows rejected, retrying row by row: {e.orig}")
+            rows = await self._write_rows(rows)
+
+        elapsed = time.perf_counter() - started
+        self._commit_seconds.observe(elapsed)
+        self._record_flush(len(rows), elapsed)
+        if self.on_written is not None and rows:
+            self.on_written(rows)
+
+    async def _write_rows(self, rows):
+        """
+        Writes rows one savepoint each and dead-letters the ones the database
+        rejects. Returns the rows that were written.
+        """
+        written = []
+        rejected = []
+        async with async_session() as session:
+            for row in rows:
+                try:
+                    async with session.begin_nested():
+                        await self._insert(session, [row])
+                    written.append(row)
+                except ROW_ERRORS as e:
+                    rejected.append((row, str(e.orig).splitlines()[0]))
+            await session.commit()
+        # Only after the commit, a failed commit retries the whole batch
+        for row, error in rejected:
+            self._dead_letter(row, error)
+        return written
+
+    def _dead_letter(self, row, error):
+        self.stats["rows_dead_lettered"] += 1
+        self._dead_letters.append({"row": row, "error": error})
+        if self.spool is not None:
+            self.spool.dead_letter(row, error)
+        _logger.error(f"{self.operation}: dropped row the database rejects: {error}", extra={"row": row})
+
+    def _requeue(self, rows):
+        self._rows[:0] = rows
+        overflow = len(self._rows) - self.max_pending
+        if overflow > 0:
+            del self._rows[:overflow]
+            self.stats["rows_dropped"] += overflow
+            _logger.error(f"Ingest buffer full, dropped {overflow} oldest readings")
+
+    def _record_flush(self, batch_size, elapsed):
+        stats = self.stats
+        stats["rows_written"] += batch_size
+        stats["flushes"] += 1
+        stats["last_batch_size"] = batch_size
+        stats["max_batch_size_seen"] = max(stats["max_batch_size_seen"], batch_size)
+        stats["flush_seconds_total"] += elapsed
+        stats["flush_seconds_max"] = max(stats["flush_seconds_max"], elapsed)
+
+        for bucket in BATCH_SIZE_BUCKETS:
+            if batch_size <= bucket:
+                stats["batch_size_buckets"][str(bucket)] += 1
+                break
+        else:
+            stats["batch_size_buckets"]["+Inf"] += 1
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._batch_ready.wait(), timeout=self.max_latency)
+            except asyncio.TimeoutError:
+                pass
+            self._batch_ready.clear()
+            if self.spool is not None:
+                self.spool.sync()
+            await self.flush()
+
+    def start(self):
+        if self._task is None:
+            self._stopping = False
+            if self.spool is not None:
+                self.spool.open()
+                self._orphans = self.spool.claim_orphans()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """
+        Stops the background flusher and writes whatever is left in the buffer.
+        """
+        # Let the running flush finish instead of cancelling it mid-commit
+        self._stopping = True
+        self._batch_ready.set()
+        if self._task is not None:
+            await self._task
+            self._task = None
+        await self.flush()
+        if self.spool is not None:
+            # Whatever is still pending is replayed by the next start
+            self.spool.sync()
+            self.spool.close()
+            for orphan in self._orphans:
+                orphan.release()
+            self._orphans = []
+
+    def snapshot(self):
+        stats = dict(self.stats)
+        stats["rows_pending"] = self.spool.pending if self.spool is not None else len(self._rows)
+        stats["flush_seconds_avg"] = (
+            stats["flush_seconds_total"] / stats["flushes"] if stats["flushes"] else 0.0
+        )
+        stats["max_batch_size"] = self.max_batch_size
+        stats["max_latency"] = self.max_latency
+        stats["recent_dead_letters"] = list(self._dead_letters)
+        if self.spool is not None:
+            stats["spool"] = self.spool.snapshot()
+            stats["orphan_spools"] = [orphan.snapshot() for orphan in self._orphans]
+        return stats
+
+
+class ReadingBuffer(BatchBuffer):
+    """
+    Readings from the temperature handler. The reading rollups are updated
+    in the same transaction as the INSERT.
+    """
+
+    operation = "readings_batch"
+
+    def add(self, value_type_id, sensor_id, value, created_date=None):
+        self._append({
+            "value_type_id": value_type_id,
+            "sensor_id": sensor_id,
+            "value": value,
+            # Stamp on arrival, otherwise every row in a batch gets the flush time
+            "created_date": created_date or datetime.now(),
+        })
+
+    async def _insert(self, session, rows):
+        await session.execute(insert(Reading), rows)
+        # Same transaction, so a retried batch is never counted twice
+        await rollups.apply(session, rows)
+
+
+class EntryLogBuffer(BatchBuffer):
+    """
+    Entry logs of keycard and pin attempts, written after the door already
+    got its reply. Meant to run with a spool so the audit trail survives
+    restarts and database outages.
+    """
+
+    operation = "entry_logs_batch"
+
+    def add(self, sensor_id, approved, key_fob_id=None):
+        self._append({
+            "sensor_id": sensor_id,
+            "key_fob_id": key_fob_id,
+            "approved": approved,
+            "date": datetime.utcnow(),
+            "created_date": datetime.now(),
+        })
+
+    async def _insert(self, session, rows):
+        await session.execute(insert(EntryLog), rows)
+
+
+class AlarmBuffer(BatchBuffer):
+    """
+    Alarm transitions from the alarm engine. Written in the background like
+    the readings, so a slow or unreachable database neither holds up the
+    telemetry handler nor loses an alarm the engine already counts as raised.
+    """
+
+    operation = "alarms_batch"
+
+    def add(self, sensor_id, value_type_id, message, severity, raised, created_date=None):
+        self._append({
+            "sensor_id": sensor_id,
+            "value_type_id": value_type_id,
+            "message": message,
+            "severity": severity,
+            "raised": raised,
+            "created_date": created_date or datetime.now(),
+        })
+
+    async def _insert(self, session, rows):
+        """
+        Raised alarms become new rows. A clear sets cleared_date on the open
+        alarm of that sensor and value type instead of adding a row, so
+        is_acknowledged stays for operators. Inserts go first and clears only
+        match alarms raised before them, so a raise, clear and raise in one
+        batch leaves the last alarm open.
+        """
+        raised = [
+            {
+                "sensor_id": row["sensor_id"],
+                "value_type_id": row["value_type_id"],
+                "message": row["message"],
+                "severity": row["severity"],
+                "is_acknowledged": False,
+                "created_date": row["created_date"],
+            }
+            for row in rows if row["raised"]
+        ]
+        if raised:
+            await session.execute(insert(Alarm), raised)
+        for row in rows:
+            if not row["raised"]:
+                await session.execute(
+                    update(Alarm)
+                    .where(and_(
+                        Alarm.sensor_id == row["sensor_id"],
+                        Alarm.value_type_id == row["value_type_id"],
+                        Alarm.cleared_date.is_(None),
+                        Alarm.created_date <= row["created_date"],
+                    ))
+                    .values(cleared_date=row["created_date"])
+                )
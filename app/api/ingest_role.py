@@ -0,0 +1,96 @@
+import asyncio
+import fcntl
+import logging
+import os
+
+_logger = logging.getLogger(__name__)
+
+# Topic filter the devices publish under
+SUBSCRIBE_TOPIC = "/mqtt/#"
+
+MODES = ("single", "shared", "leader")
+
+
+class IngestRole:
+    """
+    Decides which gunicorn workers subscribe to the device topics.
+
+    single: every worker subscribes to /mqtt/#. Only correct with one worker.
+    shared: every worker joins the MQTT shared subscription $share/<group>//mqtt/#,
+            the broker hands each message to exactly one of them.
+    leader: the worker holding an exclusive lock on lock_file subscribes, the
+            others only serve HTTP. When the leader dies the lock is released
+            and another worker takes over.
+    """
+
+    def __init__(self, mode="single", share_group="mqtt_api", lock_file="/tmp/mqtt_api_ingest.lock", retry_interval=5):
+        if mode not in MODES:
+            raise ValueError(f"INGEST_MODE must be one of {', '.join(MODES)}, got '{mode}'")
+        self.mode = mode
+        self.share_group = share_group
+        self.lock_file = lock_file
+        self.retry_interval = retry_interval
+        self._lock_fd = None
+        self._task = None
+
+    @property
+    def topic(self):
+        if self.mode == "shared":
+            # The group prefix is put in front of the full filter, leading slash included
+            return f"$share/{self.share_group}/{SUBSCRIBE_TOPIC}"
+        return SUBSCRIBE_TOPIC
+
+    @property
+    def is_ingesting(self):
+        if self.mode == "leader":
+            return self._lock_fd is not None
+        return True
+
+    def try_acquire(self):
+        if self._lock_fd is not None:
+            return True
+        fd = os.open(self.lock_file, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        os.ftruncate(fd, 0)
+        os.write(fd, str(os.getpid()).encode())
+        self._lock_fd = fd
+        _logger.warning(f"Worker {os.getpid()} is now the ingest leader")
+        return True
+
+    async def _elect(self, on_elected):
+        while not self.try_acquire():
+            await asyncio.sleep(self.retry_interval)
+        on_elected()
+
+    def start(self, on_elected):
+        """
+        In leader mode, keeps trying to take the lock in the background and
+        calls on_elected() once this worker becomes the leader.
+        """
+        if self.mode != "leader" or self._task is not None:
+            return
+        if self.try_acquire():
+            on_elected()
+            return
+        self._task = asyncio.create_task(self._elect(on_elected))
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self._lock_fd is not None:
+            fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+            os.close(self._lock_fd)
+            self._lock_fd = None
+
+    def snapshot(self):
+        return {
+            "mode": self.mode,
+            "pid": os.getpid(),
+            "topic": self.topic,
+            "ingesting": self.is_ingesting,
+        }
@@ -0,0 +1,104 @@
+import asyncio
+import json
+import logging
+
+_logger = logging.getLogger(__name__)
+
+KINDS = ("reading", "alarm", "entry_log")
+
+
+def parse_filter(kinds=None, sensors=None):
+    """
+    Turns the comma separated kinds and sensors query parameters into sets,
+    None meaning everything.
+    """
+    kind_set = None
+    if kinds:
+        kind_set = {kind.strip() for kind in kinds.split(",") if kind.strip()}
+        unknown = kind_set - set(KINDS)
+        if unknown:
+            raise ValueError(f"Unknown event kinds {', '.join(sorted(unknown))}, expected {', '.join(KINDS)}")
+    sensor_set = None
+    if sensors:
+        sensor_set = {int(sensor) for sensor in sensors.split(",") if sensor.strip()}
+    return kind_set, sensor_set
+
+
+class LiveSubscriber:
+    def __init__(self, kinds, sensor_ids, maxsize):
+        self.kinds = kinds
+        self.sensor_ids = sensor_ids
+        self.queue = asyncio.Queue(maxsize)
+        self.dropped = False
+
+    def wants(self, kind, sensor_id):
+        return (self.kinds is None or kind in self.kinds) and (self.sensor_ids is None or sensor_id in self.sensor_ids)
+
+    async def next(self):
+        """
+        Next encoded event, or None when the subscriber was dropped for falling behind.
+        """
+        return await self.queue.get()
+
+
+class LiveBroadcaster:
+    """
+    Fans out events from the MQTT handlers to WebSocket and SSE clients
+    without touching the database. Each event is encoded once and put on the
+    bounded queue of every subscriber whose filter matches. A subscriber whose
+    queue is full is dropped instead of slowing down ingest or buffering
+    without limit; the client is expected to reconnect.
+
+    Events only reach clients of the worker that handled the message. With
+    INGEST_MODE=leader the other workers refuse /live and /live/sse (close
+    1013 / 503, counted as refused) so clients reconnect until they reach the
+    leader; with INGEST_MODE=shared a client sees that worker's share of the
+    devices.
+    """
+
+    def __init__(self, max_queue=256):
+        self.max_queue = max_queue
+        self._subscribers = set()
+        self.stats = {"published": 0, "delivered": 0, "dropped_subscribers": 0, "connections": 0, "refused": 0}
+
+    def subscribe(self, kinds=None, sensor_ids=None):
+        subscriber = LiveSubscriber(kinds, sensor_ids, self.max_queue)
+        self._subscribers.add(subscriber)
+        self.stats["connections"] += 1
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        self._subscribers.discard(subscriber)
+
+    def _drop(self, subscriber):
+        self._subscribers.discard(subscriber)
+        subscriber.dropped = True
+        self.stats["dropped_subscribers"] += 1
+        # Make room for the end marker, the client reconnects and starts fresh
+        while not subscriber.queue.empty():
+            subscriber.queue.get_nowait()
+        subscriber.queue.put_nowait(None)
+
+    def publish(self, kind, sensor_id, **fields):
+        self.stats["published"] += 1
+        if not self._subscribers:
+            return
+        encoded = None
+        for subscriber in list(self._subscribers):
+            if not subscriber.wants(kind, sensor_id):
+                continue
+            if encoded is None:
+                encoded = json.dumps({"kind": kind, "sensor_id": sensor_id, **fields}, default=str)
+            try:
+                subscriber.queue.put_nowait(encoded)
+                self.stats["delivered"] += 1
+            except asyncio.QueueFull:
+                _logger.warning(f"Dropping live subscriber with {subscriber.queue.qsize()} undelivered events")
+                self._drop(subscriber)
+
+    def snapshot(self):
+        return {
+            **self.stats,
+            "subscribers": len(self._subscribers),
+            "max_queue": self.max_queue,
+        }
@@ -0,0 +1,161 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import time
+from datetime import datetime
+
+# Attributes every LogRecord has, anything else was passed with extra={...}
+_STANDARD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+def record_fields(record):
+    return {key: value for key, value in vars(record).items() if key not in _STANDARD_ATTRS}
+
+
+class JSONFormatter(logging.Formatter):
+    """
+    One JSON object per line: time, level, logger, message and the extra fields.
+    """
+
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            **record_fields(record),
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """
+    The classic "time - level - message" line with the extra fields appended as key=value.
+    """
+
+    def __init__(self):
+        super().__init__("%(asctime)s - %(levelname)s - %(message)s", datefmt="%Y-%m-%d %H:%M:%S")
+
+    def format(self, record):
+        line = super().format(record)
+        fields = record_fields(record)
+        if fields:
+            line += " " + " ".join(f"{key}={value}" for key, value in fields.items())
+        return line
+
+
+class TopicRateLimitFilter(logging.Filter):
+    """
+    Token bucket per MQTT topic for records below ERROR that carry a topic
+    (extra={"topic": ...}). Once a topic runs out of tokens only every
+    sample-th record is kept, and the next kept record says how many were
+    skipped. Warnings are limited too, a device sending garbage warns once
+    per message; errors always pass.
+    """
+
+    def __init__(self, rate=1.0, burst=10, sample=100, max_topics=10000):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst
+        self.sample = sample
+        self.max_topics = max_topics
+        # topic -> [tokens, last refill, suppressed since last kept record]
+        self._buckets = {}
+        self.suppressed = 0
+
+    def filter(self, record):
+        topic = getattr(record, "topic", None)
+        if topic is None or record.levelno >= logging.ERROR or not self.rate:
+            return True
+
+        now = time.monotonic()
+        bucket = self._buckets.get(topic)
+        if bucket is None:
+            if len(self._buckets) >= self.max_topics:
+                self._buckets.clear()
+            bucket = self._buckets[topic] = [self.burst, now, 0]
+        bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+        bucket[1] = now
+
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+        elif not self.sample or (bucket[2] + 1) % self.sample:
+            bucket[2] += 1
+            self.suppressed += 1
+            return False
+
+        if bucket[2]:
+            record.suppressed = bucket[2]
+            bucket[2] = 0
+        return True
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Never blocks the caller: when the writer thread falls behind and the
+    queue is full, records are dropped and counted.
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Only merge the arguments here, tracebacks and the line itself are
+        # formatted by the writer thread
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+_state = {"listener": None, "handler": None, "rate_limit": None}
+
+
+def setup_logging(filename, level="INFO", format="json", queue_size=10000, rate=1.0, burst=10, sample=100):
+    """
+    Replaces the root handlers with a queue: callers only enqueue the record,
+    and a background thread formats it and writes the file. Uses a
+    WatchedFileHandler so logrotate can move the file away.
+    """
+    file_handler = logging.handlers.WatchedFileHandler(filename)
+    file_handler.setFormatter(JSONFormatter() if format == "json" else TextFormatter())
+
+    handler = DroppingQueueHandler(queue.Queue(queue_size))
+    rate_limit = TopicRateLimitFilter(rate=rate, burst=burst, sample=sample)
+    handler.addFilter(rate_limit)
+
+    root = logging.getLogger()
+    for old in list(root.handlers):
+        root.removeHandler(old)
+    root.addHandler(handler)
+    root.setLevel(level)
+
+    listener = logging.handlers.QueueListener(handler.queue, file_handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    _state.update(listener=listener, handler=handler, rate_limit=rate_limit)
+    return listener
+
+
+def logging_stats():
+    handler, rate_limit = _state["handler"], _state["rate_limit"]
+    if handler is None:
+        return {}
+    return {
+        "queued": handler.queue.qsize(),
+        "dropped": handler.dropped,
+        "suppressed": rate_limit.suppressed,
+        "topics_tracked": len(rate_limit._buckets),
+    }
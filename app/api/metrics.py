@@ -0,0 +1,244 @@
+"""
+Small in-process metrics registry rendered in the Prometheus text format on /metrics.
+
+Histograms use fixed buckets and label children are created once, so
+recording a sample is a dict lookup, a bisect and two additions:
+
+    PARSE_SECONDS = STAGE_SECONDS.labels("parse")
+    ...
+    PARSE_SECONDS.observe(time.perf_counter() - started)
+
+Every gunicorn worker has its own registry, so each series carries a
+worker="<pid>" label. Successive scrapes land on different workers; sum
+over the label in queries, e.g. sum without (worker) (rate(...[5m])).
+"""
+import os
+import time
+from bisect import bisect_left
+
+# Seconds, tuned for handlers that normally take well under 100ms
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(label_names, label_values, const_labels=()):
+    pairs = [*const_labels, *zip(label_names, label_values)]
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in pairs) + "}"
+
+
+class _Metric:
+    type = ""
+
+    def __init__(self, name, help, label_names=()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(label_names)
+        # (name, value) pairs put on every series, set by the registry
+        self.const_labels = ()
+        self._children = {}
+        if not self.label_names:
+            self._children[()] = self._new_child()
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *label_values):
+        label_values = tuple(str(value) for value in label_values)
+        child = self._children.get(label_values)
+        if child is None:
+            child = self._children[label_values] = self._new_child()
+        return child
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        for label_values, child in list(self._children.items()):
+            lines.extend(self._render_child(_format_labels(self.label_names, label_values, self.const_labels), label_values, child))
+        return lines
+
+
+class _CounterChild:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount=1):
+        self._children[()].inc(amount)
+
+    def _render_child(self, labels, label_values, child):
+        return [f"{self.name}{labels} {child.value}"]
+
+
+class _HistogramChild:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        # One slot per bucket plus +Inf
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def time(self):
+        return _Timer(self)
+
+
+class _Timer:
+    __slots__ = ("child", "started")
+
+    def __init__(self, child):
+        self.child = child
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.child.observe(time.perf_counter() - self.started)
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name, help, label_names=(), buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, help, label_names)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value):
+        self._children[()].observe(value)
+
+    def time(self):
+        return self._children[()].time()
+
+    def _render_child(self, labels, label_values, child):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), child.counts):
+            cumulative += count
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            bucket_labels = _format_labels(self.label_names + ("le",), label_values + (le,), self.const_labels)
+            lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+        lines.append(f"{self.name}_sum{labels} {child.sum}")
+        lines.append(f"{self.name}_count{labels} {child.count}")
+        return lines
+
+
+class CallbackMetric(_Metric):
+    """
+    Gauge or counter read at scrape time from fn(), which returns a number or
+    a {label values tuple: number} dict. Used to expose the stats the
+    components already keep (queue depth, pool usage, ...).
+    """
+
+    def __init__(self, name, help, fn, label_names=(), type="gauge"):
+        self.fn = fn
+        self.type = type
+        super().__init__(name, help, label_names)
+
+    def _new_child(self):
+        return None
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        value = self.fn()
+        values = value if isinstance(value, dict) else {(): value}
+        for label_values, number in values.items():
+            lines.append(f"{self.name}{_format_labels(self.label_names, label_values, self.const_labels)} {number}")
+        return lines
+
+
+class Registry:
+    def __init__(self, const_labels=None):
+        self._metrics = {}
+        self.const_labels = tuple((name, str(value)) for name, value in (const_labels or {}).items())
+
+    def register(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        metric.const_labels = self.const_labels
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help, label_names=()):
+        return self.register(Counter(name, help, label_names))
+
+    def histogram(self, name, help, label_names=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, help, label_names, buckets))
+
+    def callback(self, name, help, fn, label_names=(), type="gauge"):
+        return self.register(CallbackMetric(name, help, fn, label_names, type))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+# Imported in each worker (no --preload), so this is the worker's own pid
+registry = Registry(const_labels={"worker": os.getpid()})
+
+# ------------------------------------------------------------ Shared metrics
+
+MQTT_MESSAGES = registry.counter("mqtt_messages_total", "MQTT messages handled per topic kind, unmatched topics and invalid sensor ids counted at dispatch", ["kind"])
+MQTT_HANDLING_SECONDS = registry.histogram("mqtt_message_handling_seconds", "Time spent in the handler per topic kind", ["kind"])
+STAGE_SECONDS = registry.histogram("mqtt_stage_seconds", "Time per processing stage of a message", ["stage"])
+DB_COMMIT_SECONDS = registry.histogram("db_commit_seconds", "Database write and commit latency", ["operation"])
+DOOR_ACCESS_SECONDS = registry.histogram("door_access_seconds", "Time from receiving a keycard or pin message to publishing the reply, queueing included", ["kind"])
+MQTT_DUPLICATES = registry.counter("mqtt_duplicates_suppressed_total", "Repeated MQTT messages dropped before handling, per topic kind", ["kind"])
+HTTP_REQUEST_SECONDS = registry.histogram("http_request_seconds", "HTTP request latency per route", ["handler", "method", "status"])
+
+# Children used on the hot path, created once here
+PARSE_SECONDS = STAGE_SECONDS.labels("parse")
+ACCESS_DECISION_SECONDS = STAGE_SECONDS.labels("access_decision")
+DB_WRITE_SECONDS = STAGE_SECONDS.labels("db_write")
+PUBLISH_REPLY_SECONDS = STAGE_SECONDS.labels("publish_reply")
+
+
+class HTTPMetricsMiddleware:
+    """
+    Plain ASGI middleware timing every HTTP request, labelled with the name
+    of the endpoint function so path parameters don't explode the label set.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status = [500]
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            endpoint = scope.get("endpoint")
+            handler = getattr(endpoint, "__name__", "not_found")
+            HTTP_REQUEST_SECONDS.labels(handler, scope["method"], status[0]).observe(time.perf_counter() - started)
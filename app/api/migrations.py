@@ -0,0 +1,115 @@
+"""
+Schema changes for databases created before the current models.
+
+Every step checks the live schema first, so running the whole list at each
+startup is safe. Steps take a sync connection (use conn.run_sync(run_migrations)).
+"""
+import logging
+
+from sqlalchemy import inspect, text, String
+
+from models.monitoring import Reading, Alarm, EntryLog, ReadingRollup
+import rollups
+import partitions
+
+_logger = logging.getLogger(__name__)
+
+# pg_advisory_xact_lock key serialising the schema phase between workers
+SCHEMA_LOCK_ID = 7140213
+
+
+def lock_schema(conn):
+    """
+    Waits until no other worker is changing the schema. Held until the
+    transaction ends, so the next worker sees the finished migrations.
+    """
+    conn.execute(text("SELECT pg_advisory_xact_lock(:id)"), {"id": SCHEMA_LOCK_ID})
+
+
+def readings_numeric_value(conn):
+    """
+    readings.value used to be a string. Convert it in place to double precision,
+    values that are not numbers become NULL instead of failing the migration.
+    """
+    columns = {c["name"]: c for c in inspect(conn).get_columns("readings")}
+    if not isinstance(columns["value"]["type"], String):
+        return
+
+    _logger.warning("Migrating readings.value from text to double precision")
+    conn.execute(text(
+        "ALTER TABLE readings ALTER COLUMN value TYPE double precision "
+        "USING CASE WHEN value ~ '^\\s*-?[0-9]+(\\.[0-9]+)?\\s*$' "
+        "THEN value::double precision END"
+    ))
+
+
+def alarm_clear_columns(conn):
+    """
+    Adds alarms.value_type_id and alarms.cleared_date. Clears used to be
+    stored as separate acknowledged "back to normal" rows, those are kept.
+    """
+    columns = {c["name"] for c in inspect(conn).get_columns("alarms")}
+    if "cleared_date" in columns:
+        return
+
+    _logger.warning("Adding value_type_id and cleared_date to alarms")
+    conn.execute(text(
+        "ALTER TABLE alarms "
+        "ADD COLUMN IF NOT EXISTS value_type_id integer REFERENCES value_types (id), "
+        "ADD COLUMN IF NOT EXISTS cleared_date timestamp without time zone"
+    ))
+
+
+# Indexes replaced by a version with id as the last column
+REPLACED_INDEXES = [
+    "ix_readings_type_created",
+    "ix_readings_type_sensor_created",
+    "ix_alarms_acknowledged_created",
+    "ix_entry_logs_approved_created",
+]
+
+
+def time_series_indexes(conn):
+    """
+    Creates the composite (type, sensor, created_date, id) indexes declared on
+    the models and drops the ones they replace.
+    """
+    for table in (Reading.__table__, Alarm.__table__, EntryLog.__table__):
+        for index in table.indexes:
+            index.create(conn, checkfirst=True)
+    for name in REPLACED_INDEXES:
+        conn.execute(text(f"DROP INDEX IF EXISTS {name}"))
+
+
+def reading_rollups(conn):
+    """
+    Creates reading_rollups and fills it from the readings already stored.
+    """
+    if inspect(conn).has_table("reading_rollups"):
+        return
+
+    _logger.warning("Creating reading_rollups and backfilling from readings")
+    ReadingRollup.__table__.create(conn)
+    rollups.backfill(conn)
+
+
+MIGRATIONS = [
+    readings_numeric_value,
+    # Before partitioning, the copy selects every column of the current model
+    alarm_clear_columns,
+    # Before the indexes, the partitioned tables are created with them and
+    # indexing the old heap right before it is copied and dropped is wasted
+    partitions.partition_tables,
+    time_series_indexes,
+    reading_rollups,
+]
+
+
+def run_migrations(conn):
+    tables = set(inspect(conn).get_table_names())
+    if "readings" not in tables:
+        # Fresh database, create_all builds the current schema directly
+        return
+
+    for migration in MIGRATIONS:
+        migration(conn)
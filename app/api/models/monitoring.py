@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, Boolean, DateTime,func
+from sqlalchemy import Column, Integer, String, Float, ForeignKey, Boolean, DateTime, Index, func
 from sqlalchemy.orm import relationship, declarative_base
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker
@@ -42,15 +42,25 @@ class Door(Base):
 
 class Reading(Base):
     __tablename__ = 'readings'
-    id = Column(Integer, primary_key=True)
+    id = Column(Integer, primary_key=True, autoincrement=True)
     value_type_id = Column(Integer, ForeignKey('value_types.id'))
     sensor_id = Column(Integer, ForeignKey('sensors.id'))
-    value = Column(String)
-    created_date = Column(DateTime, default=func.now())
+    value = Column(Float)
+    # Partition key, so it is part of the primary key (see partitions.py)
+    created_date = Column(DateTime, primary_key=True, default=func.now())
     updated_date = Column(DateTime, default=func.now(), onupdate=func.now())
     sensor = relationship("Sensor", back_populates="readings")
     value_type = relationship("ValueType", back_populates="readings")
 
+    __table_args__ = (
+        # Latest N / range queries per value type, value included for index-only averages. id
+        # last so the (created_date, id) keyset pages come out of the index in order
+        Index('ix_readings_type_created_id', 'value_type_id', 'created_date', 'id', postgresql_include=['value']),
+        # Same queries narrowed to one sensor
+        Index('ix_readings_type_sensor_created_id', 'value_type_id', 'sensor_id', 'created_date', 'id'),
+        {'postgresql_partition_by': 'RANGE (created_date)'},
+    )
+
 class ValueType(Base):
     __tablename__ = 'value_types'
     id = Column(Integer, primary_key=True)
@@ -62,15 +72,23 @@ class ValueType(Base):
 
 class Alarm(Base):
     __tablename__ = 'alarms'
-    id = Column(Integer, primary_key=True)
+    id = Column(Integer, primary_key=True, autoincrement=True)
     sensor_id = Column(Integer, ForeignKey('sensors.id'))
     message = Column(String)
     severity = Column(String)
     is_acknowledged = Column(Boolean)
-    created_date = Column(DateTime, default=func.now())
+    # Which reading raised it, and when the value came back inside its range (NULL while still active)
+    value_type_id = Column(Integer, ForeignKey('value_types.id'))
+    cleared_date = Column(DateTime)
+    created_date = Column(DateTime, primary_key=True, default=func.now())
     updated_date = Column(DateTime, default=func.now(), onupdate=func.now())
     sensor = relationship("Sensor", back_populates="alarms")
 
+    __table_args__ = (
+        Index('ix_alarms_acknowledged_created_id', 'is_acknowledged', 'created_date', 'id'),
+        {'postgresql_partition_by': 'RANGE (created_date)'},
+    )
+
 class Employee(Base):
     __tablename__ = 'employees'
     id = Column(Integer, primary_key=True)
@@ -104,12 +122,35 @@ class KeyFob(Base):
 
 class EntryLog(Base):
     __tablename__ = 'entry_logs'
-    id = Column(Integer, primary_key=True)
+    id = Column(Integer, primary_key=True, autoincrement=True)
     sensor_id = Column(Integer, ForeignKey('sensors.id'))
     key_fob_id = Column(Integer, ForeignKey('key_fobs.id'))
     date = Column(DateTime)
     approved = Column(Boolean)
-    created_date = Column(DateTime, default=func.now())
+    created_date = Column(DateTime, primary_key=True, default=func.now())
     updated_date = Column(DateTime, default=func.now(), onupdate=func.now())
     sensor = relationship("Sensor", back_populates="entry_logs")
-    key_fob = relationship("KeyFob", back_populates="entry_logs")
\ No newline at end of file
+    key_fob = relationship("KeyFob", back_populates="entry_logs")
+
+    __table_args__ = (
+        Index('ix_entry_logs_approved_created_id', 'approved', 'created_date', 'id'),
+        {'postgresql_partition_by': 'RANGE (created_date)'},
+    )
+
+
+# Per sensor / value type aggregates in minute, hour and day buckets, maintained by rollups.py
+class ReadingRollup(Base):
+    __tablename__ = 'reading_rollups'
+    resolution = Column(String, primary_key=True)
+    value_type_id = Column(Integer, ForeignKey('value_types.id'), primary_key=True)
+    sensor_id = Column(Integer, ForeignKey('sensors.id'), primary_key=True)
+    bucket_start = Column(DateTime, primary_key=True)
+    count = Column(Integer, nullable=False)
+    sum = Column(Float, nullable=False)
+    min = Column(Float, nullable=False)
+    max = Column(Float, nullable=False)
+
+    __table_args__ = (
+        # Range sums over all sensors for the average endpoints
+        Index('ix_reading_rollups_type_bucket', 'resolution', 'value_type_id', 'bucket_start'),
+    )
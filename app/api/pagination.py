@@ -0,0 +1,99 @@
+import base64
+import binascii
+import json
+from datetime import datetime
+
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+from sqlalchemy import desc, tuple_
+from sqlalchemy.future import select
+
+from database import async_session
+
+# Rows fetched per round trip from the server side cursor in NDJSON mode
+STREAM_CHUNK = 1000
+
+# Largest page a client can ask for, larger result sets are paged with the cursor
+MAX_PAGE_SIZE = 10000
+
+
+def encode_cursor(created_date: datetime, id: int):
+    raw = f"{created_date.isoformat()}|{id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        created_date, id = raw.split("|")
+        return datetime.fromisoformat(created_date), int(id)
+    except (ValueError, binascii.Error, UnicodeDecodeError):
+        raise ValueError("Invalid cursor")
+
+
+def paginate(stmt, model, cursor, limit, peek=True):
+    """
+    Keyset pagination on (created_date, id), newest first. With peek one row
+    more than limit is fetched so next_page() can tell whether there is another page.
+    """
+    if cursor:
+        try:
+            created_date, id = decode_cursor(cursor)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        stmt = stmt.where(tuple_(model.created_date, model.id) < (created_date, id))
+    return stmt.order_by(desc(model.created_date), desc(model.id)).limit(limit + 1 if peek else limit)
+
+
+def next_page(rows, limit):
+    """
+    Returns (rows of this page, cursor of the next page or None).
+    """
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(rows[-1].created_date, rows[-1].id)
+
+
+async def fetch_page(session, stmt, model, cursor, limit):
+    result = await session.execute(paginate(stmt, model, cursor, limit))
+    return next_page(result.scalars().all(), limit)
+
+
+def select_columns(model):
+    """
+    Plain column select, used for streaming without building ORM objects.
+    """
+    return select(*model.__table__.columns)
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+
+def ndjson_response(queries):
+    """
+    Streams the rows of each (table name, statement) pair as one JSON object
+    per line. Rows come from a server side cursor in chunks of STREAM_CHUNK,
+    so memory use does not depend on the table size.
+
+    Statements should select plain columns (select(*Model.__table__.columns)).
+    The name is added as a "table" key when it is not None.
+    """
+    async def rows():
+        # Own session, the request's session is closed before the body is sent
+        async with async_session() as session:
+            for name, stmt in queries:
+                result = await session.stream(stmt.execution_options(yield_per=STREAM_CHUNK))
+                async for partition in result.partitions():
+                    lines = []
+                    for row in partition:
+                        record = row._asdict()
+                        if name is not None:
+                            record = {"table": name, **record}
+                        lines.append(json.dumps(record, default=_json_default))
+                    yield "\n".join(lines) + "\n"
+
+    return StreamingResponse(rows(), media_type="application/x-ndjson")
@@ -0,0 +1,206 @@
+import asyncio
+import logging
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import text, inspect
+
+from models.monitoring import Base
+
+_logger = logging.getLogger(__name__)
+
+# Tables partitioned by month on created_date, see the models
+PARTITIONED_TABLES = ("readings", "alarms", "entry_logs")
+
+# Serialises partition DDL between gunicorn workers
+MAINTENANCE_LOCK_ID = 7140214
+
+
+def month_start(day):
+    return date(day.year, day.month, 1)
+
+
+def add_months(day, months):
+    month = day.month - 1 + months
+    return date(day.year + month // 12, month % 12 + 1, 1)
+
+
+def partition_name(table, month):
+    return f"{table}_p{month:%Y_%m}"
+
+
+def partition_month(table, name):
+    """
+    Inverse of partition_name(), None for anything that isn't a monthly partition.
+    """
+    prefix = f"{table}_p"
+    if not name.startswith(prefix):
+        return None
+    try:
+        return datetime.strptime(name[len(prefix):], "%Y_%m").date()
+    except ValueError:
+        return None
+
+
+def is_partitioned(conn, table):
+    return conn.execute(
+        text("SELECT c.relkind = 'p' FROM pg_class c WHERE c.relname = :table AND pg_table_is_visible(c.oid)"),
+        {"table": table},
+    ).scalar() or False
+
+
+def list_partitions(conn, table):
+    return conn.execute(text(
+        "SELECT child.relname FROM pg_inherits "
+        "JOIN pg_class parent ON parent.oid = pg_inherits.inhparent "
+        "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+        "WHERE parent.relname = :table"
+    ), {"table": table}).scalars().all()
+
+
+def create_partition(conn, table, month):
+    name = partition_name(table, month)
+    conn.execute(text(
+        f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF {table} "
+        f"FOR VALUES FROM ('{month:%Y-%m-%d}') TO ('{add_months(month, 1):%Y-%m-%d}')"
+    ))
+    return name
+
+
+def ensure_partitions(conn, months_ahead=3, first_month=None, tables=PARTITIONED_TABLES):
+    """
+    Creates the monthly partitions from first_month (default: this month) up
+    to months_ahead months from now, plus a default partition for rows
+    outside every range (e.g. device timestamps far in the past).
+    """
+    this_month = month_start(date.today())
+    for table in tables:
+        if not is_partitioned(conn, table):
+            continue
+        conn.execute(text(f"CREATE TABLE IF NOT EXISTS {table}_default PARTITION OF {table} DEFAULT"))
+        month = month_start(first_month) if first_month else this_month
+        while month <= add_months(this_month, months_ahead):
+            create_partition(conn, table, month)
+            month = add_months(month, 1)
+
+
+def drop_expired_partitions(conn, table, keep_months):
+    """
+    Drops the monthly partitions that end before the retention cutoff.
+    keep_months = 0 keeps everything.
+    """
+    if not keep_months:
+        return []
+    cutoff = add_months(month_start(date.today()), -keep_months)
+    dropped = []
+    for name in list_partitions(conn, table):
+        month = partition_month(table, name)
+        if month is not None and add_months(month, 1) <= cutoff:
+            conn.execute(text(f"DROP TABLE {name}"))
+            dropped.append(name)
+    return dropped
+
+
+def prune_minute_rollups(conn, keep_days):
+    """
+    Minute rollups are the bulk of reading_rollups, hour and day buckets are kept.
+    """
+    if not keep_days:
+        return 0
+    cutoff = datetime.combine(date.today() - timedelta(days=keep_days), datetime.min.time())
+    result = conn.execute(
+        text("DELETE FROM reading_rollups WHERE resolution = 'minute' AND bucket_start < :cutoff"),
+        {"cutoff": cutoff},
+    )
+    return result.rowcount
+
+
+def convert_to_partitioned(conn, table):
+    """
+    Moves an existing plain table into a new partitioned table of the same name.
+    The old table, its primary key, indexes and id sequence are renamed out of
+    the way, the rows are copied and the old table is dropped.
+    """
+    model_table = Base.metadata.tables[table]
+    old = f"{table}_unpartitioned"
+    _logger.warning(f"Converting {table} to a partitioned table, this copies every row once")
+
+    conn.execute(text(f"ALTER TABLE {table} RENAME TO {old}"))
+    conn.execute(text(f"ALTER TABLE {old} RENAME CONSTRAINT {table}_pkey TO {old}_pkey"))
+    conn.execute(text(f"ALTER SEQUENCE IF EXISTS {table}_id_seq RENAME TO {old}_id_seq"))
+    for index in model_table.indexes:
+        conn.execute(text(f"ALTER INDEX IF EXISTS {index.name} RENAME TO {index.name}_unpartitioned"))
+
+    model_table.create(conn)
+    first = conn.execute(text(f"SELECT min(created_date) FROM {old}")).scalar()
+    ensure_partitions(conn, first_month=first.date() if first else None, tables=(table,))
+
+    columns = ", ".join(column.name for column in model_table.columns)
+    selected = ", ".join(
+        # created_date is now part of the primary key and can't be NULL
+        "coalesce(created_date, updated_date, now())" if column.name == "created_date" else column.name
+        for column in model_table.columns
+    )
+    conn.execute(text(f"INSERT INTO {table} ({columns}) SELECT {selected} FROM {old}"))
+    conn.execute(text(f"SELECT setval('{table}_id_seq', coalesce((SELECT max(id) FROM {table}), 0) + 1, false)"))
+    conn.execute(text(f"DROP TABLE {old}"))
+
+
+def partition_tables(conn):
+    """
+    Migration step: converts the tables that still are plain heaps.
+    """
+    existing = set(inspect(conn).get_table_names())
+    for table in PARTITIONED_TABLES:
+        if table in existing and not is_partitioned(conn, table):
+            convert_to_partitioned(conn, table)
+
+
+class PartitionMaintainer:
+    """
+    Background job that creates partitions ahead of time and applies the
+    retention policy. Old readings are "downsampled" by dropping their raw
+    partitions: their hour and day rollups stay in reading_rollups.
+    """
+
+    def __init__(self, engine, months_ahead=3, retention_months=None, minute_rollup_days=0, interval=6 * 3600):
+        self.engine = engine
+        self.months_ahead = months_ahead
+        # table -> months to keep, 0 keeps everything
+        self.retention_months = retention_months or {}
+        self.minute_rollup_days = minute_rollup_days
+        self.interval = interval
+        self._task = None
+        self.stats = {"runs": 0, "failures": 0, "dropped_partitions": [], "pruned_minute_rollups": 0, "last_run": None}
+
+    def run_once(self, conn):
+        # Other workers skip this run while one of them holds the lock
+        if not conn.execute(text("SELECT pg_try_advisory_xact_lock(:id)"), {"id": MAINTENANCE_LOCK_ID}).scalar():
+            return
+        ensure_partitions(conn, self.months_ahead)
+        for table, keep_months in self.retention_months.items():
+            dropped = drop_expired_partitions(conn, table, keep_months)
+            if dropped:
+                _logger.warning(f"Retention dropped partitions {', '.join(dropped)}")
+                self.stats["dropped_partitions"].extend(dropped)
+        self.stats["pruned_minute_rollups"] += prune_minute_rollups(conn, self.minute_rollup_days)
+
+    async def _run(self):
+        while True:
+            try:
+                async with self.engine.begin() as conn:
+                    await conn.run_sync(self.run_once)
+                self.stats["runs"] += 1
+                self.stats["last_run"] = datetime.now()
+            except Exception:
+                self.stats["failures"] += 1
+                _logger.exception("Partition maintenance failed")
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
@@ -0,0 +1,158 @@
+import math
+import re
+import struct
+from datetime import datetime
+
+# Compiled once at import, not per message
+RETURN_ADDRESS_PATTERN = re.compile(r'(?<=\+).+')
+ACCESS_CODE_PATTERN = re.compile(r'!(.*?)\+')
+
+
+# ------------------------------------------------------------ Telemetry
+#
+# Temperature/humidity messages come in three forms, told apart by the first byte:
+#
+#   text     "T: 22, H: 45"
+#   batch    "T: 22.5, H: 45 @1700000000; T: 22.6, H: 44 @1700000060"
+#            samples separated by ";", "@<unix seconds>" is optional per sample
+#   binary   header  <magic 0xA5> <version> <flags> <sample count>
+#            [uint32 base unix time, if FLAG_TIMESTAMP]
+#            samples [uint16 seconds after base, if FLAG_TIMESTAMP]
+#                    int16 temperature and uint16 humidity in hundredths
+#
+# All little endian. Every form decodes to a list of
+# (temperature, humidity, created_date or None) samples.
+
+BINARY_MAGIC = 0xA5
+BINARY_VERSION = 1
+FLAG_TIMESTAMP = 0x01
+
+BINARY_HEADER = struct.Struct("<BBBB")
+BINARY_BASE_TIME = struct.Struct("<I")
+BINARY_SAMPLE = struct.Struct("<hH")
+BINARY_TIMED_SAMPLE = struct.Struct("<HhH")
+
+
+def _number(text: str):
+    text = text.strip()
+    try:
+        return int(text)
+    except ValueError:
+        number = float(text)
+    # float() also takes "nan", "inf" and "1e400", none of them fit a reading or JSON
+    if not math.isfinite(number):
+        raise ValueError(f"Not a finite number: {text}")
+    return number
+
+
+def _parse_text_sample(sample: str):
+    sample, has_time, stamp = sample.partition("@")
+    temperature_part, _, humidity_part = sample.partition(",")
+    temperature_key, _, temperature = temperature_part.partition(":")
+    humidity_key, _, humidity = humidity_part.partition(":")
+    if temperature_key.strip() != "T" or humidity_key.strip() != "H":
+        raise ValueError("Invalid temperature/humidity format")
+    created_date = datetime.fromtimestamp(int(stamp)) if has_time else None
+    return _number(temperature), _number(humidity), created_date
+
+
+def decode_text_telemetry(payload: str):
+    try:
+        return [_parse_text_sample(sample) for sample in payload.split(";") if sample.strip()]
+    except (ValueError, OverflowError, OSError):
+        raise ValueError("Invalid temperature/humidity format")
+
+
+def decode_binary_telemetry(payload: bytes):
+    if len(payload) < BINARY_HEADER.size:
+        raise ValueError("Binary telemetry shorter than its header")
+    _, version, flags, count = BINARY_HEADER.unpack_from(payload)
+    if version != BINARY_VERSION:
+        raise ValueError(f"Unsupported binary telemetry version {version}")
+
+    offset = BINARY_HEADER.size
+    timed = flags & FLAG_TIMESTAMP
+    if timed:
+        if len(payload) < offset + BINARY_BASE_TIME.size:
+            raise ValueError("Binary telemetry is missing its timestamp")
+        base_time, = BINARY_BASE_TIME.unpack_from(payload, offset)
+        offset += BINARY_BASE_TIME.size
+
+    layout = BINARY_TIMED_SAMPLE if timed else BINARY_SAMPLE
+    if len(payload) != offset + count * layout.size:
+        raise ValueError(f"Binary telemetry has {len(payload) - offset} sample bytes, expected {count * layout.size}")
+
+    samples = []
+    for fields in layout.iter_unpack(payload[offset:]):
+        if timed:
+            delta, temperature, humidity = fields
+            created_date = datetime.fromtimestamp(base_time + delta)
+        else:
+            (temperature, humidity), created_date = fields, None
+        samples.append((temperature / 100, humidity / 100, created_date))
+    return samples
+
+
+def decode_telemetry(payload: bytes):
+    """
+    Decodes any of the telemetry forms into [(temperature, humidity, created_date or None)].
+    """
+    if payload[:1] == bytes((BINARY_MAGIC,)):
+        return decode_binary_telemetry(payload)
+    try:
+        text = payload.decode()
+    except UnicodeDecodeError:
+        raise ValueError("Telemetry is neither text nor binary")
+    return decode_text_telemetry(text)
+
+
+def has_device_timestamp(payload: bytes):
+    """
+    True if the payload carries sample times, without decoding it.
+    """
+    if payload[:1] == bytes((BINARY_MAGIC,)):
+        return len(payload) > 2 and bool(payload[2] & FLAG_TIMESTAMP)
+    return b"@" in payload
+
+
+def encode_binary_telemetry(samples, base_time=None):
+    """
+    Packs [(temperature, humidity, unix seconds or None)] the way a device
+    does. With base_time every sample needs a time within 18 hours after it.
+    """
+    flags = FLAG_TIMESTAMP if base_time is not None else 0
+    parts = [BINARY_HEADER.pack(BINARY_MAGIC, BINARY_VERSION, flags, len(samples))]
+    if base_time is not None:
+        parts.append(BINARY_BASE_TIME.pack(int(base_time)))
+    for temperature, humidity, at in samples:
+        temperature, humidity = round(temperature * 100), round(humidity * 100)
+        if base_time is not None:
+            parts.append(BINARY_TIMED_SAMPLE.pack(int(at - base_time), temperature, humidity))
+        else:
+            parts.append(BINARY_SAMPLE.pack(temperature, humidity))
+    return b"".join(parts)
+
+
+def extract_temp_humidity(payload: str):
+    """
+    Parses "T: 22, H: 45" into (22, 45).
+    """
+    temperature, humidity, _ = _parse_text_sample(payload)
+    return temperature, humidity
+
+
+def parse_access_payload(payload: str):
+    """
+    Parses "!<code>+<return topic>" into (return topic, code).
+    Returns (None, None) if either part is missing.
+    """
+    return_address = RETURN_ADDRESS_PATTERN.search(payload)
+    code = ACCESS_CODE_PATTERN.search(payload)
+    if return_address and code:
+        return return_address.group(0), code.group(1)
+    return None, None
+
+
+# Keycards and pins share the same payload format
+parse_payload_keycard = parse_access_payload
+parse_payload_pin = parse_access_payload
@@ -0,0 +1,195 @@
+import csv
+import json
+import logging
+
+from pydantic import ValidationError
+from sqlalchemy import insert
+from sqlalchemy.exc import DBAPIError
+
+from database import async_session
+from models.monitoring import Device, Sensor, Door, KeyFob, Employee, Guest
+from schema.monitoring_schema import DeviceSchema, SensorSchema, DoorSchema, KeyFobSchema, EmployeeSchema, GuestSchema
+
+_logger = logging.getLogger(__name__)
+
+# Rows per INSERT and transaction
+CHUNK_SIZE = 1000
+# Errors listed in the response, the count is always complete
+MAX_ERRORS = 1000
+
+
+class BulkKind:
+    def __init__(self, schema, model, key_fob=False):
+        self.schema = schema
+        self.model = model
+        # Employees and guests carry a nested key_fob that is inserted first
+        self.key_fob = key_fob
+
+
+KINDS = {
+    "devices": BulkKind(DeviceSchema, Device),
+    "sensors": BulkKind(SensorSchema, Sensor),
+    "doors": BulkKind(DoorSchema, Door),
+    "keyfobs": BulkKind(KeyFobSchema, KeyFob),
+    "employees": BulkKind(EmployeeSchema, Employee, key_fob=True),
+    "guests": BulkKind(GuestSchema, Guest, key_fob=True),
+}
+
+
+# ------------------------------------------------------------ Parsing
+
+async def _lines(stream):
+    """
+    Splits the request body into lines as it arrives, without buffering the whole upload.
+    """
+    pending = b""
+    async for chunk in stream:
+        pending += chunk
+        *lines, pending = pending.split(b"\n")
+        for line in lines:
+            yield line.decode("utf-8-sig").rstrip("\r")
+    if pending:
+        yield pending.decode("utf-8-sig").rstrip("\r")
+
+
+def _nest(flat):
+    """
+    CSV columns like key_fob.key become {"key_fob": {"key": ...}}, empty cells become None.
+    """
+    record = {}
+    for column, value in flat.items():
+        target = record
+        *parents, name = column.strip().split(".")
+        for parent in parents:
+            target = target.setdefault(parent, {})
+        target[name] = value if value != "" else None
+    return record
+
+
+async def iter_records(stream, format):
+    """
+    Yields (line number, dict or None, error) for an ndjson or csv body.
+    CSV needs a header row and one record per line.
+    """
+    header = None
+    line_number = 0
+    async for line in _lines(stream):
+        line_number += 1
+        if not line.strip():
+            continue
+        if format == "csv":
+            values = next(csv.reader([line]))
+            if header is None:
+                header = values
+                continue
+            if len(values) != len(header):
+                yield line_number, None, f"Expected {len(header)} columns, got {len(values)}"
+                continue
+            yield line_number, _nest(dict(zip(header, values))), None
+        else:
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                yield line_number, None, f"Invalid JSON: {e}"
+                continue
+            if not isinstance(record, dict):
+                yield line_number, None, "Expected a JSON object"
+                continue
+            yield line_number, record, None
+
+
+# ------------------------------------------------------------ Loading
+
+async def _insert_rows(session, kind, rows):
+    """
+    Inserts validated rows, returns their new ids in the same order.
+    """
+    if kind.key_fob:
+        key_fob_ids = (await session.execute(
+            insert(KeyFob).returning(KeyFob.id, sort_by_parameter_order=True),
+            [row.pop("key_fob") for row in rows],
+        )).scalars().all()
+        for row, key_fob_id in zip(rows, key_fob_ids):
+            row["key_fob_id"] = key_fob_id
+
+    return (await session.execute(
+        insert(kind.model).returning(kind.model.id, sort_by_parameter_order=True),
+        rows,
+    )).scalars().all()
+
+
+class BulkResult:
+    def __init__(self, kind):
+        self.kind = kind
+        self.created = []
+        self.failed = 0
+        self.errors = []
+
+    def error(self, line, detail):
+        self.failed += 1
+        if len(self.errors) < MAX_ERRORS:
+            self.errors.append({"line": line, "errors": detail})
+
+    def as_dict(self):
+        return {
+            "kind": self.kind,
+            "inserted": len(self.created),
+            "failed": self.failed,
+            "created": [{"line": line, "id": id} for line, id in self.created],
+            "errors": self.errors,
+            "errors_truncated": self.failed > len(self.errors),
+        }
+
+
+async def _load_chunk(kind, chunk, result):
+    """
+    One transaction per chunk. When the database rejects the chunk (say a
+    device_id that doesn't exist) the rows are retried one by one in
+    savepoints, so only the offending rows are reported and skipped.
+    """
+    lines = [line for line, _ in chunk]
+    try:
+        async with async_session() as session:
+            ids = await _insert_rows(session, kind, [dict(row) for _, row in chunk])
+            await session.commit()
+        result.created.extend(zip(lines, ids))
+        return
+    except DBAPIError as e:
+        _logger.info(f"Bulk {result.kind} chunk rejected, retrying row by row: {e.orig}")
+
+    async with async_session() as session:
+        for line, row in chunk:
+            try:
+                async with session.begin_nested():
+                    ids = await _insert_rows(session, kind, [dict(row)])
+                result.created.append((line, ids[0]))
+            except DBAPIError as e:
+                result.error(line, [{"msg": str(e.orig).splitlines()[0]}])
+        await session.commit()
+
+
+async def bulk_load(kind_name, stream, format="ndjson", chunk_size=CHUNK_SIZE):
+    """
+    Validates every record with the create endpoint's schema and inserts the
+    valid ones in chunks of chunk_size rows. Invalid rows are reported with
+    their line number and skipped.
+    """
+    kind = KINDS[kind_name]
+    result = BulkResult(kind_name)
+    chunk = []
+    async for line, record, error in iter_records(stream, format):
+        if error is not None:
+            result.error(line, [{"msg": error}])
+            continue
+        try:
+            row = kind.schema.model_validate(record).model_dump()
+        except ValidationError as e:
+            result.error(line, e.errors(include_url=False, include_context=False, include_input=False))
+            continue
+        chunk.append((line, row))
+        if len(chunk) >= chunk_size:
+            await _load_chunk(kind, chunk, result)
+            chunk = []
+    if chunk:
+        await _load_chunk(kind, chunk, result)
+    return result.as_dict()
@@ -0,0 +1,54 @@
+import time
+from contextlib import contextmanager
+
+
+class Readiness:
+    """
+    Startup phase timings and whether this worker is ready for traffic.
+
+    A worker is warm once migrations ran and the access cache and database
+    pool are loaded; only then does it subscribe to the device topics, so the
+    first messages don't pay for cold caches. /ready answers 200 once the
+    worker is warm and, if it ingests, subscribed.
+    """
+
+    def __init__(self, started_at):
+        # time.perf_counter() at the top of the app module, imports included
+        self.started_at = started_at
+        self.phases = {}
+        self.warm = False
+        self.subscribed = False
+        self.ready_after = None
+
+    @contextmanager
+    def phase(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = round(time.perf_counter() - started, 4)
+
+    def mark(self, name):
+        """
+        Records the time since started_at, e.g. for the end of the imports.
+        """
+        self.phases[name] = round(time.perf_counter() - self.started_at, 4)
+
+    def is_ready(self, ingesting, require_subscription=True):
+        if not require_subscription:
+            # The HTTP API works without the broker
+            return self.warm
+        ready = self.warm and (self.subscribed or not ingesting)
+        if ready and self.ready_after is None:
+            self.ready_after = round(time.perf_counter() - self.started_at, 4)
+        return ready
+
+    def snapshot(self, ingesting, require_subscription=True):
+        return {
+            "ready": self.is_ready(ingesting, require_subscription),
+            "warm": self.warm,
+            "subscribed": self.subscribed,
+            "ingesting": ingesting,
+            "phases": self.phases,
+            "ready_after": self.ready_after,
+        }
@@ -0,0 +1,104 @@
+import hashlib
+import time
+from collections import OrderedDict
+
+from fastapi import Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+# Data a cached response can depend on, bumped by the code that writes it
+TAGS = ("readings", "alarms", "entry_logs", "metadata")
+
+
+class CachedResponse:
+    __slots__ = ("body", "etag", "versions", "expires_at")
+
+    def __init__(self, body, etag, versions, expires_at):
+        self.body = body
+        self.etag = etag
+        self.versions = versions
+        self.expires_at = expires_at
+
+
+class ResponseCache:
+    """
+    Rendered JSON bodies of the polled read endpoints, keyed by path and query
+    parameters, bounded to max_entries (least recently used are evicted).
+
+    Each entry remembers the version of the tags it depends on; the write paths
+    call invalidate(tag) after committing, which makes every entry built from
+    older data stale at once. ttl bounds how stale an entry can get from writes
+    made through other workers. Responses carry an ETag derived from the body,
+    so a client sending it back in If-None-Match gets an empty 304.
+    """
+
+    def __init__(self, max_entries=256, ttl=5.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._versions = dict.fromkeys(TAGS, 0)
+        self.stats = {"hits": 0, "misses": 0, "not_modified": 0, "evictions": 0, "invalidations": 0}
+
+    def invalidate(self, *tags):
+        for tag in tags or TAGS:
+            self._versions[tag] += 1
+        self.stats["invalidations"] += 1
+
+    def _lookup(self, key, tags):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry.expires_at < time.monotonic() or any(entry.versions[tag] != self._versions[tag] for tag in tags):
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def _store(self, key, entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def _respond(self, request, entry):
+        headers = {"ETag": entry.etag, "Cache-Control": "no-cache"}
+        if request.headers.get("if-none-match") == entry.etag:
+            self.stats["not_modified"] += 1
+            return Response(status_code=304, headers=headers)
+        return Response(content=entry.body, media_type="application/json", headers=headers)
+
+    async def respond(self, request, tags, build):
+        """
+        Serves the request from the cache or from `await build()`. build() may
+        return a Response (e.g. a streamed ndjson page), which is never cached.
+        """
+        key = (request.url.path, tuple(sorted(request.query_params.multi_items())))
+        entry = self._lookup(key, tags)
+        if entry is not None:
+            self.stats["hits"] += 1
+            return self._respond(request, entry)
+
+        self.stats["misses"] += 1
+        # Taken before the query, a write that lands meanwhile makes the entry stale
+        versions = {tag: self._versions[tag] for tag in tags}
+        payload = await build()
+        if isinstance(payload, Response):
+            return payload
+
+        body = JSONResponse(jsonable_encoder(payload)).body
+        etag = '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+        entry = CachedResponse(body, etag, versions, time.monotonic() + self.ttl)
+        self._store(key, entry)
+        return self._respond(request, entry)
+
+    def snapshot(self):
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return {
+            **self.stats,
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl": self.ttl,
+            "hit_ratio": self.stats["hits"] / lookups if lookups else 0.0,
+            "versions": dict(self._versions),
+        }
@@ -0,0 +1,178 @@
+from datetime import datetime, time
+
+from sqlalchemy import and_, func, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.future import select
+
+from models.monitoring import Reading, ReadingRollup
+
+# Coarsest first, used to pick the cheapest resolution for a range
+RESOLUTIONS = ("day", "hour", "minute")
+
+
+def bucket_start(created_date: datetime, resolution):
+    if resolution == "minute":
+        return created_date.replace(second=0, microsecond=0)
+    if resolution == "hour":
+        return created_date.replace(minute=0, second=0, microsecond=0)
+    if resolution == "day":
+        return created_date.replace(hour=0, minute=0, second=0, microsecond=0)
+    raise ValueError(f"Unknown resolution {resolution}")
+
+
+def aggregate(rows):
+    """
+    Folds a batch of reading dicts (as queued in ReadingBuffer) into one
+    rollup row per resolution, sensor, value type and bucket.
+    """
+    buckets = {}
+    for row in rows:
+        value = row["value"]
+        if value is None:
+            continue
+        for resolution in RESOLUTIONS:
+            key = (resolution, row["value_type_id"], row["sensor_id"], bucket_start(row["created_date"], resolution))
+            bucket = buckets.get(key)
+            if bucket is None:
+                buckets[key] = [1, value, value, value]
+            else:
+                bucket[0] += 1
+                bucket[1] += value
+                bucket[2] = min(bucket[2], value)
+                bucket[3] = max(bucket[3], value)
+
+    return [
+        {
+            "resolution": resolution,
+            "value_type_id": value_type_id,
+            "sensor_id": sensor_id,
+            "bucket_start": start,
+            "count": count,
+            "sum": total,
+            "min": low,
+            "max": high,
+        }
+        for (resolution, value_type_id, sensor_id, start), (count, total, low, high) in buckets.items()
+    ]
+
+
+_table = ReadingRollup.__table__
+_upsert = pg_insert(_table)
+UPSERT = _upsert.on_conflict_do_update(
+    index_elements=[_table.c.resolution, _table.c.value_type_id, _table.c.sensor_id, _table.c.bucket_start],
+    set_={
+        "count": _table.c.count + _upsert.excluded.count,
+        "sum": _table.c.sum + _upsert.excluded.sum,
+        "min": func.least(_table.c.min, _upsert.excluded.min),
+        "max": func.greatest(_table.c.max, _upsert.excluded.max),
+    },
+)
+
+
+async def apply(session, rows):
+    """
+    Adds a batch of readings to the rollups. Runs in the caller's transaction,
+    so rollups and raw rows are committed together.
+    """
+    aggregates = aggregate(rows)
+    if aggregates:
+        await session.execute(UPSERT, aggregates)
+
+
+# Backfill for readings that were stored before rollups existed.
+# The resolution is formatted in (not bound) so SELECT and GROUP BY use the same expression.
+BACKFILL_SQL = """
+INSERT INTO reading_rollups (resolution, value_type_id, sensor_id, bucket_start, count, sum, min, max)
+SELECT '{resolution}', value_type_id, sensor_id, date_trunc('{resolution}', created_date),
+       count(value), sum(value), min(value), max(value)
+FROM readings
+WHERE value IS NOT NULL AND value_type_id IS NOT NULL AND sensor_id IS NOT NULL AND created_date IS NOT NULL
+GROUP BY value_type_id, sensor_id, date_trunc('{resolution}', created_date)
+"""
+
+
+def backfill(conn):
+    for resolution in RESOLUTIONS:
+        conn.execute(text(BACKFILL_SQL.format(resolution=resolution)))
+
+
+# ------------------------------------------------------------ Queries
+
+def aligned_resolution(date_from: datetime, date_to: datetime):
+    """
+    Returns the coarsest resolution whose buckets start exactly at both ends
+    of the range, or None if the range has to be read from raw readings.
+    """
+    for resolution in RESOLUTIONS:
+        if bucket_start(date_from, resolution) == date_from and bucket_start(date_to, resolution) == date_to:
+            return resolution
+    return None
+
+
+def as_datetime(value):
+    if isinstance(value, datetime):
+        return value
+    return datetime.combine(value, time.min)
+
+
+async def average(session, value_type_id, date_from, date_to):
+    """
+    Same result as avg(value) over readings with date_from <= created_date <= date_to,
+    read from the rollups when the range is bucket aligned.
+    Returns (average, True) when served from rollups, (None, False) when it was not possible.
+    """
+    date_from, date_to = as_datetime(date_from), as_datetime(date_to)
+    resolution = aligned_resolution(date_from, date_to)
+    if resolution is None or date_from > date_to:
+        return None, False
+
+    buckets = await session.execute(
+        select(func.coalesce(func.sum(ReadingRollup.sum), 0), func.coalesce(func.sum(ReadingRollup.count), 0))
+        .where(and_(
+            ReadingRollup.resolution == resolution,
+            ReadingRollup.value_type_id == value_type_id,
+            ReadingRollup.bucket_start >= date_from,
+            ReadingRollup.bucket_start < date_to,
+        ))
+    )
+    total, count = buckets.one()
+
+    # The raw endpoints include readings stamped exactly at date_to
+    edge = await session.execute(
+        select(func.coalesce(func.sum(Reading.value), 0), func.count(Reading.value))
+        .where(and_(Reading.value_type_id == value_type_id, Reading.created_date == date_to))
+    )
+    edge_total, edge_count = edge.one()
+
+    count += edge_count
+    if not count:
+        return None, True
+    return (total + edge_total) / count, True
+
+
+async def series(session, sensor_id, value_type_id, date_from, date_to, resolution):
+    """
+    Downsampled series for one sensor, one row per non-empty bucket in [date_from, date_to).
+    """
+    date_from = bucket_start(as_datetime(date_from), resolution)
+    result = await session.execute(
+        select(ReadingRollup)
+        .where(and_(
+            ReadingRollup.resolution == resolution,
+            ReadingRollup.value_type_id == value_type_id,
+            ReadingRollup.sensor_id == sensor_id,
+            ReadingRollup.bucket_start >= date_from,
+            ReadingRollup.bucket_start < as_datetime(date_to),
+        ))
+        .order_by(ReadingRollup.bucket_start)
+    )
+    return [
+        {
+            "bucket_start": rollup.bucket_start,
+            "count": rollup.count,
+            "average": rollup.sum / rollup.count,
+            "min": rollup.min,
+            "max": rollup.max,
+        }
+        for rollup in result.scalars()
+    ]
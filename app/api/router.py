@@ -0,0 +1,104 @@
+import logging
+import time
+from typing import Any, Awaitable, Callable, NamedTuple
+
+from metrics import MQTT_MESSAGES, MQTT_HANDLING_SECONDS
+
+_logger = logging.getLogger(__name__)
+
+# Largest sensor id that fits sensors.id (a postgres integer) and the spool records
+MAX_SENSOR_ID = 2**31 - 1
+
+
+def valid_sensor_id(sensor_id):
+    return sensor_id.isascii() and sensor_id.isdigit() and int(sensor_id) <= MAX_SENSOR_ID
+
+
+class TopicMessage(NamedTuple):
+    topic: str
+    device_id: str
+    sensor_id: str
+    kind: str
+    payload: bytes
+    properties: Any
+    # time.perf_counter() when the message came off the MQTT client
+    received_at: float = 0.0
+
+
+class Route(NamedTuple):
+    kind: str
+    handler: Callable[[TopicMessage], Awaitable[None]]
+    # Work queue lane the message is processed in, see work_queue.py
+    lane: str
+
+
+class TopicRouter:
+    """
+    Dispatches MQTT messages on topics shaped like /mqtt/<device>/<sensor>/<kind>
+    to the handler registered for <kind>.
+
+    Handlers are registered once at import with @router.route("kind"), so the
+    per message work is one rsplit and one dict lookup:
+
+        @router.route("temperature")
+        async def handle_temperature(message: TopicMessage):
+            ...
+    """
+
+    def __init__(self):
+        self._handlers = {}
+        self.stats = {"dispatched": 0, "unmatched": 0, "invalid_sensor": 0}
+        self._unmatched_counter = MQTT_MESSAGES.labels("unmatched")
+        self._invalid_sensor_counter = MQTT_MESSAGES.labels("invalid_sensor")
+
+    def route(self, kind, lane="telemetry"):
+        def decorator(handler):
+            if kind in self._handlers:
+                raise ValueError(f"A handler for '{kind}' is already registered")
+            self._handlers[kind] = Route(kind, self._timed(kind, handler), lane)
+            return handler
+        return decorator
+
+    @staticmethod
+    def _timed(kind, handler):
+        received = MQTT_MESSAGES.labels(kind)
+        handling_seconds = MQTT_HANDLING_SECONDS.labels(kind)
+
+        async def timed_handler(message):
+            received.inc()
+            started = time.perf_counter()
+            try:
+                await handler(message)
+            finally:
+                handling_seconds.observe(time.perf_counter() - started)
+
+        return timed_handler
+
+    def resolve(self, topic, payload, properties=None):
+        """
+        Returns (Route, TopicMessage) for a topic, or (None, None) if no handler
+        matches or the sensor part isn't a sensor id the database can hold.
+        """
+        parts = topic.rsplit("/", 3)
+        route = self._handlers.get(parts[-1]) if len(parts) == 4 else None
+        if route is None:
+            self.stats["unmatched"] += 1
+            self._unmatched_counter.inc()
+            _logger.debug("No handler for topic", extra={"topic": topic})
+            return None, None
+        if not valid_sensor_id(parts[2]):
+            self.stats["invalid_sensor"] += 1
+            self._invalid_sensor_counter.inc()
+            _logger.warning("Ignoring message with invalid sensor id", extra={"topic": topic})
+            return None, None
+        self.stats["dispatched"] += 1
+        return route, TopicMessage(topic, parts[1], parts[2], parts[3], payload, properties, time.perf_counter())
+
+    async def dispatch(self, topic, payload, properties=None):
+        route, message = self.resolve(topic, payload, properties)
+        if route is not None:
+            await route.handler(message)
+
+    @property
+    def kinds(self):
+        return list(self._handlers)
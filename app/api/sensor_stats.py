@@ -0,0 +1,98 @@
+from sqlalchemy import and_, extract, func
+from sqlalchemy.dialects.postgresql import array
+from sqlalchemy.future import select
+
+from models.monitoring import Reading
+
+DEFAULT_PERCENTILES = (0.5, 0.95, 0.99)
+
+# Keeps one request from asking for an unbounded IN list
+MAX_IDS = 1000
+
+
+def parse_ids(text, name):
+    """
+    "1,2,3" -> [1, 2, 3], None or "" -> None (all).
+    """
+    if not text:
+        return None
+    try:
+        ids = sorted({int(part) for part in text.split(",") if part.strip()})
+    except ValueError:
+        raise ValueError(f"{name} must be a comma separated list of ids")
+    if len(ids) > MAX_IDS:
+        raise ValueError(f"At most {MAX_IDS} {name} per request")
+    return ids
+
+
+def parse_percentiles(text):
+    if not text:
+        return DEFAULT_PERCENTILES
+    try:
+        percentiles = tuple(float(part) for part in text.split(",") if part.strip())
+    except ValueError:
+        raise ValueError("percentiles must be a comma separated list of fractions")
+    if not percentiles or not all(0 <= p <= 1 for p in percentiles):
+        raise ValueError("percentiles must be between 0 and 1")
+    return percentiles
+
+
+def percentile_label(p):
+    return f"p{p * 100:g}"
+
+
+async def sensor_statistics(session, date_from, date_to, sensor_ids=None, value_type_ids=None, percentiles=DEFAULT_PERCENTILES):
+    """
+    count, min, max, mean, stddev, percentiles and the rate of change (least
+    squares slope, per hour) of the readings in [date_from, date_to], one row
+    per sensor and value type. Everything is computed by Postgres in a single
+    grouped scan, only the aggregates come back.
+    """
+    epoch = extract("epoch", Reading.created_date)
+    conditions = [
+        Reading.created_date >= date_from,
+        Reading.created_date <= date_to,
+        Reading.value.isnot(None),
+    ]
+    if sensor_ids is not None:
+        conditions.append(Reading.sensor_id.in_(sensor_ids))
+    if value_type_ids is not None:
+        conditions.append(Reading.value_type_id.in_(value_type_ids))
+
+    stmt = (
+        select(
+            Reading.sensor_id,
+            Reading.value_type_id,
+            func.count(Reading.value).label("count"),
+            func.min(Reading.value).label("min"),
+            func.max(Reading.value).label("max"),
+            func.avg(Reading.value).label("mean"),
+            func.stddev_samp(Reading.value).label("stddev"),
+            func.percentile_cont(array(percentiles)).within_group(Reading.value).label("percentiles"),
+            (func.regr_slope(Reading.value, epoch) * 3600).label("rate_per_hour"),
+            func.min(Reading.created_date).label("first_at"),
+            func.max(Reading.created_date).label("last_at"),
+        )
+        .where(and_(*conditions))
+        .group_by(Reading.sensor_id, Reading.value_type_id)
+        .order_by(Reading.sensor_id, Reading.value_type_id)
+    )
+    result = await session.execute(stmt)
+
+    labels = [percentile_label(p) for p in percentiles]
+    return [
+        {
+            "sensor_id": row.sensor_id,
+            "value_type_id": row.value_type_id,
+            "count": row.count,
+            "min": row.min,
+            "max": row.max,
+            "mean": row.mean,
+            "stddev": row.stddev,
+            "percentiles": dict(zip(labels, row.percentiles or ())),
+            "rate_per_hour": row.rate_per_hour,
+            "first_at": row.first_at,
+            "last_at": row.last_at,
+        }
+        for row in result
+    ]
@@ -0,0 +1,78 @@
+import asyncio
+import logging
+import time
+
+from sqlalchemy.future import select
+
+from database import async_session
+from models.monitoring import Device, Sensor, Door, Employee, Guest, KeyFob
+
+_logger = logging.getLogger(__name__)
+
+
+async def in_session(query, *args):
+    """
+    Runs `await query(session, *args)` on its own pooled connection, so several
+    of them can be gathered with asyncio instead of queued on one session.
+    """
+    async with async_session() as session:
+        return await query(session, *args)
+
+
+async def all_rows(session, model):
+    result = await session.execute(select(model))
+    return result.scalars().all()
+
+
+class MetadataSnapshot:
+    """
+    Cached copy of the mostly static tables shown by the overview endpoints.
+
+    Write endpoints call invalidate(), which bumps the version; the next get()
+    reloads all tables concurrently. max_age bounds how stale a copy can get
+    from writes made through other workers or directly in the database.
+    """
+
+    TABLES = {
+        "device": Device,
+        "sensor": Sensor,
+        "employee": Employee,
+        "guest": Guest,
+        "keyfob": KeyFob,
+        "door": Door,
+    }
+
+    def __init__(self, max_age=60):
+        self.max_age = max_age
+        self.version = 0
+        self._loaded_version = None
+        self._loaded_at = 0.0
+        self._tables = {}
+        self._lock = asyncio.Lock()
+        self.stats = {"hits": 0, "reloads": 0}
+
+    def invalidate(self):
+        self.version += 1
+
+    @property
+    def fresh(self):
+        return self._loaded_version == self.version and time.monotonic() - self._loaded_at < self.max_age
+
+    async def get(self):
+        if not self.fresh:
+            async with self._lock:
+                # Another request may have reloaded while we waited
+                if not self.fresh:
+                    await self._load()
+                    return self._tables
+        self.stats["hits"] += 1
+        return self._tables
+
+    async def _load(self):
+        version = self.version
+        names = list(self.TABLES)
+        results = await asyncio.gather(*(in_session(all_rows, self.TABLES[name]) for name in names))
+        self._tables = dict(zip(names, results))
+        self._loaded_version = version
+        self._loaded_at = time.monotonic()
+        self.stats["reloads"] += 1
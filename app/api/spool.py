@@ -0,0 +1,333 @@
+import fcntl
+import json
+import logging
+import math
+import mmap
+import os
+import struct
+import zlib
+from bisect import bisect_right
+from datetime import datetime
+
+_logger = logging.getLogger(__name__)
+
+RECORD_CRC = struct.Struct("<I")
+
+COMMITTED_FILE = "committed"
+LOCK_FILE = "lock"
+# Rows the database rejected, one JSON object per line
+DEAD_LETTER_FILE = "dead_letters.ndjson"
+
+
+def segment_name(first_offset):
+    return f"{first_offset:020d}.seg"
+
+
+class ReadingCodec:
+    # value_type_id, sensor_id, value (NaN for None), created_date as epoch seconds
+    body = struct.Struct("<IIdd")
+
+    def encode(self, row):
+        return self.body.pack(
+            row["value_type_id"],
+            row["sensor_id"],
+            math.nan if row["value"] is None else row["value"],
+            row["created_date"].timestamp(),
+        )
+
+    def decode(self, data):
+        value_type_id, sensor_id, value, created = self.body.unpack(data)
+        return {
+            "value_type_id": value_type_id,
+            "sensor_id": sensor_id,
+            "value": None if math.isnan(value) else value,
+            "created_date": datetime.fromtimestamp(created),
+        }
+
+
+class EntryLogCodec:
+    # sensor_id, key_fob_id (-1 for None), approved, date and created_date as epoch seconds
+    body = struct.Struct("<IiBdd")
+
+    def encode(self, row):
+        return self.body.pack(
+            row["sensor_id"],
+            -1 if row["key_fob_id"] is None else row["key_fob_id"],
+            row["approved"],
+            row["date"].timestamp(),
+            row["created_date"].timestamp(),
+        )
+
+    def decode(self, data):
+        sensor_id, key_fob_id, approved, date, created = self.body.unpack(data)
+        return {
+            "sensor_id": sensor_id,
+            "key_fob_id": None if key_fob_id < 0 else key_fob_id,
+            "approved": bool(approved),
+            "date": datetime.fromtimestamp(date),
+            "created_date": datetime.fromtimestamp(created),
+        }
+
+
+class AlarmCodec:
+    # sensor_id, value_type_id, raised, created_date as epoch seconds, message and severity as
+    # null padded utf-8 (cut at 64 and 16 bytes, the engine's texts are much shorter)
+    body = struct.Struct("<IIBd64s16s")
+
+    def encode(self, row):
+        return self.body.pack(
+            row["sensor_id"],
+            row["value_type_id"],
+            row["raised"],
+            row["created_date"].timestamp(),
+            row["message"].encode(),
+            row["severity"].encode(),
+        )
+
+    def decode(self, data):
+        sensor_id, value_type_id, raised, created, message, severity = self.body.unpack(data)
+        return {
+            "sensor_id": sensor_id,
+            "value_type_id": value_type_id,
+            "message": message.rstrip(b"\0").decode(errors="ignore"),
+            "severity": severity.rstrip(b"\0").decode(errors="ignore"),
+            "raised": bool(raised),
+            "created_date": datetime.fromtimestamp(created),
+        }
+
+
+class Spool:
+    """
+    Append-only log of rows on local disk, split in segment files of fixed
+    size records (the codec's layout plus a crc32). Offsets count records
+    since the spool was created.
+
+    append() only writes to the tail segment, so it runs at disk speed no
+    matter what the database is doing. The writer reads from the committed
+    offset through mmap and calls commit() once the rows are in the database,
+    which also removes segments that are fully committed. After a crash the
+    rows past the committed offset are read again, so delivery is
+    at-least-once.
+    """
+
+    def __init__(self, directory, codec=None, segment_records=65536, fsync=False):
+        self.directory = directory
+        self.codec = codec or ReadingCodec()
+        self.record_size = self.codec.body.size + RECORD_CRC.size
+        self.segment_records = segment_records
+        self.fsync = fsync
+        os.makedirs(directory, exist_ok=True)
+
+        self.stats = {"appended": 0, "committed_records": 0, "corrupt_records": 0, "segments_removed": 0, "recovered": 0}
+        self._segments = sorted(
+            int(name[:-4]) for name in os.listdir(directory) if name.endswith(".seg")
+        )
+        self.committed = self._read_committed()
+        self._file = None
+        self._lock_fd = None
+        # Set by claim(), used to find spools left behind by other workers
+        self._base_directory = None
+        self._kwargs = {}
+        self._open_tail()
+        self.stats["recovered"] = self.pending
+        if self.pending:
+            _logger.warning(f"Spool {directory} has {self.pending} rows to replay from offset {self.committed}")
+
+    @staticmethod
+    def _try_lock(directory):
+        fd = os.open(os.path.join(directory, LOCK_FILE), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return None
+        return fd
+
+    @classmethod
+    def claim(cls, base_directory, **kwargs):
+        """
+        Opens the first spool below base_directory that no other process holds.
+        Each gunicorn worker gets its own spool, and a restarted worker picks up
+        the spool (and backlog) a previous one left behind.
+        """
+        index = 0
+        while True:
+            directory = os.path.join(base_directory, str(index))
+            os.makedirs(directory, exist_ok=True)
+            fd = cls._try_lock(directory)
+            if fd is None:
+                index += 1
+                continue
+            spool = cls(directory, **kwargs)
+            # Held until the process exits
+            spool._lock_fd = fd
+            spool._base_directory = base_directory
+            spool._kwargs = kwargs
+            return spool
+
+    def claim_orphans(self):
+        """
+        Locks the other spools below the same base directory that no process
+        holds but still have rows to replay, e.g. after WORKERS was lowered.
+        The caller drains them and then calls release().
+        """
+        if self._base_directory is None:
+            return []
+        orphans = []
+        for name in sorted(os.listdir(self._base_directory)):
+            directory = os.path.join(self._base_directory, name)
+            if not name.isdigit() or directory == self.directory:
+                continue
+            fd = self._try_lock(directory)
+            if fd is None:
+                continue
+            spool = type(self)(directory, **self._kwargs)
+            spool._lock_fd = fd
+            if spool.pending:
+                orphans.append(spool)
+            else:
+                spool.release()
+        return orphans
+
+    # ------------------------------------------------------------------ files
+
+    def _path(self, first_offset):
+        return os.path.join(self.directory, segment_name(first_offset))
+
+    def _read_committed(self):
+        try:
+            with open(os.path.join(self.directory, COMMITTED_FILE)) as f:
+                committed = int(f.read().strip() or 0)
+        except FileNotFoundError:
+            committed = 0
+        if self._segments:
+            committed = max(committed, self._segments[0])
+        return committed
+
+    def _open_tail(self):
+        if not self._segments:
+            self._segments.append(self.committed)
+        tail = self._segments[-1]
+        path = self._path(tail)
+        size = os.path.getsize(path) if os.path.exists(path) else 0
+        if size % self.record_size:
+            # Torn write from a crash, drop the partial record
+            _logger.warning(f"Truncating partial record at the end of {path}")
+            size -= size % self.record_size
+            os.truncate(path, size)
+        self._tail_records = size // self.record_size
+        self.next_offset = tail + self._tail_records
+        self.committed = min(self.committed, self.next_offset)
+        self._file = open(path, "ab")
+
+    def _rotate(self):
+        self._file.close()
+        self._segments.append(self.next_offset)
+        self._tail_records = 0
+        self._file = open(self._path(self.next_offset), "ab")
+
+    # ------------------------------------------------------------- log access
+
+    @property
+    def pending(self):
+        return self.next_offset - self.committed
+
+    def append(self, row):
+        if self._tail_records >= self.segment_records:
+            self._rotate()
+        body = self.codec.encode(row)
+        self._file.write(body + RECORD_CRC.pack(zlib.crc32(body)))
+        # Hand it to the OS right away so a crashed process doesn't lose it
+        self._file.flush()
+        self._tail_records += 1
+        self.next_offset += 1
+        self.stats["appended"] += 1
+
+    def sync(self):
+        """
+        fsyncs the tail segment when the spool should survive power loss too.
+        """
+        if self.fsync:
+            os.fsync(self._file.fileno())
+
+    def read(self, offset, limit):
+        """
+        Returns (rows, end_offset) for up to limit records from offset.
+        Corrupt records are skipped but still counted in end_offset.
+        """
+        rows = []
+        size = self.record_size
+        body_size = self.codec.body.size
+        end = min(self.next_offset, offset + limit)
+        while offset < end:
+            index = bisect_right(self._segments, offset) - 1
+            first = self._segments[index]
+            stop = min(end, self._segments[index + 1] if index + 1 < len(self._segments) else self.next_offset)
+            with open(self._path(first), "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as view:
+                for position in range((offset - first) * size, (stop - first) * size, size):
+                    body = view[position:position + body_size]
+                    if RECORD_CRC.unpack_from(view, position + body_size)[0] != zlib.crc32(body):
+                        self.stats["corrupt_records"] += 1
+                    else:
+                        rows.append(self.codec.decode(body))
+            offset = stop
+        return rows, end
+
+    def commit(self, offset):
+        """
+        Marks everything before offset as written and removes the segments
+        that only hold committed records.
+        """
+        path = os.path.join(self.directory, COMMITTED_FILE)
+        with open(path + ".tmp", "w") as f:
+            f.write(str(offset))
+            if self.fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(path + ".tmp", path)
+        self.stats["committed_records"] += offset - self.committed
+        self.committed = offset
+
+        # The tail segment is kept, it is still being appended to
+        while len(self._segments) > 1 and self._segments[1] <= offset:
+            os.remove(self._path(self._segments.pop(0)))
+            self.stats["segments_removed"] += 1
+
+    def open(self):
+        if self._file is None:
+            self._open_tail()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def release(self):
+        """
+        Closes the spool and gives up its lock, so another process can claim it.
+        """
+        self.close()
+        if self._lock_fd is not None:
+            os.close(self._lock_fd)
+            self._lock_fd = None
+
+    def dead_letter(self, row, error):
+        """
+        Keeps a row the database rejected next to the spool, so it can be
+        looked at and replayed by hand once the cause is fixed.
+        """
+        with open(os.path.join(self.directory, DEAD_LETTER_FILE), "a") as f:
+            f.write(json.dumps({"row": row, "error": error}, default=str) + "\n")
+            if self.fsync:
+                f.flush()
+                os.fsync(f.fileno())
+
+    def snapshot(self):
+        return {
+            **self.stats,
+            "directory": self.directory,
+            "pending": self.pending,
+            "committed": self.committed,
+            "next_offset": self.next_offset,
+            "segments": len(self._segments),
+        }
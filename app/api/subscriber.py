@@ -1,60 +1,79 @@
-import re
+import time
+# Start of the import phase reported by /ready
+_import_started = time.perf_counter()
 
+import asyncio
 import logging
 
-from fastapi import FastAPI
+from fastapi import FastAPI, Request, WebSocket, WebSocketDisconnect
 from fastapi_mqtt import FastMQTT, MQTTConfig
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse, StreamingResponse
 
 from models.monitoring import (Base,Device, Sensor, Door, Reading, ValueType,
     Alarm, Employee, Guest, KeyFob, EntryLog)
 
 from schema.monitoring_schema import DeviceSchema, SensorSchema,SensorSchemaWithoutDoor ,DoorSchema, KeyFobSchema,GuestSchema,EmployeeSchema
 
-from database import engine, async_session
+from config import load_config
+from database import engine, async_session, pool_stats, warm_pool
+from readiness import Readiness
+from dedup import Deduplicator
+from ingest import ReadingBuffer, EntryLogBuffer, AlarmBuffer
+from spool import Spool, EntryLogCodec, AlarmCodec
+from response_cache import ResponseCache
+from live import LiveBroadcaster, parse_filter
+from log_setup import setup_logging, logging_stats
+from access_cache import AccessCache
+from migrations import lock_schema, run_migrations
+from partitions import PartitionMaintainer, ensure_partitions
+import rollups
+import sensor_stats
+from alarms import AlarmEngine, Threshold, parse_sensor_thresholds
+from router import TopicRouter, TopicMessage
+from work_queue import PriorityWorkQueue, Lane
+from ingest_role import IngestRole
+from pagination import fetch_page, paginate, select_columns, ndjson_response, MAX_PAGE_SIZE
+from snapshot import MetadataSnapshot, in_session, all_rows
+from metrics import (registry, HTTPMetricsMiddleware, DB_COMMIT_SECONDS, PARSE_SECONDS,
+    ACCESS_DECISION_SECONDS, DB_WRITE_SECONDS, PUBLISH_REPLY_SECONDS, DOOR_ACCESS_SECONDS, MQTT_DUPLICATES)
+from payloads import decode_telemetry, has_device_timestamp, parse_payload_keycard, parse_payload_pin
 from datetime import date
 
 
-from sqlalchemy import desc, func,and_,cast,Float
+from sqlalchemy import func,and_
 from datetime import datetime, timedelta
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, HTTPException, Query, status
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 from sqlalchemy.orm import selectinload
 from fastapi.middleware.cors import CORSMiddleware
 
 import os
-from dotenv import load_dotenv
 
-# Load environment variables from the .env file
-def load_env_file(file_path: str):
-    dotenv_path = os.path.join(os.path.dirname(__file__), '..', 'configFiles', file_path)
-    load_dotenv(dotenv_path)
-
-# Load environment variables from the .control.env file
-load_env_file('.control.env')
+# Loads every file in configFiles, once (see config.py)
+load_config()
 
 # Define your variables with default values
 Max_temp = int(os.getenv("Max_temp", 0))
 Min_temp = int(os.getenv("Min_temp", 0))
 Max_humid = int(os.getenv("Max_humid", 0))
 Min_humid = int(os.getenv("Min_humid", 0))
-
-# Load environment variables from the .env file
-load_env_file('.env')
+Hysteresis_temp = float(os.getenv("Hysteresis_temp", 0))
+Hysteresis_humid = float(os.getenv("Hysteresis_humid", 0))
+Sensor_thresholds = os.getenv("Sensor_thresholds", "")
 
 DEBUG = os.getenv("Debug_mode", False)
 
-# Load environment variables from the mqtt.env file
-load_env_file('mqtt.env')
-
-
-#Add the base logging config 
-logging.basicConfig(filename='/home/sysadmin/code/iot_case_h5/app/logs/application.log',  # log to a file named 'app.log'
-                    filemode='a',  # append to the log file if it exists, otherwise create it
-                    level=logging.INFO,
-                    format='%(asctime)s - %(levelname)s - %(message)s',
-                    datefmt='%Y-%m-%d %H:%M:%S')
+# Log records are queued and written by a background thread, see log_setup.py
+setup_logging(
+    os.getenv("LOG_FILE", "/home/sysadmin/code/iot_case_h5/app/logs/application.log"),
+    level=os.getenv("LOG_LEVEL", "INFO"),
+    format=os.getenv("LOG_FORMAT", "json"),
+    queue_size=int(os.getenv("LOG_QUEUE_SIZE", 10000)),
+    rate=float(os.getenv("LOG_TOPIC_RATE", 1)),
+    burst=int(os.getenv("LOG_TOPIC_BURST", 10)),
+    sample=int(os.getenv("LOG_TOPIC_SAMPLE", 100)),
+)
 
 #get the logger with the newly set config
 _logger = logging.getLogger(__name__)
@@ -70,15 +89,57 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+app.add_middleware(HTTPMetricsMiddleware)
+
+async def warm_access_cache():
+    try:
+        await access_cache.load()
+    except Exception:
+        # Lookups fall back to the database until the next reload
+        _logger.exception("Could not warm the access cache")
+
+
 @app.on_event("startup")
 async def startup_event():
-    async with engine.begin() as conn:
-        if DEBUG is True:
-            # Drop all tables (make sure this is what you want!)
-            await conn.run_sync(Base.metadata.drop_all)
-            # Create all tables
-            await conn.run_sync(Base.metadata.create_all)
-        return
+    # MQTT connects in parallel, but connect() only subscribes once the worker is warm
+    with readiness.phase("schema"):
+        async with engine.begin() as conn:
+            # Every gunicorn worker runs this, one at a time
+            await conn.run_sync(lock_schema)
+            if DEBUG is True:
+                # Drop all tables (make sure this is what you want!)
+                await conn.run_sync(Base.metadata.drop_all)
+                # Create all tables
+                await conn.run_sync(Base.metadata.create_all)
+            await conn.run_sync(run_migrations)
+            # create_all only makes the partitioned parents, the monthly tables are made here
+            await conn.run_sync(ensure_partitions, partition_maintainer.months_ahead)
+
+    with readiness.phase("warm_up"):
+        await asyncio.gather(warm_access_cache(), warm_pool(int(os.getenv("DB_WARM_CONNECTIONS", 2))))
+
+    access_cache.start()
+    reading_buffer.start()
+    alarm_buffer.start()
+    entry_log_buffer.start()
+    work_queue.start()
+    partition_maintainer.start()
+    readiness.warm = True
+    if ingest_role.is_ingesting:
+        subscribe_devices()
+    ingest_role.start(on_elected=subscribe_devices)
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    # Finish queued messages, then write out readings still waiting in the buffer
+    await work_queue.stop()
+    await reading_buffer.stop()
+    await alarm_buffer.stop()
+    await entry_log_buffer.stop()
+    access_cache.stop()
+    partition_maintainer.stop()
+    ingest_role.stop()
 
 
 # Dependency to get the async session
@@ -105,191 +166,326 @@ mqtt = FastMQTT(config=mqtt_config)
 
 mqtt.init_app(app)
 
+# Rendered responses of the polled read endpoints
+response_cache = ResponseCache(
+    max_entries=int(os.getenv("RESPONSE_CACHE_SIZE", 256)),
+    ttl=float(os.getenv("RESPONSE_CACHE_TTL", 5)),
+)
+
+# Keycard and pin attempts, written after the door got its reply
+entry_log_buffer = EntryLogBuffer(
+    max_batch_size=int(os.getenv("ENTRY_LOG_BATCH_SIZE", 200)),
+    max_latency=float(os.getenv("ENTRY_LOG_MAX_LATENCY", 0.2)),
+    max_pending=int(os.getenv("INGEST_MAX_PENDING", 50000)),
+    # fsynced once per batch, so the audit trail also survives a power loss
+    spool=Spool.claim(
+        os.path.join(os.getenv("SPOOL_DIR"), "entry_logs"),
+        codec=EntryLogCodec(),
+        fsync=os.getenv("ENTRY_LOG_FSYNC", "True").lower() in ("1", "true", "yes"),
+    ) if os.getenv("SPOOL_DIR") else None,
+    on_written=lambda rows: response_cache.invalidate("entry_logs"),
+)
+
+# New readings, alarms and entry logs pushed to /live and /live/sse
+live = LiveBroadcaster(max_queue=int(os.getenv("LIVE_MAX_QUEUE", 256)))
+
+# Readings are written in batches instead of one transaction per message
+reading_buffer = ReadingBuffer(
+    max_batch_size=int(os.getenv("INGEST_BATCH_SIZE", 500)),
+    max_latency=float(os.getenv("INGEST_MAX_LATENCY", 0.5)),
+    max_pending=int(os.getenv("INGEST_MAX_PENDING", 50000)),
+    # Readings go through a local on-disk log when SPOOL_DIR is set
+    spool=Spool.claim(
+        os.getenv("SPOOL_DIR"),
+        segment_records=int(os.getenv("SPOOL_SEGMENT_RECORDS", 65536)),
+        fsync=os.getenv("SPOOL_FSYNC", "False").lower() in ("1", "true", "yes"),
+    ) if os.getenv("SPOOL_DIR") else None,
+    on_written=lambda rows: response_cache.invalidate("readings"),
+)
+
+# Alarm transitions, written in batches behind the readings
+alarm_buffer = AlarmBuffer(
+    max_batch_size=int(os.getenv("ALARM_BATCH_SIZE", 100)),
+    max_latency=float(os.getenv("ALARM_MAX_LATENCY", 0.5)),
+    max_pending=int(os.getenv("INGEST_MAX_PENDING", 50000)),
+    # Spooled like the readings, so a transition the engine already made survives a database outage
+    spool=Spool.claim(
+        os.path.join(os.getenv("SPOOL_DIR"), "alarms"),
+        codec=AlarmCodec(),
+        fsync=os.getenv("SPOOL_FSYNC", "False").lower() in ("1", "true", "yes"),
+    ) if os.getenv("SPOOL_DIR") else None,
+    on_written=lambda rows: response_cache.invalidate("alarms"),
+)
+
+# Devices, sensors, doors, employees, guests and keyfobs for the overview endpoints
+metadata_snapshot = MetadataSnapshot(max_age=int(os.getenv("SNAPSHOT_MAX_AGE", 60)))
+
+# Keyfobs and door codes used by handle_keycard / handle_pin
+access_cache = AccessCache(
+    refresh_interval=int(os.getenv("ACCESS_CACHE_REFRESH", 300)),
+    negative_ttl=float(os.getenv("ACCESS_CACHE_NEGATIVE_TTL", 30)),
+)
+
+# Alarms are only written when a sensor crosses into or out of its range
+alarm_engine = AlarmEngine(
+    thresholds={
+        1: Threshold(Min_temp, Max_temp, Hysteresis_temp),
+        2: Threshold(Min_humid, Max_humid, Hysteresis_humid),
+    },
+    labels={1: "Temp", 2: "humid"},
+    sensor_thresholds=parse_sensor_thresholds(Sensor_thresholds, {1: Hysteresis_temp, 2: Hysteresis_humid}),
+)
+
+# Messages are handled by a pool of workers, door access before telemetry
+work_queue = PriorityWorkQueue(
+    lanes=[
+        # Never dropped, the MQTT callback waits when this lane is full
+        Lane("access", maxsize=int(os.getenv("QUEUE_ACCESS_SIZE", 1000)), drop_oldest=False),
+        Lane("telemetry", maxsize=int(os.getenv("QUEUE_TELEMETRY_SIZE", 10000)), drop_oldest=True),
+    ],
+    workers=int(os.getenv("QUEUE_WORKERS", 4)),
+    failure_log_every=int(os.getenv("QUEUE_FAILURE_LOG_EVERY", 100)),
+)
+
+# Numbers the components already keep, read when /metrics is scraped
+registry.callback("ingest_rows_pending", "Readings waiting in the ingest buffer",
+    lambda: reading_buffer.snapshot()["rows_pending"])
+registry.callback("ingest_rows_written_total", "Readings written by the ingest buffer",
+    lambda: reading_buffer.stats["rows_written"], type="counter")
+registry.callback("entry_log_rows_pending", "Entry logs waiting for their batch write",
+    lambda: entry_log_buffer.snapshot()["rows_pending"])
+registry.callback("work_queue_depth", "Messages waiting per work queue lane",
+    lambda: {(name,): lane["depth"] for name, lane in work_queue.snapshot()["lanes"].items()}, ["lane"])
+registry.callback("work_queue_dropped_total", "Messages dropped because the lane was full",
+    lambda: {(name,): lane["dropped"] for name, lane in work_queue.snapshot()["lanes"].items()}, ["lane"], type="counter")
+registry.callback("access_cache_lookups_total", "Access cache lookups by result",
+    lambda: {("hit",): access_cache.stats["hits"], ("miss",): access_cache.stats["misses"]}, ["result"], type="counter")
+registry.callback("live_subscribers", "Clients connected to /live and /live/sse",
+    lambda: live.snapshot()["subscribers"])
+registry.callback("live_dropped_subscribers_total", "Live clients dropped for falling behind",
+    lambda: live.stats["dropped_subscribers"], type="counter")
+registry.callback("db_pool_checked_out", "Database connections currently checked out",
+    lambda: pool_stats()["checked_out"])
+
+# Creates next months' partitions and drops the ones past retention
+partition_maintainer = PartitionMaintainer(
+    engine,
+    months_ahead=int(os.getenv("PARTITION_MONTHS_AHEAD", 3)),
+    retention_months={
+        "readings": int(os.getenv("RETENTION_READINGS_MONTHS", 0)),
+        "alarms": int(os.getenv("RETENTION_ALARMS_MONTHS", 0)),
+        "entry_logs": int(os.getenv("RETENTION_ENTRY_LOGS_MONTHS", 0)),
+    },
+    minute_rollup_days=int(os.getenv("RETENTION_MINUTE_ROLLUPS_DAYS", 0)),
+    interval=int(os.getenv("PARTITION_MAINTENANCE_INTERVAL", 6 * 3600)),
+)
+
+# Which workers subscribe to the device topics when gunicorn runs more than one
+ingest_role = IngestRole(
+    mode=os.getenv("INGEST_MODE", "single"),
+    share_group=os.getenv("SHARE_GROUP", "mqtt_api"),
+    lock_file=os.getenv("LEADER_LOCK_FILE", "/tmp/mqtt_api_ingest.lock"),
+)
+
+# Redelivered and retried telemetry is dropped here, before any database work
+deduplicator = Deduplicator(
+    window=float(os.getenv("DEDUP_WINDOW", 5)),
+    max_entries=int(os.getenv("DEDUP_MAX_ENTRIES", 50000)),
+)
+
+# Startup phases and the /ready answer
+readiness = Readiness(started_at=_import_started)
+readiness.mark("import")
+
+
+def subscribe_devices():
+    # Not before startup warmed the caches, startup_event() calls this again when it has
+    if mqtt.client.is_connected and readiness.warm:
+        mqtt.client.subscribe(ingest_role.topic) # subscribing mqtt topic wildcard- multi-level
+        readiness.subscribed = True
+        readiness.is_ready(ingest_role.is_ingesting)
+
+
 @mqtt.on_connect()
 def connect(client, flags, rc, properties):
-    mqtt.client.subscribe("/mqtt/#") # subscribing mqtt topic wildcard- multi-level
-    print("connected: ", client, flags, rc, properties)
+    # Workers that don't ingest (leader mode) stay connected for publishing only
+    if ingest_role.is_ingesting:
+        subscribe_devices()
+    _logger.info("MQTT connected", extra={"flags": flags, "rc": rc})
 
 @mqtt.on_message()
 async def message(client, topic, payload, qos, properties):
-    async def extract_temp_humidity(payload):
-        pattern = r"T: (\d+), H: (\d+)"
-        match = re.match(pattern, payload)
-        if not match:
-            raise ValueError("Invalid temperature/humidity format")
-        temperature = int(match.group(1))
-        humidity = int(match.group(2))
-        return temperature, humidity
-    
-    async def create_alarm(sensor_id, message, severity,is_acknowledged=False):
-        async with async_session() as session:
-            alarm = Alarm(sensor_id = sensor_id, message=message,severity=severity, is_acknowledged=is_acknowledged)
-            session.add(alarm)
-            await session.commit()
-
-
-    async def store_readings(temperature, humidity, device_id, sensor_id):
-        temp_reading = Reading(value_type_id=1, sensor_id=int(sensor_id), value=str(temperature))
-        humid_reading = Reading(value_type_id=2, sensor_id=int(sensor_id), value=str(humidity))
-
-        if int(temp_reading.value) > Max_temp or int(temp_reading.value) < Min_temp:
-            await create_alarm(sensor_id = int(sensor_id), message="Temp outside normal fuction",severity="warning", is_acknowledged=False )
-        if int(humid_reading.value) > Max_humid or int(humid_reading.value) < Min_humid:
-            await create_alarm(sensor_id = int(sensor_id), message="humid outside normal fuction",severity="warning", is_acknowledged=False )
-
-        async with async_session() as session:
-            session.add_all([temp_reading, humid_reading])
-            await session.commit()
-
-    async def parse_payload_keycard(payload):
-        
-        return_address = re.findall(r'(?<=\+).+', payload)
-        keycard_code = re.findall(r'!(.*?)\+', payload)
-        if return_address:
-            return return_address,keycard_code[0]
-        return None,None
-    
-    async def verify_keyfob_access(sensor_id,keycard_code):
-        """
-        Verifies that the keyfob exists and matches the door's access code.
-        """
-        async with async_session() as session:
-            stmt = select(KeyFob).where(KeyFob.key == keycard_code)
-            result = await session.execute(stmt)
-            keyfob = result.scalars().all()
-            if not keyfob:
-                _logger.warning(f"Error with {keyfob}")
-                return None , False  # Error   
-            keyfob = keyfob[0]
-            _logger.warning(f"keyfob found: {keyfob}")
-
-
-            if keyfob and keyfob.key == keycard_code and keyfob.is_active: 
-                return keyfob.id, True # Access granted
-            elif keyfob:
-                return keyfob.id, False # Access Denied
+    # Not the payload, keycard and pin messages carry the codes
+    _logger.debug("MQTT message", extra={"topic": topic, "payload_bytes": len(payload)})
+    route, topic_message = router.resolve(topic, payload, properties)
+    if route is not None:
+        # Access messages always get an answer, a door retrying after a lost reply waits for one
+        if route.lane != "access" and deduplicator.is_duplicate(
+                topic, payload, properties, now=topic_message.received_at, timestamped=has_device_timestamp(payload)):
+            MQTT_DUPLICATES.labels(route.kind).inc()
+            _logger.debug("Duplicate MQTT message dropped", extra={"topic": topic})
+            return
+        await work_queue.put(route.lane, route.handler, topic_message)
+
+
+@mqtt.on_subscribe()
+def subscribe(client, mid, qos, properties):
+    _logger.info("MQTT subscribed", extra={"mid": mid, "qos": qos})
+
 
+# ------------------------------------------------------------ MQTT handlers
+
+router = TopicRouter()
+
+
+def publish_reply(return_address, response_payload, properties):
+    with PUBLISH_REPLY_SECONDS.time():
+        mqtt.client.publish(message_or_topic = return_address, payload = response_payload, qos=0,properties=properties)
+
+
+async def store_readings(temperature, humidity, device_id, sensor_id, created_date=None):
+    # Handed to the ingest buffer first, written in the next batch
+    now = datetime.now()
+    # Trust the sensor's clock for buffered samples, but never for a time in the future
+    created_date = min(created_date, now) if created_date else now
+    reading_buffer.add(value_type_id=1, sensor_id=int(sensor_id), value=temperature, created_date=created_date)
+    reading_buffer.add(value_type_id=2, sensor_id=int(sensor_id), value=humidity, created_date=created_date)
+    live.publish("reading", int(sensor_id), temperature=temperature, humidity=humidity, created_date=created_date)
+
+    for value_type_id, value in ((1, temperature), (2, humidity)):
+        transition = alarm_engine.evaluate(int(sensor_id), value_type_id, value)
+        if transition is not None:
+            # Queued like the readings, the handler never waits for the database
+            alarm_buffer.add(int(sensor_id), value_type_id, transition.message, transition.severity, transition.raised,
+                created_date=created_date)
+            live.publish("alarm", int(sensor_id), message=transition.message, severity=transition.severity,
+                raised=transition.raised, created_date=created_date)
+
+
+async def verify_keyfob_access(sensor_id,keycard_code):
+    """
+    Verifies that the keyfob exists, is active and has not expired.
+    """
+    keyfob = await access_cache.get_keyfob(keycard_code)
+    if keyfob is None:
+        _logger.info("Unknown keyfob", extra={"sensor_id": sensor_id})
         return None , False  # Error
-        
-    async def handle_keycard(payload, sensor_id):
-        """
-        Handles the keycard payload.
-        """
-        return_address,keycard_code = await parse_payload_keycard(payload)
-        _logger.warning(f"return_address :: {return_address}")
+    _logger.debug("Keyfob found", extra={"sensor_id": sensor_id, "keyfob_id": keyfob.id})
+
+    if keyfob.allows_entry():
+        return keyfob.id, True # Access granted
+    return keyfob.id, False # Access Denied
+
+
+async def known_door_sensor(message, return_address):
+    """
+    Entry logs reference the sensor, so an attempt on a topic with a sensor id
+    that doesn't exist is denied without an entry log.
+    """
+    if message.sensor_id.isdigit() and await access_cache.has_sensor(int(message.sensor_id)):
+        return True
+    reply_to_door(message, return_address, b'0')
+    _logger.warning("Access attempt on an unknown sensor, denied", extra={"topic": message.topic})
+    return False
+
+
+def record_entry_log(sensor_id, approved, key_fob_id=None):
+    """
+    Queues the entry log of a keycard or pin attempt, written in the next
+    entry log batch. With a spool it is on disk before this returns.
+    """
+    live.publish("entry_log", int(sensor_id), key_fob_id=key_fob_id, approved=bool(approved),
+        method="pin" if key_fob_id is None else "keycard")
+    entry_log_buffer.add(int(sensor_id), bool(approved), key_fob_id=key_fob_id)
+
 
-        if return_address is not None and keycard_code is not None:
+def reply_to_door(message, return_address, response_payload):
+    publish_reply(return_address, response_payload, message.properties)
+    DOOR_ACCESS_SECONDS.labels(message.kind).observe(time.perf_counter() - message.received_at)
 
+
+async def verify_pin(sensor_id,pincode):
+    """
+    Verifies that the pin matches the access code of the sensor's door.
+    """
+    # Assuming each sensor is associated with one door
+    access_code = await access_cache.get_access_code(int(sensor_id))
+    if access_code is not None and access_code == pincode:
+        return True
+
+    return False  # Access denied
+
+
+# Temperature and Humidity Example
+@router.route("temperature")
+async def handle_temperature(message: TopicMessage):
+    try:
+        # Text, batched text or binary, see payloads.py
+        with PARSE_SECONDS.time():
+            samples = decode_telemetry(message.payload)
+    except ValueError as e:
+        # There is no one to answer over MQTT, the device keeps sending whatever it sends,
+        # so this is rate limited per topic by the log filter
+        _logger.warning(f"Ignoring telemetry that can't be parsed: {e}", extra={"topic": message.topic})
+        return
+    for temperature, humidity, created_date in samples:
+        await store_readings(temperature, humidity, message.device_id, message.sensor_id, created_date)
+
+
+# Doors Keycard Example
+@router.route("keycard", lane="access")
+async def handle_keycard(message: TopicMessage):
+    """
+    Handles the keycard payload.
+    """
+    sensor_id = message.sensor_id
+    with PARSE_SECONDS.time():
+        return_address,keycard_code = parse_payload_keycard(message.payload.decode())
+    _logger.debug("Keycard request", extra={"topic": message.topic, "return_address": return_address})
+
+    if return_address is not None and keycard_code is not None:
+        if not await known_door_sensor(message, return_address):
+            return
+
+        with ACCESS_DECISION_SECONDS.time():
             keyfob_id,access_granted = await verify_keyfob_access(sensor_id,keycard_code)
-            if not keyfob_id and not access_granted: 
-                response_payload = b'0'
-                mqtt.client.publish(message_or_topic = return_address[0], payload = response_payload, qos=0,properties=properties)
-                _logger.error("keyfob_id not found")
-                return
-
-            # Create entry log only if access is granted
-            await create_entry_log_keyfob(sensor_id,keyfob_id,access_granted)
-
-                
-            response_payload = b'1' if access_granted else b'0'
-            mqtt.client.publish(message_or_topic = return_address[0], payload = response_payload, qos=0,properties=properties)
-
-
-
-
-    async def create_entry_log_keyfob(sensor_id, key_fob_id, approved):
-        """
-        Creates an entry log with the given sensor ID and access method (keycard or pin).
-        """
-        async with async_session() as session:
-            entry_log = EntryLog(
-                sensor_id=int(sensor_id), 
-                key_fob_id=int(key_fob_id), 
-                date=datetime.utcnow(), 
-                approved=bool(approved)
-            )
-            session.add(entry_log)
-            await session.commit()
-
-    async def create_entry_log_pin(sensor_id, approved):
-        """
-        Creates an entry log with the given sensor ID and access method (keycard or pin).
-        """
-        async with async_session() as session:
-            entry_log = EntryLog(
-                sensor_id=int(sensor_id), 
-                date=datetime.utcnow(), 
-                approved=bool(approved)
-            )
-            session.add(entry_log)
-            await session.commit()
-
-
-    async def parse_payload_pin(payload):
-        
-        return_address = re.findall(r'(?<=\+).+', payload)
-        keycard_code = re.findall(r'!(.*?)\+', payload)
-        if return_address:
-            return return_address,keycard_code[0]
-        return None,None
-    
-    async def verify_pin(sensor_id,pincode):
-        """
-        Verifies that the keyfob exists and matches the door's access code.
-        """
-        async with async_session() as session:
-            # Assuming each sensor is associated with one door
-            _logger.warning(f"sensor_id to qury : {sensor_id}")
-            stmt = select(Sensor).where(Sensor.id == int(sensor_id)).options(selectinload(Sensor.door))
-            result = await session.execute(stmt)
-            sensor = result.scalars().all()
-            sensor : Sensor = sensor[0]
-
-            if sensor and sensor.door.access_code == pincode:
-                return True
-
-        return False  # Access denied
-    
-    async def handle_pin(payload, sensor_id):
-        """
-        Handles the keycard payload.
-        """
-        return_address,pin_code = await parse_payload_pin(payload)
-        _logger.warning(f"return_address :: {return_address}, pin_code {pin_code}")
-
-        if return_address is not None and pin_code is not None:
-            access_granted = await verify_pin(sensor_id,pin_code)
-            await create_entry_log_pin(sensor_id,access_granted)
-                
-            response_payload = b'1' if access_granted else b'0'
-            mqtt.client.publish(message_or_topic = return_address[0], payload = response_payload, qos=0,properties=properties)
+        if not keyfob_id and not access_granted: 
+            reply_to_door(message, return_address, b'0')
+            _logger.info("Keycard denied, keyfob not found", extra={"topic": message.topic})
+            return
 
+        # Only the append to the entry log spool happens before the reply,
+        # the database write follows in the next batch
+        with DB_WRITE_SECONDS.time():
+            record_entry_log(sensor_id, access_granted, key_fob_id=int(keyfob_id))
 
-    parts = topic.split("/")
-    payload_decoded = payload.decode()
-    _logger.warning(f"parts : {parts}, payload_load {payload_decoded}")
+        response_payload = b'1' if access_granted else b'0'
+        reply_to_door(message, return_address, response_payload)
 
-    # Temperature and Humidity Example
-    if parts[-1] == "temperature":
-        try:
-            temperature, humidity = await extract_temp_humidity(payload_decoded)
-            await store_readings(temperature, humidity, parts[-3], parts[-2])
-        except ValueError as e:
-            raise HTTPException(status_code=400, detail=str(e))
-
-    # Doors Keycard Example
-    elif parts[-1] == "keycard":
-        await handle_keycard(payload_decoded, parts[-2])
-
-    # Doors Pin Example
-    elif parts[-1] == "pin":
-        await handle_pin(payload_decoded, parts[-2])
-        
 
+# Doors Pin Example
+@router.route("pin", lane="access")
+async def handle_pin(message: TopicMessage):
+    """
+    Handles the pin payload.
+    """
+    sensor_id = message.sensor_id
+    with PARSE_SECONDS.time():
+        return_address,pin_code = parse_payload_pin(message.payload.decode())
+    # The pin itself is never logged
+    _logger.debug("Pin request", extra={"topic": message.topic, "return_address": return_address})
+
+    if return_address is not None and pin_code is not None:
+        if not await known_door_sensor(message, return_address):
+            return
 
-@mqtt.on_subscribe()
-def subscribe(client, mid, qos, properties):
-    print("subscribed", client, mid, qos, properties)
+        with ACCESS_DECISION_SECONDS.time():
+            access_granted = await verify_pin(sensor_id,pin_code)
+        with DB_WRITE_SECONDS.time():
+            record_entry_log(sensor_id, access_granted)
+
+        response_payload = b'1' if access_granted else b'0'
+        reply_to_door(message, return_address, response_payload)
 
 
 # ------------------------------------------------------------ HTTP
@@ -348,8 +544,8 @@ async def create_sample_data(session: AsyncSession = Depends(get_session)):
         sample_sensor4 = Sensor(name="Door key card", device=sample_device3, door=sample_door2)
 
         # Create sample readings
-        temp_reading = Reading(value_type=temp_value_type, sensor=sample_sensor, value="22")
-        humidity_reading = Reading(value_type=humidity_value_type, sensor=sample_sensor, value="45")
+        temp_reading = Reading(value_type=temp_value_type, sensor=sample_sensor, value=22)
+        humidity_reading = Reading(value_type=humidity_value_type, sensor=sample_sensor, value=45)
 
         # Create sample alarm
         sample_alarm = Alarm(sensor=sample_sensor, message="High temperature!", severity="High", is_acknowledged=False)
@@ -375,6 +571,9 @@ async def create_sample_data(session: AsyncSession = Depends(get_session)):
             sample_key_fob_employee,sample_key_fob_guest, sample_entry_log,sample_sensor2,sample_device2,sample_sensor3,sample_sensor4
         ])
         await session.commit()
+        await access_cache.load()
+        metadata_snapshot.invalidate()
+        response_cache.invalidate()
 
         return {"message": "Sample data created successfully"}
 
@@ -384,47 +583,233 @@ async def create_sample_data(session: AsyncSession = Depends(get_session)):
 
 
 @app.get("/get_all")
-async def get_all(session: AsyncSession = Depends(get_session)):
-
-    reading = await session.execute(select(Reading))
-    alarm = await session.execute(select(Alarm))
-    device = await session.execute(select(Device))
-    sensor = await session.execute(select(Sensor))
-    employee = await session.execute(select(Employee))
-    entry_log = await session.execute(select(EntryLog))
-    valuetype = await session.execute(select(ValueType))
-    guest = await session.execute(select(Guest))
-    keyfob = await session.execute(select(KeyFob))
-    door = await session.execute(select(Door))
+async def get_all(limit : int = Query(1000, gt=0, le=MAX_PAGE_SIZE), reading_cursor : str = None, alarm_cursor : str = None, entry_log_cursor : str = None,
+                  format : str = "json"):
+    """
+    readings, alarms and entry logs are paged newest first, limit rows each,
+    pass back the cursors from next_cursor to get the next page.
+    format=ndjson streams every row of every table instead.
+    """
+    if format == "ndjson":
+        return ndjson_response([
+            (name, select_columns(model))
+            for name, model in (("reading", Reading), ("alarm", Alarm), ("device", Device), ("sensor", Sensor),
+                                ("employee", Employee), ("entry_log", EntryLog), ("valuetype", ValueType),
+                                ("guest", Guest), ("keyfob", KeyFob), ("door", Door))
+        ])
+
+    # Each query runs on its own pooled connection, latency is the slowest one instead of the sum
+    (reading, next_reading), (alarm, next_alarm), (entry_log, next_entry_log), valuetype, basic = await asyncio.gather(
+        in_session(fetch_page, select(Reading), Reading, reading_cursor, limit),
+        in_session(fetch_page, select(Alarm), Alarm, alarm_cursor, limit),
+        in_session(fetch_page, select(EntryLog), EntryLog, entry_log_cursor, limit),
+        in_session(all_rows, ValueType),
+        metadata_snapshot.get(),
+    )
 
     return {
-        "reading" : reading.scalars().all(),
-        "alarm" : alarm.scalars().all(),
-        "device" : device.scalars().all(),
-        "sensor" : sensor.scalars().all(),
-        "employee" : employee.scalars().all(),
-        "entry_log" : entry_log.scalars().all(),
-        "valuetype" : valuetype.scalars().all(),
-        "guest" : guest.scalars().all(),
-        "keyfob" : keyfob.scalars().all(),
-        "door" : door.scalars().all(),
+        "reading" : reading,
+        "alarm" : alarm,
+        "device" : basic["device"],
+        "sensor" : basic["sensor"],
+        "employee" : basic["employee"],
+        "entry_log" : entry_log,
+        "valuetype" : valuetype,
+        "guest" : basic["guest"],
+        "keyfob" : basic["keyfob"],
+        "door" : basic["door"],
+        "next_cursor" : {
+            "reading" : next_reading,
+            "alarm" : next_alarm,
+            "entry_log" : next_entry_log,
+        },
     }
 
 
+@app.get("/ingest_stats")
+async def ingest_stats():
+    return {**reading_buffer.snapshot(), "entry_logs": entry_log_buffer.snapshot(), "alarms": alarm_buffer.snapshot()}
+
+
+@app.get("/partition_stats")
+async def partition_stats():
+    return partition_maintainer.stats
+
+
+@app.websocket("/live")
+async def live_websocket(websocket: WebSocket, kinds : str = None, sensors : str = None):
+    """
+    Pushes events as JSON text frames, filtered with e.g. ?kinds=reading,alarm&sensors=1,2.
+    """
+    try:
+        kind_set, sensor_set = parse_filter(kinds, sensors)
+    except ValueError as e:
+        await websocket.close(code=1008, reason=str(e))
+        return
+    await websocket.accept()
+    if not ingest_role.is_ingesting:
+        # Events are only published by the worker that ingests, 1013 makes the
+        # client reconnect until it lands on that one
+        live.stats["refused"] += 1
+        await websocket.close(code=1013, reason="Not the ingesting worker, try again")
+        return
+    subscriber = live.subscribe(kind_set, sensor_set)
+    # Waits for the client as well as the queue, otherwise a client that goes
+    # away under a quiet filter is never noticed and never unsubscribed
+    receive = asyncio.create_task(websocket.receive())
+    next_event = asyncio.create_task(subscriber.next())
+    try:
+        while True:
+            done, _ = await asyncio.wait((receive, next_event), return_when=asyncio.FIRST_COMPLETED)
+            if receive in done:
+                if receive.result()["type"] == "websocket.disconnect":
+                    break
+                # Clients aren't expected to send anything, it is ignored
+                receive = asyncio.create_task(websocket.receive())
+            if next_event in done:
+                event = next_event.result()
+                if event is None:
+                    # Fell behind, 1013 tells the client to try again
+                    await websocket.close(code=1013, reason="Too slow, dropped")
+                    break
+                await websocket.send_text(event)
+                next_event = asyncio.create_task(subscriber.next())
+    except WebSocketDisconnect:
+        pass
+    finally:
+        receive.cancel()
+        next_event.cancel()
+        live.unsubscribe(subscriber)
+
+
+@app.get("/live/sse")
+async def live_sse(kinds : str = None, sensors : str = None):
+    """
+    Same events as /live as Server-Sent Events, for clients without WebSockets.
+    """
+    try:
+        kind_set, sensor_set = parse_filter(kinds, sensors)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not ingest_role.is_ingesting:
+        # Same as /live, the client retries after Retry-After (a browser EventSource gives up on
+        # a non-200 reply, so it has to be recreated from its onerror)
+        live.stats["refused"] += 1
+        raise HTTPException(status_code=503, detail="Not the ingesting worker, try again", headers={"Retry-After": "1"})
+    subscriber = live.subscribe(kind_set, sensor_set)
+
+    async def events():
+        try:
+            while True:
+                try:
+                    event = await asyncio.wait_for(subscriber.next(), timeout=15)
+                except asyncio.TimeoutError:
+                    # Keeps proxies from closing an idle stream
+                    yield ": keepalive\n\n"
+                    continue
+                if event is None:
+                    yield "event: dropped\ndata: {}\n\n"
+                    return
+                yield f"data: {event}\n\n"
+        finally:
+            live.unsubscribe(subscriber)
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.get("/logging_stats")
+async def get_logging_stats():
+    return logging_stats()
+
+
+@app.get("/live_stats")
+async def live_stats():
+    return live.snapshot()
+
+
+@app.get("/response_cache_stats")
+async def response_cache_stats():
+    return response_cache.snapshot()
+
+
+@app.get("/access_cache_stats")
+async def access_cache_stats():
+    return access_cache.snapshot()
+
+
+@app.get("/alarm_state")
+async def alarm_state():
+    return alarm_engine.snapshot()
+
+
+@app.get("/dedup_stats")
+async def dedup_stats():
+    return deduplicator.snapshot()
+
+
+@app.get("/ready")
+async def ready(require_subscription : bool = True):
+    """
+    200 once this worker is warm and subscribed, 503 before. For nginx.
+    ?require_subscription=false only waits for the warm up, for systemd, so
+    a broker outage at boot doesn't fail the unit and the HTTP API with it.
+    """
+    state = readiness.snapshot(ingest_role.is_ingesting, require_subscription)
+    state["mqtt_connected"] = mqtt.client.is_connected
+    return JSONResponse(state, status_code=200 if state["ready"] else 503)
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/db_pool_stats")
+async def db_pool_stats():
+    return pool_stats()
+
+
+@app.get("/ingest_role")
+async def get_ingest_role():
+    return ingest_role.snapshot()
+
+
+@app.get("/queue_stats")
+async def queue_stats():
+    return {**work_queue.snapshot(), "router": router.stats}
+
+
 @app.get("/get_temp")
-async def get_temp(amount : int ,session: AsyncSession = Depends(get_session)):
-    reading = await session.execute(select(Reading).where(Reading.value_type_id == 1).options(selectinload(Reading.sensor)).options(selectinload(Reading.value_type)).order_by(desc(Reading.created_date)).fetch(amount))
-    
+async def get_temp(request: Request, amount : int = Query(gt=0, le=MAX_PAGE_SIZE), cursor : str = None, format : str = "json", session: AsyncSession = Depends(get_session)):
+    return await response_cache.respond(request, ("readings", "metadata"),
+        lambda: readings_page(1, amount, cursor, format, session))
+
+
+async def readings_page(value_type_id, amount, cursor, format, session):
+    """
+    Latest readings of one value type, amount per page, newest first.
+    format=ndjson streams the page as plain rows without the sensor and value type.
+    """
+    if format == "ndjson":
+        stmt = select_columns(Reading).where(Reading.value_type_id == value_type_id)
+        return ndjson_response([(None, paginate(stmt, Reading, cursor, amount, peek=False))])
+
+    stmt = select(Reading).where(Reading.value_type_id == value_type_id).options(selectinload(Reading.sensor)).options(selectinload(Reading.value_type))
+    reading, next_cursor = await fetch_page(session, stmt, Reading, cursor, amount)
     return {
-        "reading" : reading.scalars().all(),
+        "reading" : reading,
+        "next_cursor" : next_cursor,
     }
 
 @app.get("/get_temp_from_to")
 async def get_temp_from_to(date_from : date,date_to : date ,session: AsyncSession = Depends(get_session)):
-  
+    # Whole days always line up with the day rollups
+    avg_value, from_rollups = await rollups.average(session, 1, date_from, date_to)
+    if from_rollups:
+        return {"average": avg_value}
 
     result = await session.execute(
-        select(func.avg(cast(Reading.value, Float)).label('average'))
+        select(func.avg(Reading.value).label('average'))
         .where(and_(Reading.value_type_id == 1, Reading.created_date <= date_to, Reading.created_date >= date_from))
     )
     avg_value = result.scalar_one()
@@ -433,54 +818,141 @@ async def get_temp_from_to(date_from : date,date_to : date ,session: AsyncSessio
 
 @app.get("/get_temp_from_to_datetime")
 async def get_temp_from_to_datetime(date_from : datetime,date_to : datetime ,session: AsyncSession = Depends(get_session)):
+    avg_value, from_rollups = await rollups.average(session, 1, date_from, date_to)
+    if from_rollups:
+        return {"average": avg_value}
 
     result = await session.execute(
-        select(func.avg(cast(Reading.value, Float)).label('average'))
+        select(func.avg(Reading.value).label('average'))
         .where(and_(Reading.value_type_id == 1, Reading.created_date <= date_to, Reading.created_date >= date_from))
     )
     avg_value = result.scalar_one()
     return {"average": avg_value}
 
-@app.get("/get_humid")
-async def get_humid(amount : int ,session: AsyncSession = Depends(get_session)):
-    reading = await session.execute(select(Reading).where(Reading.value_type_id == 2).options(selectinload(Reading.sensor)).options(selectinload(Reading.value_type)).order_by(desc(Reading.created_date)).fetch(amount))
+@app.get("/get_series")
+async def get_series(sensor_id : int, value_type_id : int, date_from : datetime, date_to : datetime, resolution : str = "hour", session: AsyncSession = Depends(get_session)):
+    """
+    Downsampled series for one sensor, served from the reading rollups.
+    resolution is one of minute, hour or day.
+    """
+    if resolution not in rollups.RESOLUTIONS:
+        raise HTTPException(status_code=400, detail=f"resolution must be one of {', '.join(rollups.RESOLUTIONS)}")
+
     return {
-        "reading" : reading.scalars().all(),
+        "resolution" : resolution,
+        "series" : await rollups.series(session, sensor_id, value_type_id, date_from, date_to, resolution),
     }
 
+@app.get("/get_stats")
+async def get_stats(request: Request, date_from : datetime, date_to : datetime, sensor_ids : str = None, value_type_ids : str = None,
+                    percentiles : str = None, session: AsyncSession = Depends(get_session)):
+    """
+    Per sensor and value type statistics for a time window, for many sensors in one call.
+    sensor_ids and value_type_ids are comma separated (default all), percentiles
+    are fractions such as 0.5,0.95,0.99.
+    """
+    try:
+        sensors = sensor_stats.parse_ids(sensor_ids, "sensor_ids")
+        value_types = sensor_stats.parse_ids(value_type_ids, "value_type_ids")
+        fractions = sensor_stats.parse_percentiles(percentiles)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    async def build():
+        return {
+            "date_from" : date_from,
+            "date_to" : date_to,
+            "stats" : await sensor_stats.sensor_statistics(session, date_from, date_to, sensors, value_types, fractions),
+        }
+
+    return await response_cache.respond(request, ("readings",), build)
+
+@app.get("/export/{table}")
+async def export_table(table : str, date_from : datetime, date_to : datetime, sensor_ids : str = None, format : str = None):
+    """
+    Streams readings, entry_logs or alarms with created_date in [date_from, date_to)
+    as arrow (IPC stream), parquet or csv. Arrow is the default when pyarrow is installed.
+    """
+    # Not needed for ingest, imported on first use to keep startup short
+    import export
+    if table not in export.EXPORT_TABLES:
+        raise HTTPException(status_code=404, detail=f"table must be one of {', '.join(export.EXPORT_TABLES)}")
+    format = format or export.default_format()
+    if format not in export.available_formats():
+        raise HTTPException(status_code=400, detail=f"format must be one of {', '.join(export.available_formats())}")
+    try:
+        sensors = sensor_stats.parse_ids(sensor_ids, "sensor_ids")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    filename = export.export_filename(table, date_from, date_to, format)
+    return StreamingResponse(
+        export.export_chunks(table, date_from, date_to, sensors, format),
+        media_type=export.MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+@app.get("/get_humid")
+async def get_humid(request: Request, amount : int = Query(gt=0, le=MAX_PAGE_SIZE), cursor : str = None, format : str = "json", session: AsyncSession = Depends(get_session)):
+    return await response_cache.respond(request, ("readings", "metadata"),
+        lambda: readings_page(2, amount, cursor, format, session))
+
 @app.get("/get_entry_logs")
-async def get_entry_logs(amount : int,  approved:bool,session: AsyncSession = Depends(get_session)):
-    logs = await session.execute(select(EntryLog).where(EntryLog.approved == approved).options(selectinload(EntryLog.sensor)).order_by(desc(EntryLog.created_date)).fetch(amount))
-    
+async def get_entry_logs(request: Request, approved:bool, amount : int = Query(gt=0, le=MAX_PAGE_SIZE), cursor : str = None, format : str = "json", session: AsyncSession = Depends(get_session)):
+    return await response_cache.respond(request, ("entry_logs", "metadata"),
+        lambda: entry_logs_page(amount, approved, cursor, format, session))
+
+
+async def entry_logs_page(amount, approved, cursor, format, session):
+    if format == "ndjson":
+        stmt = select_columns(EntryLog).where(EntryLog.approved == approved)
+        return ndjson_response([(None, paginate(stmt, EntryLog, cursor, amount, peek=False))])
+
+    stmt = select(EntryLog).where(EntryLog.approved == approved).options(selectinload(EntryLog.sensor))
+    logs, next_cursor = await fetch_page(session, stmt, EntryLog, cursor, amount)
     return {
-        "logs" : logs.scalars().all(),
+        "logs" : logs,
+        "next_cursor" : next_cursor,
     }
 
 @app.get("/get_alarm")
-async def get_alarm(amount : int,  is_acknowledged:bool,session: AsyncSession = Depends(get_session)):
-    alarm = await session.execute(select(Alarm).where(Alarm.is_acknowledged == is_acknowledged).options(selectinload(Alarm.sensor)).order_by(desc(Alarm.created_date)).fetch(amount))
-    
+async def get_alarm(request: Request, is_acknowledged:bool, amount : int = Query(gt=0, le=MAX_PAGE_SIZE), cursor : str = None, cleared : bool = None, format : str = "json", session: AsyncSession = Depends(get_session)):
+    return await response_cache.respond(request, ("alarms", "metadata"),
+        lambda: alarms_page(amount, is_acknowledged, cursor, cleared, format, session))
+
+
+def alarm_filter(is_acknowledged, cleared):
+    condition = Alarm.is_acknowledged == is_acknowledged
+    # cleared=false: value still out of range, cleared=true: back to normal
+    if cleared is not None:
+        condition = and_(condition, Alarm.cleared_date.isnot(None) if cleared else Alarm.cleared_date.is_(None))
+    return condition
+
+
+async def alarms_page(amount, is_acknowledged, cursor, cleared, format, session):
+    if format == "ndjson":
+        stmt = select_columns(Alarm).where(alarm_filter(is_acknowledged, cleared))
+        return ndjson_response([(None, paginate(stmt, Alarm, cursor, amount, peek=False))])
+
+    stmt = select(Alarm).where(alarm_filter(is_acknowledged, cleared)).options(selectinload(Alarm.sensor))
+    alarm, next_cursor = await fetch_page(session, stmt, Alarm, cursor, amount)
     return {
-        "alarm" : alarm.scalars().all(),
+        "alarm" : alarm,
+        "next_cursor" : next_cursor,
     }
 
 
 @app.get("/get_all_basic")
-async def get_all_basic(session: AsyncSession = Depends(get_session)):
-    device = await session.execute(select(Device))
-    sensor = await session.execute(select(Sensor))
-    employee = await session.execute(select(Employee))
-    guest = await session.execute(select(Guest))
-    keyfob = await session.execute(select(KeyFob))
-    door = await session.execute(select(Door))
+async def get_all_basic():
+    basic = await metadata_snapshot.get()
 
     return {
-        "device" : device.scalars().all(),
-        "sensor" : sensor.scalars().all(),
-        "employee" : employee.scalars().all(),
-        "guest" : guest.scalars().all(),
-        "keyfob" : keyfob.scalars().all(),
-        "door" : door.scalars().all(),
+        "device" : basic["device"],
+        "sensor" : basic["sensor"],
+        "employee" : basic["employee"],
+        "guest" : basic["guest"],
+        "keyfob" : basic["keyfob"],
+        "door" : basic["door"],
     }
 
 # Define endpoint to create a device
@@ -490,6 +962,8 @@ async def create_device(device_data: DeviceSchema, session: AsyncSession = Depen
     device = Device(name=device_name)
     session.add(device)
     await session.commit()
+    metadata_snapshot.invalidate()
+    response_cache.invalidate("metadata")
     return device
 
 @app.post("/sensors/")
@@ -501,6 +975,9 @@ async def create_sensor(sensor: SensorSchema, session: AsyncSession = Depends(ge
     new_sensor = Sensor(name=sensor_name, device_id=device_id, door_id=door_id)
     session.add(new_sensor)
     await session.commit()
+    access_cache.put_sensor(new_sensor)
+    metadata_snapshot.invalidate()
+    response_cache.invalidate("metadata")
     return new_sensor
 
 @app.post("/doors/")
@@ -511,6 +988,9 @@ async def create_door(door: DoorSchema, session: AsyncSession = Depends(get_sess
     new_door = Door(name=door_name, access_code=access_code)
     session.add(new_door)
     await session.commit()
+    access_cache.put_door(new_door)
+    metadata_snapshot.invalidate()
+    response_cache.invalidate("metadata")
     return new_door
 
 @app.post("/sensors-without-door/")
@@ -521,6 +1001,9 @@ async def create_sensor_without_door(sensor: SensorSchemaWithoutDoor, session: A
     new_sensor = Sensor(name=sensor_name, device_id=device_id)
     session.add(new_sensor)
     await session.commit()
+    access_cache.put_sensor(new_sensor)
+    metadata_snapshot.invalidate()
+    response_cache.invalidate("metadata")
     return new_sensor
 
 
@@ -530,7 +1013,7 @@ async def create_employee(employee: EmployeeSchema, session: AsyncSession = Depe
     employee_name = employee_data.get("name")
     phonenumber = employee_data.get("phonenumber")
     key_fob_dict = employee_data.get("key_fob")
-    _logger.warning(f"key_fob_dict {key_fob_dict} , all {employee}")
+    _logger.debug("Creating employee", extra={"employee": employee_name})
 
     new_employee = Employee(name=employee_name, phonenumber=phonenumber)
     key_fob_employee = KeyFob(is_active=key_fob_dict['is_active'],key=key_fob_dict['key'])
@@ -541,6 +1024,9 @@ async def create_employee(employee: EmployeeSchema, session: AsyncSession = Depe
         new_employee,key_fob_employee
     ])
     await session.commit()
+    access_cache.put_keyfob(key_fob_employee)
+    metadata_snapshot.invalidate()
+    response_cache.invalidate("metadata")
     return {"message": "Employee created"}
 
 @app.post("/guests/")
@@ -559,6 +1045,9 @@ async def create_guest(guest: GuestSchema, session: AsyncSession = Depends(get_s
         new_guest,key_fob
     ])
     await session.commit()
+    access_cache.put_keyfob(key_fob)
+    metadata_snapshot.invalidate()
+    response_cache.invalidate("metadata")
     return {"message": "Guest created"}
 
 @app.post("/keyfobs/")
@@ -570,8 +1059,38 @@ async def create_keyfob(keyfob: KeyFobSchema, session: AsyncSession = Depends(ge
     new_keyfob = KeyFob(is_active=is_active, key=key, valid_until=valid_until)
     session.add(new_keyfob)
     await session.commit()
+    access_cache.put_keyfob(new_keyfob)
+    metadata_snapshot.invalidate()
+    response_cache.invalidate("metadata")
     return new_keyfob
 
+@app.post("/bulk/{kind}")
+async def bulk_create(kind : str, request: Request, format : str = None):
+    """
+    Creates many devices, sensors, doors, keyfobs, employees or guests from an
+    NDJSON or CSV upload (format=csv or a text/csv content type), one record
+    per line. Rows are validated with the same schemas as the single create
+    endpoints, invalid rows are listed with their line number and skipped.
+    CSV nests dotted columns, e.g. key_fob.key and key_fob.is_active.
+    """
+    # Imported on first use, like export
+    import provisioning
+    if kind not in provisioning.KINDS:
+        raise HTTPException(status_code=404, detail=f"kind must be one of {', '.join(provisioning.KINDS)}")
+    if format is None:
+        format = "csv" if request.headers.get("content-type", "").startswith("text/csv") else "ndjson"
+    if format not in ("csv", "ndjson"):
+        raise HTTPException(status_code=400, detail="format must be csv or ndjson")
+
+    result = await provisioning.bulk_load(kind, request.stream(), format)
+    if result["inserted"]:
+        # Doors, sensors and keyfobs are used by the access checks right away
+        await access_cache.load()
+        metadata_snapshot.invalidate()
+        response_cache.invalidate("metadata")
+    return result
+
+
 @app.put("/employees/{employee_id}/update-keyfob/")
 async def update_employee_keyfob(employee_id: int, key_fob_id: int, session: AsyncSession = Depends(get_session)):
     async with session.begin():
@@ -583,6 +1102,10 @@ async def update_employee_keyfob(employee_id: int, key_fob_id: int, session: Asy
         # Update the key_fob_id
         employee.key_fob_id = key_fob_id
 
+    # Re-read the fob on its next use
+    access_cache.invalidate_keyfob(key_fob_id)
+    metadata_snapshot.invalidate()
+    response_cache.invalidate("metadata")
     return employee
 
 
@@ -597,4 +1120,8 @@ async def update_guest_keyfob(guest_id: int, key_fob_id: int, session: AsyncSess
         # Update the key_fob_id
         guest.key_fob_id = key_fob_id
 
+    # Re-read the fob on its next use
+    access_cache.invalidate_keyfob(key_fob_id)
+    metadata_snapshot.invalidate()
+    response_cache.invalidate("metadata")
     return guest
\ No newline at end of file
@@ -0,0 +1,81 @@
+from alarms import AlarmEngine, Threshold, parse_sensor_thresholds
+
+TEMPERATURE = 1
+
+
+def engine(**kwargs):
+    return AlarmEngine({TEMPERATURE: Threshold(18, 26, hysteresis=1)}, {TEMPERATURE: "Temperature"}, **kwargs)
+
+
+def test_inside_the_range_raises_nothing():
+    alarms = engine()
+
+    assert alarms.evaluate(1, TEMPERATURE, 22) is None
+    assert alarms.stats["raised"] == 0
+
+
+def test_alarm_is_raised_once_while_outside():
+    alarms = engine()
+
+    raised = alarms.evaluate(1, TEMPERATURE, 27)
+
+    assert raised.raised and raised.severity == "warning"
+    assert alarms.evaluate(1, TEMPERATURE, 30) is None
+    assert alarms.evaluate(1, TEMPERATURE, 27) is None
+    assert alarms.stats["raised"] == 1
+
+
+def test_clears_only_past_the_hysteresis_band():
+    alarms = engine()
+    alarms.evaluate(1, TEMPERATURE, 27)
+
+    # Back inside [18, 26] but not inside [19, 25] yet
+    assert alarms.evaluate(1, TEMPERATURE, 25.5) is None
+    cleared = alarms.evaluate(1, TEMPERATURE, 25)
+
+    assert cleared is not None and not cleared.raised
+    assert alarms.snapshot()["active"] == []
+    # And it can be raised again afterwards
+    assert alarms.evaluate(1, TEMPERATURE, 17).raised
+
+
+def test_low_alarm_clears_on_the_low_band():
+    alarms = engine()
+    alarms.evaluate(1, TEMPERATURE, 17)
+
+    assert alarms.snapshot()["active"] == [{"sensor_id": 1, "value_type_id": TEMPERATURE, "direction": "low"}]
+    assert alarms.evaluate(1, TEMPERATURE, 18.5) is None
+    assert not alarms.evaluate(1, TEMPERATURE, 19).raised
+
+
+def test_sensors_have_separate_state():
+    alarms = engine()
+
+    assert alarms.evaluate(1, TEMPERATURE, 27).raised
+    assert alarms.evaluate(2, TEMPERATURE, 27).raised
+    assert alarms.evaluate(1, TEMPERATURE, 22) is not None
+    assert alarms.evaluate(2, TEMPERATURE, 30) is None
+
+
+def test_sensor_threshold_overrides_the_global_one():
+    alarms = engine(sensor_thresholds={(3, TEMPERATURE): Threshold(0, 10)})
+
+    assert alarms.evaluate(3, TEMPERATURE, 12).raised
+    assert alarms.evaluate(1, TEMPERATURE, 12).raised
+
+
+def test_unknown_value_type_and_missing_value_are_ignored():
+    alarms = engine()
+
+    assert alarms.evaluate(1, 99, 1000) is None
+    assert alarms.evaluate(1, TEMPERATURE, None) is None
+    assert alarms.stats["evaluated"] == 0
+
+
+def test_parse_sensor_thresholds_skips_invalid_entries():
+    thresholds = parse_sensor_thresholds("3:1:18:26, bad, 4:2:20:60", {1: 0.5})
+
+    assert thresholds == {
+        (3, 1): Threshold(18, 26, 0.5),
+        (4, 2): Threshold(20, 60, 0),
+    }
@@ -0,0 +1,103 @@
+from dedup import Deduplicator, message_id
+
+STEADY = b"T: 22, H: 45"
+TIMED = b"T: 22, H: 45 @1700000000"
+
+
+def test_steady_plain_text_is_kept():
+    dedup = Deduplicator(window=5)
+
+    kept = [dedup.is_duplicate("/mqtt/1/2/temperature", STEADY, now=t) for t in range(10)]
+
+    assert kept == [False] * 10
+    assert dedup.stats["repeats_kept"] == 9
+    assert dedup.stats["suppressed"] == 0
+
+
+def test_timestamped_repeat_within_window_is_dropped():
+    dedup = Deduplicator(window=5)
+
+    assert not dedup.is_duplicate("/t", TIMED, now=0, timestamped=True)
+    assert dedup.is_duplicate("/t", TIMED, now=4, timestamped=True)
+    assert dedup.stats["suppressed"] == 1
+
+
+def test_repeat_after_the_window_is_kept():
+    dedup = Deduplicator(window=5)
+
+    assert not dedup.is_duplicate("/t", TIMED, now=0, timestamped=True)
+    assert not dedup.is_duplicate("/t", TIMED, now=5, timestamped=True)
+    assert dedup.stats["expired"] == 1
+
+
+def test_window_runs_from_the_first_copy():
+    dedup = Deduplicator(window=5)
+
+    dedup.is_duplicate("/t", TIMED, now=0, timestamped=True)
+    assert dedup.is_duplicate("/t", TIMED, now=3, timestamped=True)
+    # The suppressed copy at 3 didn't extend the window
+    assert not dedup.is_duplicate("/t", TIMED, now=6, timestamped=True)
+
+
+def test_broker_redelivery_of_plain_text_is_dropped():
+    dedup = Deduplicator(window=5)
+
+    dedup.is_duplicate("/t", STEADY, now=0)
+
+    assert dedup.is_duplicate("/t", STEADY, {"dup": True}, now=1)
+    assert dedup.stats["flagged_dup"] == 1
+
+
+def test_redelivery_matches_the_latest_kept_repeat():
+    dedup = Deduplicator(window=5)
+
+    for t in range(5):
+        dedup.is_duplicate("/t", STEADY, now=t)
+
+    assert dedup.is_duplicate("/t", STEADY, {"dup": True}, now=8)
+
+
+def test_message_id_tells_messages_apart():
+    dedup = Deduplicator(window=5)
+    first = {"user_property": [("msg_id", "1")]}
+    second = {"user_property": [("msg_id", "2")]}
+
+    assert not dedup.is_duplicate("/t", STEADY, first, now=0)
+    assert not dedup.is_duplicate("/t", STEADY, second, now=1)
+    assert dedup.is_duplicate("/t", STEADY, first, now=2)
+
+
+def test_same_payload_on_another_topic_is_kept():
+    dedup = Deduplicator(window=5)
+
+    dedup.is_duplicate("/a", TIMED, now=0, timestamped=True)
+
+    assert not dedup.is_duplicate("/b", TIMED, now=1, timestamped=True)
+
+
+def test_full_index_evicts_the_oldest_key():
+    dedup = Deduplicator(window=60, max_entries=2)
+
+    for topic in ("/a", "/b", "/c"):
+        dedup.is_duplicate(topic, TIMED, now=0, timestamped=True)
+
+    assert dedup.snapshot()["entries"] == 2
+    assert dedup.stats["evicted"] == 1
+    # /a was evicted and is let through again, /c is still known
+    assert not dedup.is_duplicate("/a", TIMED, now=1, timestamped=True)
+    assert dedup.is_duplicate("/c", TIMED, now=1, timestamped=True)
+
+
+def test_zero_window_disables():
+    dedup = Deduplicator(window=0)
+
+    dedup.is_duplicate("/t", TIMED, now=0, timestamped=True)
+
+    assert not dedup.is_duplicate("/t", TIMED, now=0, timestamped=True)
+    assert dedup.snapshot()["entries"] == 0
+
+
+def test_message_id():
+    assert message_id(None) is None
+    assert message_id({"user_property": [("other", "x")]}) is None
+    assert message_id({"user_property": [("msg_id", "42")]}) == "42"
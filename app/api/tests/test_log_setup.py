@@ -0,0 +1,45 @@
+import logging
+
+from log_setup import TopicRateLimitFilter
+
+
+def record(level, topic="/mqtt/1/2/temperature"):
+    fields = {"name": "subscriber", "levelno": level, "msg": "Ignoring telemetry"}
+    if topic is not None:
+        fields["topic"] = topic
+    return logging.makeLogRecord(fields)
+
+
+def test_warnings_per_topic_are_limited_and_sampled():
+    rate_limit = TopicRateLimitFilter(rate=0.001, burst=2, sample=5)
+
+    kept = [rate_limit.filter(record(logging.WARNING)) for _ in range(12)]
+
+    # Burst of 2, then every 5th
+    assert kept == [True, True, False, False, False, False, True, False, False, False, False, True]
+    assert rate_limit.suppressed == 8
+
+
+def test_kept_record_counts_the_skipped_ones():
+    rate_limit = TopicRateLimitFilter(rate=0.001, burst=1, sample=3)
+    records = [record(logging.INFO) for _ in range(4)]
+
+    for r in records:
+        rate_limit.filter(r)
+
+    assert records[3].suppressed == 2
+
+
+def test_topics_have_their_own_bucket():
+    rate_limit = TopicRateLimitFilter(rate=0.001, burst=1, sample=0)
+
+    assert rate_limit.filter(record(logging.WARNING, "/mqtt/1/2/temperature"))
+    assert not rate_limit.filter(record(logging.WARNING, "/mqtt/1/2/temperature"))
+    assert rate_limit.filter(record(logging.WARNING, "/mqtt/1/3/temperature"))
+
+
+def test_errors_and_records_without_topic_always_pass():
+    rate_limit = TopicRateLimitFilter(rate=0.001, burst=0, sample=0)
+
+    assert rate_limit.filter(record(logging.ERROR))
+    assert rate_limit.filter(record(logging.WARNING, topic=None))
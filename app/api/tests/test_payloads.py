@@ -0,0 +1,94 @@
+import struct
+from datetime import datetime
+
+import pytest
+
+from payloads import (
+    BINARY_HEADER,
+    BINARY_MAGIC,
+    decode_telemetry,
+    encode_binary_telemetry,
+    extract_temp_humidity,
+    has_device_timestamp,
+    parse_access_payload,
+)
+
+
+def test_plain_text():
+    assert decode_telemetry(b"T: 22, H: 45") == [(22, 45, None)]
+    assert extract_temp_humidity("T: 22.5, H: 45") == (22.5, 45)
+
+
+def test_text_batch_with_timestamps():
+    samples = decode_telemetry(b"T: 22.5, H: 45 @1700000000; T: 22.6, H: 44 @1700000060")
+
+    assert samples == [
+        (22.5, 45, datetime.fromtimestamp(1700000000)),
+        (22.6, 44, datetime.fromtimestamp(1700000060)),
+    ]
+
+
+@pytest.mark.parametrize("payload", [
+    b"T: inf, H: 45",
+    b"T: 22, H: nan",
+    b"T: 1e400, H: 45",
+    b"T: -inf, H: 45",
+    b"T: 22; H: 45",
+    b"X: 22, H: 45",
+    b"T: abc, H: 45",
+    b"T: 22, H: 45 @notatime",
+    b"\xff\xfe",
+])
+def test_invalid_text_is_rejected(payload):
+    with pytest.raises(ValueError):
+        decode_telemetry(payload)
+
+
+def test_binary_round_trip_without_timestamps():
+    payload = encode_binary_telemetry([(21.5, 40.25, None), (-3.1, 99.99, None)])
+
+    assert decode_telemetry(payload) == [(21.5, 40.25, None), (-3.1, 99.99, None)]
+
+
+def test_binary_round_trip_with_timestamps():
+    base = 1700000000
+    payload = encode_binary_telemetry([(21.5, 40, base), (21.6, 41, base + 60)], base_time=base)
+
+    assert decode_telemetry(payload) == [
+        (21.5, 40, datetime.fromtimestamp(base)),
+        (21.6, 41, datetime.fromtimestamp(base + 60)),
+    ]
+
+
+def test_binary_unknown_version_is_rejected():
+    payload = bytearray(encode_binary_telemetry([(21.5, 40, None)]))
+    payload[1] = 2
+
+    with pytest.raises(ValueError, match="version"):
+        decode_telemetry(bytes(payload))
+
+
+@pytest.mark.parametrize("payload", [
+    bytes((BINARY_MAGIC, 1)),
+    # Says two samples, carries one
+    BINARY_HEADER.pack(BINARY_MAGIC, 1, 0, 2) + struct.pack("<hH", 2150, 4000),
+    # One sample plus a stray byte
+    BINARY_HEADER.pack(BINARY_MAGIC, 1, 0, 1) + struct.pack("<hH", 2150, 4000) + b"\x00",
+    # Timestamp flag without the base time
+    BINARY_HEADER.pack(BINARY_MAGIC, 1, 1, 0) + b"\x00\x00",
+])
+def test_binary_length_mismatch_is_rejected(payload):
+    with pytest.raises(ValueError):
+        decode_telemetry(payload)
+
+
+def test_has_device_timestamp():
+    assert has_device_timestamp(b"T: 22, H: 45 @1700000000")
+    assert not has_device_timestamp(b"T: 22, H: 45")
+    assert has_device_timestamp(encode_binary_telemetry([(21.5, 40, 1700000000)], base_time=1700000000))
+    assert not has_device_timestamp(encode_binary_telemetry([(21.5, 40, None)]))
+
+
+def test_access_payload():
+    assert parse_access_payload("!1234+/door/3/reply") == ("/door/3/reply", "1234")
+    assert parse_access_payload("1234/door/3/reply") == (None, None)
@@ -0,0 +1,177 @@
+import asyncio
+import json
+
+import pytest
+
+pytest.importorskip("fastapi")
+
+from fastapi import Response
+from starlette.requests import Request
+
+import response_cache as response_cache_module
+from response_cache import ResponseCache
+
+
+class FakeTime:
+    now = 1000.0
+
+    @classmethod
+    def monotonic(cls):
+        return cls.now
+
+
+@pytest.fixture(autouse=True)
+def clock(monkeypatch):
+    FakeTime.now = 1000.0
+    monkeypatch.setattr(response_cache_module, "time", FakeTime)
+    return FakeTime
+
+
+def request(path="/get_temperature", query="amount=10", etag=None):
+    headers = [(b"if-none-match", etag.encode())] if etag else []
+    return Request({"type": "http", "method": "GET", "path": path, "query_string": query.encode(), "headers": headers})
+
+
+class Builder:
+    def __init__(self, on_build=None):
+        self.calls = 0
+        self.on_build = on_build
+
+    async def __call__(self):
+        self.calls += 1
+        if self.on_build:
+            self.on_build()
+        return {"build": self.calls}
+
+
+def respond(cache, build, tags=("readings",), **kwargs):
+    return asyncio.run(cache.respond(request(**kwargs), tags, build))
+
+
+def test_second_request_is_served_from_the_cache():
+    cache = ResponseCache()
+    build = Builder()
+
+    first = respond(cache, build)
+    second = respond(cache, build)
+
+    assert build.calls == 1
+    assert json.loads(second.body) == {"build": 1}
+    assert second.body == first.body
+    assert cache.stats["hits"] == 1
+    assert cache.stats["misses"] == 1
+
+
+def test_query_parameters_are_part_of_the_key():
+    cache = ResponseCache()
+    build = Builder()
+
+    respond(cache, build, query="amount=10")
+    respond(cache, build, query="amount=20")
+
+    assert build.calls == 2
+
+
+def test_invalidating_a_tag_makes_its_entries_stale():
+    cache = ResponseCache()
+    build = Builder()
+    respond(cache, build)
+
+    cache.invalidate("alarms")
+    respond(cache, build)
+    assert build.calls == 1
+
+    cache.invalidate("readings")
+    response = respond(cache, build)
+    assert build.calls == 2
+    assert json.loads(response.body) == {"build": 2}
+
+
+def test_write_during_build_leaves_the_entry_stale():
+    cache = ResponseCache()
+    # A write commits while the first build is querying
+    build = Builder(on_build=lambda: build.calls == 1 and cache.invalidate("readings"))
+
+    respond(cache, build)
+    respond(cache, build)
+    respond(cache, build)
+
+    assert build.calls == 2
+
+
+def test_entries_expire_after_the_ttl(clock):
+    cache = ResponseCache(ttl=5)
+    build = Builder()
+    respond(cache, build)
+
+    clock.now += 4.9
+    respond(cache, build)
+    assert build.calls == 1
+
+    clock.now += 0.2
+    respond(cache, build)
+    assert build.calls == 2
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = ResponseCache(max_entries=2)
+    build = Builder()
+
+    respond(cache, build, path="/a")
+    respond(cache, build, path="/b")
+    # /a is used again, so /b is the oldest when /c comes in
+    respond(cache, build, path="/a")
+    respond(cache, build, path="/c")
+    assert build.calls == 3
+    assert cache.stats["evictions"] == 1
+
+    respond(cache, build, path="/a")
+    assert build.calls == 3
+    respond(cache, build, path="/b")
+    assert build.calls == 4
+
+
+def test_matching_if_none_match_gets_an_empty_304():
+    cache = ResponseCache()
+    build = Builder()
+    first = respond(cache, build)
+    etag = first.headers["etag"]
+
+    not_modified = respond(cache, build, etag=etag)
+    changed = respond(cache, build, etag='"something else"')
+
+    assert first.status_code == 200
+    assert not_modified.status_code == 304
+    assert not_modified.body == b""
+    assert not_modified.headers["etag"] == etag
+    assert changed.status_code == 200
+    assert cache.stats["not_modified"] == 1
+
+
+def test_etag_follows_the_body():
+    cache = ResponseCache()
+    build = Builder()
+    first = respond(cache, build)
+
+    cache.invalidate("readings")
+    second = respond(cache, build)
+
+    assert first.headers["etag"] != second.headers["etag"]
+    # The client's copy is outdated, so it gets the new body
+    assert respond(cache, build, etag=first.headers["etag"]).status_code == 200
+
+
+def test_response_from_build_is_passed_through_uncached():
+    cache = ResponseCache()
+    calls = []
+
+    async def build():
+        calls.append(1)
+        return Response(content=b"{}\n", media_type="application/x-ndjson")
+
+    first = respond(cache, build)
+    respond(cache, build)
+
+    assert first.media_type == "application/x-ndjson"
+    assert len(calls) == 2
+    assert cache.snapshot()["entries"] == 0
@@ -0,0 +1,41 @@
+import pytest
+
+from router import TopicRouter, MAX_SENSOR_ID
+
+
+@pytest.fixture
+def router():
+    router = TopicRouter()
+
+    @router.route("temperature")
+    async def handle_temperature(message):
+        pass
+
+    return router
+
+
+def test_resolve_splits_the_topic(router):
+    route, message = router.resolve("/mqtt/4/12/temperature", b"T: 21, H: 40")
+
+    assert route.kind == "temperature"
+    assert route.lane == "telemetry"
+    assert (message.device_id, message.sensor_id, message.kind) == ("4", "12", "temperature")
+    assert router.stats["dispatched"] == 1
+
+
+def test_unknown_kind_is_unmatched(router):
+    assert router.resolve("/mqtt/4/12/pressure", b"") == (None, None)
+    assert router.stats["unmatched"] == 1
+
+
+@pytest.mark.parametrize("sensor_id", ["-1", "abc", "1.5", "", "²", str(MAX_SENSOR_ID + 1), str(2**32)])
+def test_invalid_sensor_id_is_rejected(router, sensor_id):
+    assert router.resolve(f"/mqtt/4/{sensor_id}/temperature", b"T: 21, H: 40") == (None, None)
+    assert router.stats["invalid_sensor"] == 1
+    assert router.stats["dispatched"] == 0
+
+
+def test_largest_sensor_id_is_accepted(router):
+    route, message = router.resolve(f"/mqtt/4/{MAX_SENSOR_ID}/temperature", b"")
+
+    assert message.sensor_id == str(MAX_SENSOR_ID)
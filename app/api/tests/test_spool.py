@@ -0,0 +1,190 @@
+import os
+from datetime import datetime
+
+import pytest
+
+from spool import Spool, EntryLogCodec, AlarmCodec, COMMITTED_FILE, DEAD_LETTER_FILE, segment_name
+
+
+def reading(n):
+    return {
+        "value_type_id": 1,
+        "sensor_id": n,
+        "value": n / 2,
+        "created_date": datetime(2024, 1, 1, 12, 0, n % 60),
+    }
+
+
+def test_read_returns_appended_rows_in_order(tmp_path):
+    spool = Spool(str(tmp_path))
+    for n in range(5):
+        spool.append(reading(n))
+
+    rows, end = spool.read(0, 10)
+
+    assert rows == [reading(n) for n in range(5)]
+    assert end == 5
+    assert spool.pending == 5
+
+
+def test_none_value_survives_the_round_trip(tmp_path):
+    spool = Spool(str(tmp_path))
+    spool.append(dict(reading(1), value=None))
+
+    rows, _ = spool.read(0, 1)
+
+    assert rows[0]["value"] is None
+
+
+def test_entry_log_codec(tmp_path):
+    spool = Spool(str(tmp_path), codec=EntryLogCodec())
+    row = {
+        "sensor_id": 3,
+        "key_fob_id": None,
+        "approved": True,
+        "date": datetime(2024, 1, 1, 8, 30),
+        "created_date": datetime(2024, 1, 1, 9, 30),
+    }
+    spool.append(row)
+
+    assert spool.read(0, 1)[0] == [row]
+
+
+def test_alarm_codec(tmp_path):
+    spool = Spool(str(tmp_path), codec=AlarmCodec())
+    row = {
+        "sensor_id": 3,
+        "value_type_id": 2,
+        "message": "humid outside normal fuction",
+        "severity": "warning",
+        "raised": True,
+        "created_date": datetime(2024, 1, 1, 9, 30),
+    }
+    spool.append(row)
+    spool.append(dict(row, message="x" * 100, raised=False))
+
+    rows, _ = spool.read(0, 2)
+
+    assert rows[0] == row
+    assert rows[1]["message"] == "x" * 64
+    assert rows[1]["raised"] is False
+
+
+def test_reopen_replays_from_committed(tmp_path):
+    spool = Spool(str(tmp_path))
+    for n in range(10):
+        spool.append(reading(n))
+    spool.commit(4)
+    spool.close()
+
+    reopened = Spool(str(tmp_path))
+
+    assert reopened.committed == 4
+    assert reopened.pending == 6
+    assert reopened.stats["recovered"] == 6
+    rows, end = reopened.read(reopened.committed, 100)
+    assert rows == [reading(n) for n in range(4, 10)]
+    assert end == 10
+
+
+def test_torn_write_is_truncated_on_open(tmp_path):
+    spool = Spool(str(tmp_path))
+    for n in range(3):
+        spool.append(reading(n))
+    spool.close()
+    path = os.path.join(str(tmp_path), segment_name(0))
+    with open(path, "ab") as f:
+        # Half a record, as left by a crash in the middle of append()
+        f.write(b"\x01" * (spool.record_size // 2))
+
+    reopened = Spool(str(tmp_path))
+
+    assert os.path.getsize(path) == 3 * spool.record_size
+    assert reopened.next_offset == 3
+    assert reopened.read(0, 10)[0] == [reading(n) for n in range(3)]
+    # Appends continue right after the last whole record
+    reopened.append(reading(3))
+    assert reopened.read(0, 10)[0] == [reading(n) for n in range(4)]
+
+
+def test_corrupt_record_is_skipped_but_counted_in_end(tmp_path):
+    spool = Spool(str(tmp_path))
+    for n in range(3):
+        spool.append(reading(n))
+    path = os.path.join(str(tmp_path), segment_name(0))
+    with open(path, "r+b") as f:
+        f.seek(spool.record_size + 1)
+        f.write(b"\xff")
+
+    rows, end = spool.read(0, 10)
+
+    assert rows == [reading(0), reading(2)]
+    assert end == 3
+    assert spool.stats["corrupt_records"] == 1
+
+
+def test_segments_rotate_and_committed_ones_are_removed(tmp_path):
+    spool = Spool(str(tmp_path), segment_records=4)
+    for n in range(10):
+        spool.append(reading(n))
+    assert sorted(os.listdir(str(tmp_path))) == [segment_name(0), segment_name(4), segment_name(8)]
+
+    # Reads cross segment boundaries
+    assert spool.read(2, 5)[0] == [reading(n) for n in range(2, 7)]
+
+    spool.commit(9)
+
+    assert segment_name(0) not in os.listdir(str(tmp_path))
+    assert segment_name(4) not in os.listdir(str(tmp_path))
+    assert spool.stats["segments_removed"] == 2
+    with open(os.path.join(str(tmp_path), COMMITTED_FILE)) as f:
+        assert f.read() == "9"
+    assert spool.read(9, 10)[0] == [reading(9)]
+
+
+def test_claim_gives_each_process_its_own_directory(tmp_path):
+    first = Spool.claim(str(tmp_path))
+    second = Spool.claim(str(tmp_path))
+
+    assert first.directory != second.directory
+    second.release()
+    # A released spool can be claimed again
+    assert Spool.claim(str(tmp_path)).directory == second.directory
+
+
+def test_claim_orphans_only_returns_unheld_spools_with_a_backlog(tmp_path):
+    own = Spool.claim(str(tmp_path))
+    left_behind = Spool.claim(str(tmp_path))
+    empty = Spool.claim(str(tmp_path))
+    held = Spool.claim(str(tmp_path))
+    left_behind.append(reading(1))
+    held.append(reading(2))
+    left_behind.release()
+    empty.release()
+
+    orphans = own.claim_orphans()
+
+    assert [orphan.directory for orphan in orphans] == [left_behind.directory]
+    assert orphans[0].read(0, 10)[0] == [reading(1)]
+    held.release()
+
+
+def test_dead_letter_appends_json_lines(tmp_path):
+    spool = Spool(str(tmp_path))
+
+    spool.dead_letter(reading(1), "violates foreign key")
+    spool.dead_letter(reading(2), "violates foreign key")
+
+    with open(os.path.join(str(tmp_path), DEAD_LETTER_FILE)) as f:
+        lines = f.read().splitlines()
+    assert len(lines) == 2
+    assert '"sensor_id": 2' in lines[1]
+
+
+@pytest.mark.parametrize("offset, limit, expected", [(0, 0, []), (3, 2, [3, 4]), (4, 10, [4])])
+def test_read_window(tmp_path, offset, limit, expected):
+    spool = Spool(str(tmp_path))
+    for n in range(5):
+        spool.append(reading(n))
+
+    assert spool.read(offset, limit)[0] == [reading(n) for n in expected]
@@ -0,0 +1,132 @@
+import asyncio
+import logging
+
+from router import TopicMessage
+from work_queue import Lane, PriorityWorkQueue
+
+
+def lanes(access_size=10, telemetry_size=10):
+    return [
+        Lane("access", maxsize=access_size, drop_oldest=False),
+        Lane("telemetry", maxsize=telemetry_size, drop_oldest=True),
+    ]
+
+
+def message(topic="/mqtt/1/2/temperature", payload=b"T: 21, H: 40"):
+    return TopicMessage(topic, "1", "2", topic.rsplit("/", 1)[-1], payload, None)
+
+
+def test_access_lane_is_served_first():
+    async def run():
+        handled = []
+
+        async def handler(item):
+            handled.append(item)
+
+        queue = PriorityWorkQueue(lanes(), workers=1)
+        for n in range(3):
+            await queue.put("telemetry", handler, f"telemetry {n}")
+        for n in range(2):
+            await queue.put("access", handler, f"access {n}")
+        queue.start()
+        await queue.stop()
+        return handled
+
+    assert asyncio.run(run()) == ["access 0", "access 1", "telemetry 0", "telemetry 1", "telemetry 2"]
+
+
+def test_full_telemetry_lane_drops_the_oldest():
+    async def run():
+        handled = []
+
+        async def handler(item):
+            handled.append(item)
+
+        queue = PriorityWorkQueue(lanes(telemetry_size=2), workers=1)
+        for n in range(5):
+            await queue.put("telemetry", handler, n)
+        queue.start()
+        await queue.stop()
+        return handled, queue.snapshot()["lanes"]["telemetry"]
+
+    handled, stats = asyncio.run(run())
+
+    assert handled == [3, 4]
+    assert stats["dropped"] == 3
+    assert stats["processed"] == 2
+
+
+def test_full_access_lane_makes_put_wait_instead_of_dropping():
+    async def run():
+        handled = []
+
+        async def handler(item):
+            handled.append(item)
+
+        queue = PriorityWorkQueue(lanes(access_size=1), workers=1)
+        await queue.put("access", handler, "first")
+        blocked = asyncio.create_task(queue.put("access", handler, "second"))
+        await asyncio.sleep(0.05)
+        waited = not blocked.done()
+
+        queue.start()
+        await asyncio.wait_for(blocked, timeout=1)
+        await queue.stop()
+        return waited, handled, queue.snapshot()["lanes"]["access"]
+
+    waited, handled, stats = asyncio.run(run())
+
+    assert waited
+    assert handled == ["first", "second"]
+    assert stats["dropped"] == 0
+
+
+def test_stop_drains_queued_and_running_items():
+    async def run():
+        handled = []
+
+        async def handler(item):
+            await asyncio.sleep(0.01)
+            handled.append(item)
+
+        queue = PriorityWorkQueue(lanes(), workers=2)
+        queue.start()
+        for n in range(10):
+            await queue.put("telemetry", handler, n)
+        await queue.stop()
+        return handled, queue.snapshot()
+
+    handled, snapshot = asyncio.run(run())
+
+    assert sorted(handled) == list(range(10))
+    assert snapshot["in_flight"] == 0
+    assert snapshot["lanes"]["telemetry"]["depth"] == 0
+
+
+def test_handler_failures_are_sampled_per_topic_without_the_payload(caplog):
+    async def run():
+        async def handler(item):
+            raise RuntimeError("database went away")
+
+        queue = PriorityWorkQueue(lanes(), workers=1, failure_log_every=3)
+        for _ in range(5):
+            await queue.put("telemetry", handler, message(payload=b"secret payload"))
+        await queue.put("telemetry", handler, message(topic="/mqtt/1/3/temperature"))
+        queue.start()
+        await queue.stop()
+        return queue.snapshot()["lanes"]["telemetry"]
+
+    with caplog.at_level(logging.ERROR, logger="work_queue"):
+        stats = asyncio.run(run())
+
+    failures = [record for record in caplog.records if record.getMessage() == "Handler failed"]
+    # 1st and 4th failure of the first topic, 1st of the second
+    assert [(record.topic, record.suppressed) for record in failures] == [
+        ("/mqtt/1/2/temperature", 0),
+        ("/mqtt/1/2/temperature", 2),
+        ("/mqtt/1/3/temperature", 0),
+    ]
+    assert all(record.lane == "telemetry" and record.kind == "temperature" for record in failures)
+    assert "secret payload" not in caplog.text
+    assert stats["failed"] == 6
+    assert stats["failures_not_logged"] == 3
@@ -0,0 +1,154 @@
+import asyncio
+import logging
+import time
+from collections import deque
+
+_logger = logging.getLogger(__name__)
+
+
+class Lane:
+    def __init__(self, name, maxsize, drop_oldest):
+        self.name = name
+        self.maxsize = maxsize
+        # When full: drop the oldest item (telemetry) or make put() wait (door access)
+        self.drop_oldest = drop_oldest
+        self.items = deque()
+        self.stats = {
+            "enqueued": 0,
+            "processed": 0,
+            "dropped": 0,
+            "failed": 0,
+            "failures_not_logged": 0,
+            "max_depth": 0,
+            "wait_seconds_total": 0.0,
+            "wait_seconds_max": 0.0,
+        }
+
+    @property
+    def full(self):
+        return len(self.items) >= self.maxsize
+
+
+class PriorityWorkQueue:
+    """
+    Bounded queue between the MQTT callback and the database, drained by a
+    pool of worker tasks. Lanes are served in the order they are given, so a
+    burst of telemetry never delays the door access events behind it.
+
+    Items are (handler, message) pairs, the worker runs `await handler(message)`.
+
+    A failing handler is logged with its traceback for the first failure of a
+    topic and then every failure_log_every-th one, so a device that keeps
+    sending something the handler chokes on doesn't flood the log. Only the
+    lane, topic and kind are logged, never the payload.
+    """
+
+    def __init__(self, lanes, workers=4, failure_log_every=100, max_failure_topics=10000):
+        self._lanes = {lane.name: lane for lane in lanes}
+        self._order = list(lanes)
+        self.workers = workers
+        self.failure_log_every = failure_log_every
+        self.max_failure_topics = max_failure_topics
+        # topic -> failures since the last logged one
+        self._failures = {}
+        self._cond = asyncio.Condition()
+        self._tasks = []
+        self._in_flight = 0
+
+    async def put(self, lane_name, handler, message):
+        lane = self._lanes[lane_name]
+        async with self._cond:
+            if lane.full and lane.drop_oldest:
+                lane.items.popleft()
+                lane.stats["dropped"] += 1
+            while lane.full:
+                # Backpressure for lanes that must not lose items
+                await self._cond.wait()
+
+            lane.items.append((time.perf_counter(), handler, message))
+            lane.stats["enqueued"] += 1
+            lane.stats["max_depth"] = max(lane.stats["max_depth"], len(lane.items))
+            self._cond.notify_all()
+
+    async def _next(self):
+        async with self._cond:
+            while True:
+                for lane in self._order:
+                    if lane.items:
+                        enqueued_at, handler, message = lane.items.popleft()
+                        self._in_flight += 1
+                        # Wake putters waiting for room
+                        self._cond.notify_all()
+                        return lane, enqueued_at, handler, message
+                await self._cond.wait()
+
+    async def _worker(self):
+        while True:
+            lane, enqueued_at, handler, message = await self._next()
+            waited = time.perf_counter() - enqueued_at
+            lane.stats["wait_seconds_total"] += waited
+            lane.stats["wait_seconds_max"] = max(lane.stats["wait_seconds_max"], waited)
+            try:
+                await handler(message)
+                lane.stats["processed"] += 1
+            except Exception:
+                lane.stats["failed"] += 1
+                self._log_failure(lane, message)
+            finally:
+                self._in_flight -= 1
+
+    def _log_failure(self, lane, message):
+        topic = getattr(message, "topic", None)
+        skipped = self._failures.get(topic)
+        if skipped is not None and skipped + 1 < self.failure_log_every:
+            self._failures[topic] = skipped + 1
+            lane.stats["failures_not_logged"] += 1
+            return
+        if skipped is None and len(self._failures) >= self.max_failure_topics:
+            self._failures.clear()
+        self._failures[topic] = 0
+        _logger.exception("Handler failed", extra={
+            "lane": lane.name,
+            "topic": topic,
+            "kind": getattr(message, "kind", None),
+            "suppressed": skipped or 0,
+        })
+
+    def start(self):
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self, timeout=10):
+        """
+        Waits (up to timeout seconds) for queued and running items, then stops the workers.
+        """
+        deadline = time.monotonic() + timeout
+        while (self._in_flight or any(lane.items for lane in self._order)) and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+        left = sum(len(lane.items) for lane in self._order)
+        if left:
+            _logger.error(f"Work queue stopped with {left} unprocessed messages")
+
+    def snapshot(self):
+        return {
+            "workers": self.workers,
+            "in_flight": self._in_flight,
+            "lanes": {
+                lane.name: {
+                    **lane.stats,
+                    "depth": len(lane.items),
+                    "maxsize": lane.maxsize,
+                    "wait_seconds_avg": (
+                        lane.stats["wait_seconds_total"] / (lane.stats["processed"] + lane.stats["failed"])
+                        if lane.stats["processed"] + lane.stats["failed"] else 0.0
+                    ),
+                }
+                for lane in self._order
+            },
+        }